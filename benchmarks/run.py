@@ -0,0 +1,243 @@
+"""Benchmark the pdfpop config/run pipeline on synthetic forms and data.
+
+Usage:
+    python benchmarks/run.py bench --pages 10 --fields 200 --rows 500 \
+        --output results.json
+    python benchmarks/run.py compare baseline.json results.json
+"""
+from typing import Any, Callable, Optional
+import contextlib
+import io
+import json
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+
+import click
+import pdfrw
+
+import pdfpop
+import pdfpop.commands
+import pdfpop.data
+import pdfpop.form_config
+import pdfpop.pdf
+import synthetic
+
+
+STAGES = ("config", "load", "interpret", "fill", "write")
+
+
+@click.group(context_settings=dict(help_option_names=["-h", "--help"]))
+def main() -> None:
+    """Benchmark the pdfpop config/run pipeline."""
+    pass
+
+
+@main.command()
+@click.option(
+    "--pages",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of form pages.",
+)
+@click.option(
+    "--fields",
+    type=click.IntRange(min=1),
+    default=50,
+    show_default=True,
+    help="Number of form fields, spread evenly over the pages.",
+)
+@click.option(
+    "--rows",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Number of data rows.",
+)
+@click.option(
+    "--mix",
+    default="text=4,checkbox=2,radio=1,combo=1,list=1",
+    show_default=True,
+    help="Relative weights of the field types.",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes for the end-to-end run.",
+)
+@click.option("--incremental", is_flag=True, help="Write incremental updates.")
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Seed of the random data values.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(path_type=pathlib.Path, dir_okay=False),
+    default=None,
+    help="JSON results path. [default: standard output]",
+)
+def bench(
+    pages: int,
+    fields: int,
+    rows: int,
+    mix: str,
+    jobs: int,
+    incremental: bool,
+    seed: int,
+    output: Optional[pathlib.Path],
+) -> None:
+    """Time each pipeline stage and the end-to-end run."""
+    parameters = {
+        "pages": pages,
+        "fields": fields,
+        "rows": rows,
+        "mix": synthetic.parse_mix(mix),
+        "jobs": jobs,
+        "incremental": incremental,
+        "seed": seed,
+    }
+    with tempfile.TemporaryDirectory(prefix="pdfpop-bench-") as tmp:
+        results = run_benchmark(pathlib.Path(tmp), **parameters)
+    text = json.dumps(results, indent=4)
+    if output is None:
+        click.echo(text)
+    else:
+        output.write_text(text + "\n")
+        click.echo(f'Saved benchmark results to "{output}".')
+
+
+@main.command()
+@click.argument(
+    "baseline", type=click.Path(path_type=pathlib.Path, exists=True)
+)
+@click.argument("result", type=click.Path(path_type=pathlib.Path, exists=True))
+def compare(baseline: pathlib.Path, result: pathlib.Path) -> None:
+    """Compare the stage times of two benchmark results."""
+    before = json.loads(baseline.read_text())
+    after = json.loads(result.read_text())
+    if before["parameters"] != after["parameters"]:
+        click.echo("Warning: the benchmarks used different parameters.")
+    click.echo(f"{'stage':<12}{'baseline':>12}{'result':>12}{'speedup':>10}")
+    for stage in (*STAGES, "end_to_end"):
+        old = before["stages"][stage]["seconds"]
+        new = after["stages"][stage]["seconds"]
+        speedup = old / new if new else float("inf")
+        click.echo(f"{stage:<12}{old:>12.4f}{new:>12.4f}{speedup:>9.2f}x")
+
+
+def run_benchmark(
+    work_dir: pathlib.Path,
+    pages: int,
+    fields: int,
+    rows: int,
+    mix: dict[str, int],
+    jobs: int,
+    incremental: bool,
+    seed: int,
+) -> dict[str, Any]:
+    """Generate the synthetic inputs in a directory and benchmark them."""
+    form_path = work_dir / "form.pdf"
+    data_path = work_dir / "data.csv"
+    config_path = work_dir / "config.json"
+    output_dir = work_dir / "output"
+    output_dir.mkdir()
+    names = synthetic.make_form(form_path, pages, fields, mix)
+    synthetic.make_data(data_path, names, rows, seed)
+    synthetic.make_config(config_path, form_path, output_dir, names)
+
+    stages = {}
+    stages["config"] = _timed(lambda: pdfpop.pdf.get_fields_info(form_path))
+
+    data = []
+    stages["load"] = _timed(
+        lambda: data.extend(pdfpop.data.read_rows(data_path))
+    )
+
+    form_cfg = pdfpop.form_config.FormConfig(config_path)
+    form_cfg.load()
+    values = []
+
+    def interpret() -> None:
+        compiled = pdfpop.form_config.CompiledConfig(form_cfg, data[0])
+        for row in data:
+            values.append(compiled.fields.evaluate(row, verbose=False))
+
+    stages["interpret"] = _timed(interpret)
+
+    template = pdfpop.pdf.FormTemplate(form_path)
+    fill_seconds, write_seconds = 0.0, 0.0
+    for idx, row_fields in enumerate(values):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if incremental:
+                populated = template.update(row_fields)
+            else:
+                populated = template.populate(row_fields)
+        fill_seconds += time.perf_counter() - start
+        output_path = output_dir / f"stage-{idx}.pdf"
+        start = time.perf_counter()
+        if incremental:
+            with output_path.open("wb") as f:
+                f.write(template.source)
+                f.write(populated)
+        else:
+            pdfrw.PdfWriter().write(output_path, populated)
+        write_seconds += time.perf_counter() - start
+    stages["fill"] = _stage(fill_seconds)
+    stages["write"] = _stage(write_seconds)
+
+    def end_to_end() -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pdfpop.commands.run(
+                config_path,
+                data_path,
+                jobs=jobs,
+                options=pdfpop.commands.OutputOptions(incremental=incremental),
+            )
+
+    stages["end_to_end"] = _timed(end_to_end)
+    for stage in stages.values():
+        stage["per_row"] = stage["seconds"] / rows
+    seconds = stages["end_to_end"]["seconds"]
+    return {
+        "pdfpop": pdfpop.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "pages": pages,
+            "fields": fields,
+            "rows": rows,
+            "mix": mix,
+            "jobs": jobs,
+            "incremental": incremental,
+            "seed": seed,
+        },
+        "form_bytes": form_path.stat().st_size,
+        "stages": stages,
+        "rows_per_second": rows / seconds if seconds else None,
+    }
+
+
+def _timed(function: Callable[[], Any]) -> dict[str, float]:
+    """Return the stage result of timing a function call."""
+    start = time.perf_counter()
+    function()
+    return _stage(time.perf_counter() - start)
+
+
+def _stage(seconds: float) -> dict[str, float]:
+    """Return the result of a stage that took the given time."""
+    return {"seconds": seconds}
+
+
+if __name__ == "__main__":
+    sys.exit(main())
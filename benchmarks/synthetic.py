@@ -0,0 +1,212 @@
+"""Synthetic forms, data files and configurations for pdfpop benchmarks."""
+from typing import Any
+import csv
+import json
+import pathlib
+import random
+
+import pdfrw
+
+
+FIELD_TYPES = ("text", "checkbox", "radio", "combo", "list")
+OPTIONS = ("Alpha", "Bravo", "Charlie", "Delta")
+PAGE_SIZE = (612, 792)
+FIELD_SIZE = (150, 14)
+FIELDS_PER_COLUMN = 40
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    """Parse a field type mix such as `text=3,checkbox=1` into weights."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in FIELD_TYPES:
+            raise RuntimeError(f"Unknown field type: {name}.")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+def field_types(count: int, mix: dict[str, int]) -> list[str]:
+    """Return `count` field types distributed according to the mix weights."""
+    cycle = [name for name, weight in mix.items() for _ in range(weight)]
+    return [cycle[idx % len(cycle)] for idx in range(count)]
+
+
+def make_form(
+    form_path: pathlib.Path, pages: int, fields: int, mix: dict[str, int]
+) -> dict[str, str]:
+    """Write an AcroForm PDF and return the type of each of its fields.
+
+    Fields are spread evenly over the pages and named `<type>_<n>`.
+    """
+    types = field_types(fields, mix)
+    names = {f"{ft}_{idx}": ft for idx, ft in enumerate(types)}
+    font = pdfrw.IndirectPdfDict(
+        Type=pdfrw.PdfName.Font,
+        Subtype=pdfrw.PdfName.Type1,
+        BaseFont=pdfrw.PdfName.Helvetica,
+    )
+    resources = pdfrw.PdfDict(Font=pdfrw.PdfDict(Helv=font))
+    writer = pdfrw.PdfWriter()
+    acro_fields = pdfrw.PdfArray()
+    items = list(names.items())
+    per_page = -(-len(items) // pages) if items else 0
+    for page_idx in range(pages):
+        page_items = items[page_idx * per_page : (page_idx + 1) * per_page]
+        contents = pdfrw.IndirectPdfDict()
+        contents.stream = (
+            f"BT /Helv 12 Tf 72 760 Td (Synthetic page {page_idx + 1}) Tj ET"
+        )
+        page = pdfrw.IndirectPdfDict(
+            Type=pdfrw.PdfName.Page,
+            MediaBox=pdfrw.PdfArray([0, 0, *PAGE_SIZE]),
+            Resources=resources,
+            Contents=contents,
+            Annots=pdfrw.PdfArray(),
+        )
+        for slot, (name, ft) in enumerate(page_items):
+            field, widgets = _make_field(name, ft, slot, page)
+            page.Annots.extend(widgets)
+            acro_fields.append(field)
+        writer.addpage(page)
+    writer.trailer.Root.AcroForm = pdfrw.IndirectPdfDict(
+        Fields=acro_fields,
+        DA=pdfrw.PdfString.encode("/Helv 0 Tf 0 g"),
+        DR=resources,
+    )
+    writer.write(form_path)
+    return names
+
+
+def make_data(
+    data_path: pathlib.Path,
+    names: dict[str, str],
+    rows: int,
+    seed: int = 0,
+) -> None:
+    """Write a CSV data file with one column per field."""
+    rng = random.Random(seed)
+    with data_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", *names])
+        for idx in range(rows):
+            writer.writerow(
+                [idx, *(_make_value(ft, rng) for ft in names.values())]
+            )
+
+
+def make_config(
+    config_path: pathlib.Path,
+    form_path: pathlib.Path,
+    output_dir: pathlib.Path,
+    names: dict[str, str],
+) -> None:
+    """Write a configuration that maps every field to its data column."""
+    fields = {}
+    for name, ft in names.items():
+        if ft == "list":
+            fields[f"{name} [{ft}]"] = f"data['{name}'].split(';')"
+        else:
+            fields[f"{name} [{ft}]"] = name
+    data: dict[str, Any] = {
+        "io": {
+            "form": repr(str(form_path)),
+            "output_dir": repr(str(output_dir)),
+            "output_name": "'row-' + data['id'] + '.pdf'",
+        },
+        "fields": fields,
+    }
+    with config_path.open("w") as f:
+        json.dump(data, f, indent=4)
+
+
+def _make_field(
+    name: str, ft: str, slot: int, page: pdfrw.PdfDict
+) -> tuple[pdfrw.PdfDict, list[pdfrw.PdfDict]]:
+    """Return a field and its widget annotations."""
+    column, row = divmod(slot, FIELDS_PER_COLUMN)
+    x = 72 + column * (FIELD_SIZE[0] + 20)
+    y = PAGE_SIZE[1] - 100 - row * (FIELD_SIZE[1] + 2)
+    rect = pdfrw.PdfArray([x, y, x + FIELD_SIZE[0], y + FIELD_SIZE[1]])
+    field = pdfrw.IndirectPdfDict(T=pdfrw.PdfString.encode(name))
+    if ft == "radio":
+        field.FT = pdfrw.PdfName.Btn
+        field.Ff = 1 << 15
+        field.Kids = pdfrw.PdfArray()
+        width = FIELD_SIZE[0] // len(OPTIONS)
+        for idx, option in enumerate(OPTIONS):
+            kid_x = x + idx * width
+            kid = _make_widget(
+                pdfrw.PdfArray([kid_x, y, kid_x + FIELD_SIZE[1], y + 14]),
+                page,
+                {option: _appearance(), "Off": _appearance()},
+            )
+            kid.Parent = field
+            field.Kids.append(kid)
+        return field, list(field.Kids)
+    field.update(_make_widget(rect, page))
+    if ft == "text":
+        field.FT = pdfrw.PdfName.Tx
+    elif ft == "checkbox":
+        field.FT = pdfrw.PdfName.Btn
+        field.AP = pdfrw.PdfDict(
+            N=pdfrw.PdfDict(Yes=_appearance(), Off=_appearance())
+        )
+    else:
+        field.FT = pdfrw.PdfName.Ch
+        field.Opt = pdfrw.PdfArray(
+            pdfrw.PdfArray(
+                [pdfrw.PdfString.encode(o.lower()), pdfrw.PdfString.encode(o)]
+            )
+            for o in OPTIONS
+        )
+        if ft == "combo":
+            field.Ff = 1 << 17
+        else:
+            field.Ff = 1 << 21
+    return field, [field]
+
+
+def _make_widget(
+    rect: pdfrw.PdfArray,
+    page: pdfrw.PdfDict,
+    states: dict[str, pdfrw.PdfDict] = None,
+) -> pdfrw.PdfDict:
+    """Return a widget annotation on a page."""
+    widget = pdfrw.IndirectPdfDict(
+        Type=pdfrw.PdfName.Annot,
+        Subtype=pdfrw.PdfName.Widget,
+        Rect=rect,
+        P=page,
+        F=4,
+    )
+    if states is not None:
+        widget.AP = pdfrw.PdfDict(
+            N=pdfrw.PdfDict(
+                (pdfrw.PdfName(key), value) for key, value in states.items()
+            )
+        )
+    return widget
+
+
+def _appearance() -> pdfrw.PdfDict:
+    """Return an empty appearance stream."""
+    stream = pdfrw.IndirectPdfDict(
+        Type=pdfrw.PdfName.XObject,
+        Subtype=pdfrw.PdfName.Form,
+        BBox=pdfrw.PdfArray([0, 0, FIELD_SIZE[1], FIELD_SIZE[1]]),
+    )
+    stream.stream = ""
+    return stream
+
+
+def _make_value(ft: str, rng: random.Random) -> str:
+    """Return a random data value for a field type."""
+    if ft == "checkbox":
+        return rng.choice(["Yes", "No"])
+    if ft in ("radio", "combo"):
+        return rng.choice(OPTIONS)
+    if ft == "list":
+        return ";".join(rng.sample(OPTIONS, rng.randint(1, len(OPTIONS))))
+    return "".join(rng.choice("abcdefghij ") for _ in range(20)).strip()
@@ -0,0 +1,464 @@
+"""Appearance streams for populated form fields.
+
+By default, populated forms ask viewers to render the fields themselves
+(`/NeedAppearances true`). An `AppearanceBuilder` instead generates the
+appearance stream of each populated widget from the field's default
+appearance (`/DA`) font, size and color, so that viewers, printers and
+rasterizers can draw the form as is. `flatten_page` goes one step further and
+draws the widgets into the page content.
+
+Text is measured with the glyph widths of the field's font, which are read
+once per font and cached by the builder. Fonts without a `/Widths` array are
+measured with the metrics of the standard Helvetica or Courier fonts.
+"""
+from typing import Any, NamedTuple, Optional
+import re
+
+import pdfrw
+
+
+DEFAULT_APPEARANCE = "/Helv 0 Tf 0 g"
+DEFAULT_FONT_SIZE = 12.0
+MIN_FONT_SIZE = 4.0
+PADDING = 2.0
+LINE_HEIGHT = 1.15
+DESCENT = 0.22
+SELECTION_COLOR = "0.6 0.75 0.85 rg"
+
+MULTILINE = 1 << 12
+HIDDEN = 1 << 1
+
+OFF = pdfrw.PdfName("Off")
+
+# Widths of the printable ASCII characters (32-126) of standard Helvetica.
+# fmt: off
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278,
+    278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584,
+    584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556,
+    833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278,
+    278, 278, 469, 556, 333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222,
+    500, 222, 833, 556, 556, 556, 556, 333, 500, 278, 556, 500, 722, 500, 500,
+    500, 334, 260, 334, 584,
+)
+# fmt: on
+HELVETICA_DEFAULT_WIDTH = 556
+COURIER_WIDTH = 600
+
+
+class FontMetrics(NamedTuple):
+    """Glyph widths of a font, in thousandths of the font size."""
+
+    widths: dict[int, float]
+    default_width: float
+
+    def measure(self, text: str) -> float:
+        """Return the width of a text in thousandths of the font size."""
+        widths, default = self.widths, self.default_width
+        return sum(widths.get(code, default) for code in _encode(text))
+
+
+HELVETICA = FontMetrics(
+    dict(enumerate(HELVETICA_WIDTHS, start=32)), HELVETICA_DEFAULT_WIDTH
+)
+COURIER = FontMetrics({}, COURIER_WIDTH)
+
+
+class DefaultAppearance(NamedTuple):
+    """The font, size and color operators of a default appearance string."""
+
+    font: str
+    size: float
+    color: str
+
+
+class AppearanceBuilder:
+    """Generate appearance streams for the widgets of a form's fields."""
+
+    def __init__(self, acro_form: Optional[pdfrw.PdfDict]) -> None:
+        """Initialize the builder with the AcroForm of a form."""
+        acro_form = acro_form or pdfrw.PdfDict()
+        self._da = acro_form["/DA"]
+        self._q = acro_form["/Q"]
+        resources = acro_form["/DR"]
+        self._fonts = (resources and resources["/Font"]) or pdfrw.PdfDict()
+        self._metrics = {}
+        self._standard_fonts = {}
+
+    def apply(
+        self,
+        field_type: Optional[str],
+        field: pdfrw.PdfDict,
+        widget: pdfrw.PdfDict,
+        value: Any,
+        options: Optional[dict[str, Any]] = None,
+    ) -> None:
+        """Set the appearance of a widget of a populated field.
+
+        `options` are the display values of a choice field's options.
+        """
+        if field_type in ("checkbox", "radio"):
+            self._apply_button(field_type, field, widget)
+            return
+        if field is not widget and field["/AP"] is not None:
+            field.AP = None
+        if field_type == "list":
+            content = self._list(field, widget, value, options or {})
+        else:
+            content = self._text(field, widget, value)
+        widget.AP = pdfrw.PdfDict(N=content)
+
+    def metrics(self, font_name: str) -> FontMetrics:
+        """Return the (cached) glyph widths of a form font by resource name."""
+        metrics = self._metrics.get(font_name)
+        if metrics is None:
+            metrics = _font_metrics(self._font(font_name))
+            self._metrics[font_name] = metrics
+        return metrics
+
+    def _text(
+        self, field: pdfrw.PdfDict, widget: pdfrw.PdfDict, value: Any
+    ) -> pdfrw.PdfDict:
+        """Return the appearance of a text or combo box widget."""
+        width, height = _size(widget)
+        da = self._default_appearance(widget, field)
+        metrics = self.metrics(da.font)
+        text = "" if value is None else str(value)
+        multiline = int(field.inheritable["/Ff"] or 0) & MULTILINE
+        available = width - 2 * PADDING
+        size = da.size
+        if multiline:
+            size = size or DEFAULT_FONT_SIZE
+            lines = _wrap(text, metrics, size, available)
+            top = height - PADDING - size
+        else:
+            lines = [text.replace("\r", " ").replace("\n", " ")]
+            if not size:
+                size = (height - 2 * PADDING) / LINE_HEIGHT
+                text_width = metrics.measure(lines[0])
+                if text_width * size / 1000 > available:
+                    size = available * 1000 / text_width
+                size = max(size, MIN_FONT_SIZE)
+            top = (height - size) / 2 + DESCENT * size
+        quadding = int(field.inheritable["/Q"] or widget["/Q"] or self._q or 0)
+        ops = []
+        for idx, line in enumerate(lines):
+            line_width = metrics.measure(line) * size / 1000
+            x = PADDING + (available - line_width) * quadding / 2
+            y = top - idx * size * LINE_HEIGHT
+            ops.append(f"1 0 0 1 {_num(x)} {_num(y)} Tm {_literal(line)} Tj")
+        return self._stream(
+            widget,
+            da,
+            (
+                f"/Tx BMC\nq\n{_num(PADDING / 2)} {_num(PADDING / 2)} "
+                f"{_num(width - PADDING)} {_num(height - PADDING)} re W n\n"
+                f"BT\n{da.font} {_num(size)} Tf {da.color}\n"
+                + "\n".join(ops)
+                + "\nET\nQ\nEMC"
+            ),
+        )
+
+    def _list(
+        self,
+        field: pdfrw.PdfDict,
+        widget: pdfrw.PdfDict,
+        values: Any,
+        options: dict[str, Any],
+    ) -> pdfrw.PdfDict:
+        """Return the appearance of a list box widget."""
+        width, height = _size(widget)
+        da = self._default_appearance(widget, field)
+        size = da.size or DEFAULT_FONT_SIZE
+        leading = size * LINE_HEIGHT
+        selected = {values} if isinstance(values, str) else set(values or ())
+        highlights, ops = [], []
+        for idx, option in enumerate(options):
+            top = height - PADDING / 2 - idx * leading
+            if top - leading < 0:
+                break
+            if option in selected:
+                highlights.append(
+                    f"{_num(PADDING / 2)} {_num(top - leading)} "
+                    f"{_num(width - PADDING)} {_num(leading)} re f"
+                )
+            baseline = top - leading + (leading - size) / 2 + DESCENT * size
+            ops.append(
+                f"1 0 0 1 {_num(PADDING)} {_num(baseline)} Tm "
+                f"{_literal(option)} Tj"
+            )
+        if highlights:
+            highlights = [SELECTION_COLOR, *highlights]
+        return self._stream(
+            widget,
+            da,
+            "/Tx BMC\nq\n"
+            + "".join(f"{op}\n" for op in highlights)
+            + f"BT\n{da.font} {_num(size)} Tf {da.color}\n"
+            + "\n".join(ops)
+            + "\nET\nQ\nEMC",
+        )
+
+    def _apply_button(
+        self,
+        field_type: str,
+        field: pdfrw.PdfDict,
+        widget: pdfrw.PdfDict,
+    ) -> None:
+        """Select the appearance state of a checkbox or radio button widget.
+
+        The radio button strategy already selects the state of each kid, and
+        checkboxes are shown in their own "on" state if they are checked.
+        Widgets without appearances get one drawn with their caption.
+        """
+        if field_type == "radio":
+            checked = (widget["/AS"] or OFF) != OFF
+            on = widget["/AS"] if checked else None
+        else:
+            checked = (field["/V"] or OFF) != OFF
+            on = None
+        appearances = widget["/AP"] and widget["/AP"]["/N"]
+        if isinstance(appearances, pdfrw.PdfDict) and not appearances.stream:
+            states = [state for state in appearances if state != OFF]
+            on = states[0] if states else on
+        else:
+            on = on or field["/V"] or pdfrw.PdfName("Yes")
+            widget.AP = pdfrw.PdfDict(
+                N=pdfrw.PdfDict(
+                    {on: self._caption(field, widget), OFF: self._blank(widget)}
+                )
+            )
+        widget.AS = on if checked else OFF
+
+    def _caption(
+        self, field: pdfrw.PdfDict, widget: pdfrw.PdfDict
+    ) -> pdfrw.PdfDict:
+        """Return the "on" appearance of a button, drawn with its caption."""
+        da = self._default_appearance(widget, field)
+        caption = widget["/MK"] and widget["/MK"]["/CA"]
+        caption = caption.to_unicode() if caption else "4"
+        width, height = _size(widget)
+        size = da.size or (height - 2 * PADDING) * 0.8
+        caption_width = self.metrics(da.font).measure(caption) * size / 1000
+        x = (width - caption_width) / 2
+        y = (height - size) / 2 + DESCENT * size
+        return self._stream(
+            widget,
+            da,
+            f"q BT {da.font} {_num(size)} Tf {da.color} "
+            f"1 0 0 1 {_num(x)} {_num(y)} Tm {_literal(caption)} Tj ET Q",
+        )
+
+    def _blank(self, widget: pdfrw.PdfDict) -> pdfrw.PdfDict:
+        """Return an empty appearance for a widget."""
+        return self._stream(widget, None, "")
+
+    def _default_appearance(
+        self, widget: pdfrw.PdfDict, field: pdfrw.PdfDict
+    ) -> DefaultAppearance:
+        """Return the parsed default appearance of a widget."""
+        da = widget["/DA"] or field.inheritable["/DA"] or self._da
+        if da is not None:
+            parsed = _parse_default_appearance(da.to_unicode())
+            if parsed is not None:
+                return parsed
+        return _parse_default_appearance(DEFAULT_APPEARANCE)
+
+    def _font(self, font_name: str) -> pdfrw.PdfDict:
+        """Return a form font by resource name.
+
+        Fonts that are missing from the form's resources are replaced by a
+        standard font, which is created once and shared by every stream.
+        """
+        font = self._fonts[font_name]
+        if font is None:
+            font = self._standard_fonts.get(font_name)
+            if font is None:
+                font = self._standard_fonts[font_name] = pdfrw.IndirectPdfDict(
+                    Type=pdfrw.PdfName("Font"),
+                    Subtype=pdfrw.PdfName("Type1"),
+                    BaseFont=pdfrw.PdfName(_standard_font(font_name)),
+                    Encoding=pdfrw.PdfName("WinAnsiEncoding"),
+                )
+        return font
+
+    def _stream(
+        self,
+        widget: pdfrw.PdfDict,
+        da: Optional[DefaultAppearance],
+        content: str,
+    ) -> pdfrw.PdfDict:
+        """Return a form XObject that draws content over a widget."""
+        width, height = _size(widget)
+        stream = pdfrw.PdfDict(
+            Type=pdfrw.PdfName("XObject"),
+            Subtype=pdfrw.PdfName("Form"),
+            BBox=pdfrw.PdfArray(
+                [pdfrw.PdfObject(_num(v)) for v in (0, 0, width, height)]
+            ),
+        )
+        if da is not None:
+            stream.Resources = pdfrw.PdfDict(
+                Font=pdfrw.PdfDict(
+                    {pdfrw.PdfName(da.font[1:]): self._font(da.font)}
+                )
+            )
+        stream.stream = content
+        return stream
+
+
+def flatten_page(page: pdfrw.PdfDict) -> None:
+    """Draw the visible widgets of a page into its content and remove them.
+
+    Each widget is drawn with its normal appearance (in its current state).
+    The page's resources and content are replaced rather than modified, so
+    they may be shared with other pages.
+    """
+    annotations = page["/Annots"] or []
+    kept, xobjects, ops = [], [], []
+    for annotation in annotations:
+        if annotation["/Subtype"] != "/Widget":
+            kept.append(annotation)
+            continue
+        if int(annotation["/F"] or 0) & HIDDEN:
+            continue
+        appearance = annotation["/AP"] and annotation["/AP"]["/N"]
+        if isinstance(appearance, pdfrw.PdfDict) and not appearance.stream:
+            appearance = appearance[annotation["/AS"] or OFF]
+        if appearance is None or appearance.stream is None:
+            continue
+        name = pdfrw.PdfName(f"FlatWidget{len(xobjects)}")
+        xobjects.append((name, appearance))
+        ops.append(f"q {_placement(annotation, appearance)} cm {name} Do Q")
+    page.Annots = pdfrw.PdfArray(kept) if kept else None
+    if not xobjects:
+        return
+    resources = _copied(page.inheritable["/Resources"])
+    resources.XObject = _copied(resources["/XObject"])
+    for name, appearance in xobjects:
+        resources.XObject[name] = appearance
+    page.Resources = resources
+    contents = page["/Contents"]
+    if contents is None:
+        contents = []
+    elif not isinstance(contents, pdfrw.PdfArray):
+        contents = [contents]
+    page.Contents = pdfrw.PdfArray(
+        [
+            _content_stream("q"),
+            *contents,
+            _content_stream("Q\n" + "\n".join(ops)),
+        ]
+    )
+
+
+def _parse_default_appearance(text: str) -> Optional[DefaultAppearance]:
+    """Return the font, size and color of a default appearance string."""
+    tokens = text.split()
+    try:
+        idx = tokens.index("Tf")
+        font, size = tokens[idx - 2], float(tokens[idx - 1])
+    except (ValueError, IndexError):
+        return None
+    if idx < 2 or not font.startswith("/"):
+        return None
+    color = " ".join(tokens[: idx - 2] + tokens[idx + 1 :])
+    return DefaultAppearance(font, size, color)
+
+
+def _copied(obj: Optional[pdfrw.PdfDict]) -> pdfrw.PdfDict:
+    """Return a direct shallow copy of a dictionary.
+
+    References are copied as they are, without loading the objects.
+    """
+    copy = pdfrw.PdfDict()
+    dict.update(copy, obj or {})
+    return copy
+
+
+def _content_stream(content: str) -> pdfrw.PdfDict:
+    """Return a page content stream."""
+    stream = pdfrw.PdfDict()
+    stream.stream = content
+    return stream
+
+
+def _placement(annotation: pdfrw.PdfDict, appearance: pdfrw.PdfDict) -> str:
+    """Return the matrix that maps an appearance's box onto a widget."""
+    x1, y1, x2, y2 = (float(v) for v in annotation["/Rect"])
+    bx1, by1, bx2, by2 = (float(v) for v in appearance["/BBox"])
+    sx = abs(x2 - x1) / (bx2 - bx1) if bx2 != bx1 else 1
+    sy = abs(y2 - y1) / (by2 - by1) if by2 != by1 else 1
+    x, y = min(x1, x2) - bx1 * sx, min(y1, y2) - by1 * sy
+    return " ".join(_num(v) for v in (sx, 0, 0, sy, x, y))
+
+
+def _size(widget: pdfrw.PdfDict) -> tuple[float, float]:
+    """Return the width and height of a widget."""
+    x1, y1, x2, y2 = (float(v) for v in widget["/Rect"])
+    return abs(x2 - x1), abs(y2 - y1)
+
+
+def _font_metrics(font: pdfrw.PdfDict) -> FontMetrics:
+    """Read the glyph widths of a font."""
+    widths = font["/Widths"]
+    if widths is None:
+        base_font = str(font["/BaseFont"] or "")
+        return COURIER if "Courier" in base_font else HELVETICA
+    first_char = int(font["/FirstChar"] or 0)
+    descriptor = font["/FontDescriptor"]
+    missing = descriptor and descriptor["/MissingWidth"]
+    return FontMetrics(
+        {first_char + idx: float(width) for idx, width in enumerate(widths)},
+        float(missing) if missing else HELVETICA_DEFAULT_WIDTH,
+    )
+
+
+def _standard_font(font_name: str) -> str:
+    """Return the standard font for a font resource name."""
+    name = font_name.lstrip("/").lower()
+    if name.startswith("zadb") or name.startswith("zapf"):
+        return "ZapfDingbats"
+    if name.startswith("cour"):
+        return "Courier"
+    return "Helvetica"
+
+
+def _wrap(
+    text: str, metrics: FontMetrics, size: float, width: float
+) -> list[str]:
+    """Break text into lines that fit a width, at spaces where possible."""
+    lines = []
+    for paragraph in re.split(r"\r\n|\r|\n", text):
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if line and metrics.measure(candidate) * size / 1000 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def _encode(text: str) -> bytes:
+    """Encode text in the single-byte encoding of the generated streams."""
+    return text.encode("latin-1", errors="replace")
+
+
+def _literal(text: str) -> str:
+    """Return a PDF literal string for text."""
+    escaped = (
+        _encode(text)
+        .decode("latin-1")
+        .replace("\\", "\\\\")
+        .replace("(", "\\(")
+        .replace(")", "\\)")
+    )
+    return f"({escaped})"
+
+
+def _num(value: float) -> str:
+    """Format a number for a content stream."""
+    return f"{value:.2f}".rstrip("0").rstrip(".") or "0"
@@ -0,0 +1,303 @@
+"""Compiled form artifacts for pdfpop.
+
+Every `run` parses its form, works out which objects population copies,
+indexes the fields with their option and export tables, and compiles the
+mappings of its configuration. `pdfpop compile` saves the result next to the
+configuration (see `get_path`), and `run` loads it instead as long as the
+digests of the configuration and form recorded in it still match.
+
+An artifact is a header followed by two pickles: a summary of the format,
+Python version and configuration digest, which is checked first, and the
+compiled content. pdfrw objects are pickled without their parser state and
+mapping code with `marshal`, so an artifact is only valid for the Python
+version that wrote it. Like configurations, whose mappings are Python code,
+artifacts must come from a trusted source.
+"""
+from typing import Any, NamedTuple, Optional
+import errno
+import importlib.util
+import logging
+import marshal
+import os
+import pathlib
+import pickle
+import types
+
+import pdfrw
+from pdfrw.objects.pdfindirect import PdfIndirect
+
+import pdfpop
+import pdfpop.form_config
+import pdfpop.pdf
+
+
+ARTIFACT_SUFFIX = ".pdfpopc"
+MAGIC = b"%PDFPOP-ARTIFACT\n"
+FORMAT_VERSION = 2
+
+logger = logging.getLogger(__name__)
+
+
+class Artifact(NamedTuple):
+    """The compiled mappings and form templates of a configuration."""
+
+    expressions: dict[str, pdfpop.form_config.CompiledExpression]
+    templates: dict[pathlib.Path, pdfpop.pdf.FormTemplate]
+
+
+def get_path(config_path: pathlib.Path) -> pathlib.Path:
+    """Return the artifact path for a configuration."""
+    return config_path.with_suffix(ARTIFACT_SUFFIX)
+
+
+def compile_config(form_cfg: pdfpop.form_config.FormConfig) -> Artifact:
+    """Compile the mappings of a configuration and parse its form.
+
+    The form is only parsed if the `form` mapping of the IO section does not
+    depend on the row data.
+    """
+    expressions = pdfpop.form_config.compile_expressions(form_cfg)
+    templates = {}
+    form_path = _static_form_path(form_cfg, expressions)
+    if form_path is None:
+        logger.info(
+            "The form depends on the row data; only the mappings are compiled."
+        )
+    elif not form_path.exists():
+        raise FileNotFoundError(
+            errno.ENOENT, os.strerror(errno.ENOENT), str(form_path)
+        )
+    else:
+        templates[form_path] = pdfpop.pdf.FormTemplate(form_path)
+    return Artifact(expressions, templates)
+
+
+def save(
+    form_cfg: pdfpop.form_config.FormConfig, artifact: Artifact
+) -> pathlib.Path:
+    """Save the artifact of a configuration and return its path."""
+    header = {
+        "format": FORMAT_VERSION,
+        "python": importlib.util.MAGIC_NUMBER,
+        "pdfpop": pdfpop.__version__,
+        "config_digest": form_cfg.digest,
+    }
+    templates = [
+        (str(path), template.digest, template)
+        for path, template in artifact.templates.items()
+    ]
+    graph = _containers(artifact.templates.values())
+    path = get_path(form_cfg.path)
+    partial_path = path.with_name(f"{path.name}.partial")
+    with partial_path.open("wb") as f:
+        f.write(MAGIC)
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        _Pickler(f, graph).dump((graph, artifact.expressions, templates))
+    partial_path.replace(path)
+    return path
+
+
+def load(form_cfg: pdfpop.form_config.FormConfig) -> Optional[Artifact]:
+    """Load the artifact of a configuration, if there is a current one.
+
+    Artifacts of another format, Python or pdfpop version, or compiled from
+    another version of the configuration, are ignored with a warning, as are
+    the templates of forms that have changed since they were compiled.
+    Artifacts whose content cannot be restored (e.g., templates pickled by
+    older code) are ignored as well, so that `run` compiles the configuration
+    again instead.
+    """
+    path = get_path(form_cfg.path)
+    if not path.exists():
+        return None
+    try:
+        with path.open("rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("not a pdfpop artifact")
+            header = pickle.load(f)
+            if (
+                header["format"] != FORMAT_VERSION
+                or header["python"] != importlib.util.MAGIC_NUMBER
+                or header["pdfpop"] != pdfpop.__version__
+            ):
+                _warn(path, "was compiled by another version")
+                return None
+            if header["config_digest"] != form_cfg.digest:
+                _warn(path, "is out of date with the configuration")
+                return None
+            graph, expressions, compiled = pickle.load(f)
+        for obj, children in graph:
+            if isinstance(obj, pdfrw.PdfDict):
+                dict.update(obj, children)
+            else:
+                list.extend(obj, children)
+        templates = _current_templates(path, compiled)
+    except Exception as e:
+        _warn(path, f"cannot be read ({type(e).__name__}: {e})")
+        return None
+    return Artifact(expressions, templates)
+
+
+def _current_templates(
+    path: pathlib.Path, compiled: list[tuple[str, str, Any]]
+) -> dict[pathlib.Path, pdfpop.pdf.FormTemplate]:
+    """Return the loaded templates whose forms have not changed."""
+    templates = {}
+    for name, digest, template in compiled:
+        form_path = pathlib.Path(name)
+        try:
+            current = form_path.exists() and template.digest == digest
+        except OSError:
+            current = False
+        if not current:
+            _warn(path, f'is out of date with the form "{form_path}"')
+            continue
+        templates[form_path] = template
+    return templates
+
+
+class _Pickler(pickle.Pickler):
+    """Pickle pdfrw objects without their parser state, and code objects.
+
+    PDF dictionaries and arrays are pickled empty and their contents are
+    restored from a flat list of `(container, children)` pairs, so that long
+    chains of objects (e.g., `/Next` or `/Parent` links) do not make pickling
+    recurse deeply. References to objects that are not parsed are pickled
+    without their reader, which restores them (see `pdfpop.reader`), and
+    references that were resolved since are pickled as their object.
+    """
+
+    def __init__(self, f: Any, graph: list[tuple[Any, list]]) -> None:
+        """Initialize the pickler for the containers of a graph."""
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._graph = {id(obj) for obj, _ in graph}
+
+    def reducer_override(self, obj: Any) -> Any:
+        """Reduce pdfrw containers and references, and code objects."""
+        if isinstance(obj, PdfIndirect):
+            if "value" in vars(obj):
+                return _resolved, (obj.value,)
+            return PdfIndirect, (tuple(obj),)
+        if isinstance(obj, pdfrw.PdfDict):
+            indirect = _key(obj.indirect)
+            if id(obj) in self._graph:
+                return _make_dict, (indirect, obj.stream)
+            return (
+                _make_dict,
+                (indirect, obj.stream),
+                None,
+                None,
+                obj.iteritems(),
+            )
+        if isinstance(obj, pdfrw.PdfArray):
+            indirect = _key(obj.indirect)
+            if id(obj) in self._graph:
+                return _make_array, (indirect,)
+            return _make_array, (indirect,), None, iter(list(obj))
+        if isinstance(obj, types.CodeType):
+            return marshal.loads, (marshal.dumps(obj),)
+        return NotImplemented
+
+
+def _make_dict(indirect: Any, stream: Optional[str]) -> pdfrw.PdfDict:
+    """Return an empty PDF dictionary (used when unpickling)."""
+    obj = pdfrw.PdfDict()
+    obj.indirect = indirect
+    obj._stream = stream
+    return obj
+
+
+def _make_array(indirect: Any) -> pdfrw.PdfArray:
+    """Return an empty PDF array (used when unpickling)."""
+    obj = pdfrw.PdfArray()
+    if indirect:
+        obj.indirect = indirect
+    return obj
+
+
+def _key(indirect: Any) -> Any:
+    """Return the `indirect` attribute of an object without its reference.
+
+    The attribute of a parsed object may be the reference it was parsed for.
+    """
+    return tuple(indirect) if isinstance(indirect, tuple) else indirect
+
+
+def _resolved(obj: Any) -> Any:
+    """Return a resolved reference (used when unpickling)."""
+    return obj
+
+
+def _containers(templates: Any) -> list[tuple[Any, list]]:
+    """Return every PDF dictionary and array of templates with its children.
+
+    The trailer of each template that is not mapped is included as a plain
+    dictionary, without the state of the reader that parsed it, and the
+    references of its objects are resolved. Mapped templates keep the
+    references to the objects they have not parsed.
+    """
+    graph = []
+    seen = set()
+    pending = []
+    for template in templates:
+        state = template.__getstate__()
+        resolve = not template.mapped
+        pending.extend((obj, resolve) for obj in state["_mutable"])
+        pending.extend((obj, resolve) for obj in state["_shared"])
+    while pending:
+        obj, resolve = pending.pop()
+        if isinstance(obj, PdfIndirect) and "value" in vars(obj):
+            obj = obj.value
+        if not isinstance(obj, (pdfrw.PdfDict, pdfrw.PdfArray)):
+            continue
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, pdfrw.PdfDict):
+            items = obj.iteritems() if resolve else dict.items(obj)
+            children = list(items)
+            pending.extend((value, resolve) for _, value in children)
+        else:
+            children = list(obj if resolve else list.__iter__(obj))
+            pending.extend((value, resolve) for value in children)
+        graph.append((obj, children))
+    return graph
+
+
+def _static_form_path(
+    form_cfg: pdfpop.form_config.FormConfig,
+    expressions: dict[str, pdfpop.form_config.CompiledExpression],
+) -> Optional[pathlib.Path]:
+    """Return the form of a configuration if it does not depend on rows.
+
+    Text that is not an expression names the form only if it is an existing
+    file, since it may otherwise be the name of a data column. Expressions
+    name the form if they use no data and evaluate without errors (e.g., a
+    bare column name, which only evaluates as a column at run time).
+    """
+    value = form_cfg.data["io"].get("form")
+    if not isinstance(value, str):
+        return None
+    expression = expressions.get(value)
+    if expression is None:
+        path = pathlib.Path(value)
+        return path.resolve() if path.is_file() else None
+    if expression.columns != frozenset():
+        return None
+    namespace = {}
+    try:
+        exec(expression.code, namespace)
+        path = namespace["fn"]({})
+    except Exception:
+        return None
+    return None if path is None else pathlib.Path(str(path)).resolve()
+
+
+def _warn(path: pathlib.Path, reason: str) -> None:
+    """Log that an artifact is ignored."""
+    logger.warning(
+        'Ignoring compiled form "%s", which %s; '
+        "run `pdfpop compile` to update it.",
+        path,
+        reason,
+    )
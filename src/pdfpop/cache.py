@@ -0,0 +1,142 @@
+"""Bounded cache of parsed form templates.
+
+When the `io` section of a configuration selects a different form for some
+rows, every distinct form is parsed once and kept in a least recently used
+(LRU) cache. Entries are keyed by resolved path and validated against the
+file's modification time and size, so a modified form is parsed again.
+
+The cache is bounded by a number of templates and by an estimate of the
+memory they use, as reported by each template when it is inserted (see
+`pdfpop.pdf.FormTemplate.memory_size`). Forms that are read lazily are
+charged for their bytes and the few objects they parse rather than for the
+whole form.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, NamedTuple
+import collections
+import os
+import pathlib
+import threading
+
+import pdfpop.metrics
+
+if TYPE_CHECKING:
+    import pdfpop.pdf
+
+
+DEFAULT_MAX_TEMPLATES = 32
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+class _Entry(NamedTuple):
+    """A cached template with the file state it was parsed from."""
+
+    mtime: int
+    size: int
+    template: pdfpop.pdf.FormTemplate
+    bytes: int
+
+
+class TemplateCache:
+    """Thread-safe LRU cache of parsed form templates."""
+
+    def __init__(
+        self,
+        max_templates: int = DEFAULT_MAX_TEMPLATES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        """Initialize an empty cache with the given limits.
+
+        The most recently used template is always kept, even if it exceeds
+        the limits on its own.
+        """
+        self._max_templates = max_templates
+        self._max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = _empty_stats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def bytes(self) -> int:
+        """Getter for the estimated memory use of the cached templates."""
+        return self._bytes
+
+    def get(
+        self,
+        form_path: pathlib.Path,
+        metrics: pdfpop.metrics.Metrics = pdfpop.metrics.NULL_METRICS,
+    ) -> pdfpop.pdf.FormTemplate:
+        """Return the parsed template of a form, parsing it if needed.
+
+        Parsing is recorded as the "parse" stage of `metrics`.
+        """
+        key = form_path.resolve()
+        stat = key.stat()
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is not None
+                and entry.mtime == stat.st_mtime_ns
+                and entry.size == stat.st_size
+            ):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry.template
+            self._stats["misses"] += 1
+        import pdfpop.pdf
+
+        with metrics.stage("parse"):
+            template = pdfpop.pdf.FormTemplate(form_path)
+        with self._lock:
+            self._insert(key, stat, template)
+        return template
+
+    def add(
+        self, form_path: pathlib.Path, template: pdfpop.pdf.FormTemplate
+    ) -> None:
+        """Add a template that was parsed elsewhere (e.g., compiled)."""
+        key = form_path.resolve()
+        stat = key.stat()
+        with self._lock:
+            self._insert(key, stat, template)
+
+    def drain_stats(self) -> dict[str, int]:
+        """Return and reset the hit, miss and eviction counts."""
+        with self._lock:
+            stats, self._stats = self._stats, _empty_stats()
+        return stats
+
+    def _insert(
+        self,
+        key: pathlib.Path,
+        stat: os.stat_result,
+        template: pdfpop.pdf.FormTemplate,
+    ) -> None:
+        """Insert a template and evict the least recently used ones."""
+        self._remove(key)
+        entry = _Entry(
+            stat.st_mtime_ns, stat.st_size, template, template.memory_size
+        )
+        self._entries[key] = entry
+        self._bytes += entry.bytes
+        while len(self._entries) > 1 and (
+            len(self._entries) > self._max_templates
+            or self._bytes > self._max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: pathlib.Path) -> None:
+        """Remove an entry from the cache, if it is present."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.bytes
+
+
+def _empty_stats() -> dict[str, int]:
+    """Return zeroed cache statistics."""
+    return {"hits": 0, "misses": 0, "evictions": 0}
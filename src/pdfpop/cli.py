@@ -1,11 +1,20 @@
-"""CLI module for pdfpop."""
+"""CLI module for pdfpop.
+
+Only the modules needed to build the command line interface are imported at
+startup. Each command imports `pdfpop.commands` (and with it pdfrw and the
+data readers) when it runs, so that `--help` and `--version` stay fast.
+"""
+from typing import Any, Callable, Optional
 import pathlib
 import sys
 
 import click
 
 import pdfpop
-import pdfpop.commands
+import pdfpop.cache
+import pdfpop.dedup
+import pdfpop.log
+import pdfpop.pipeline
 
 
 def version_msg() -> str:
@@ -26,20 +35,347 @@ def main() -> None:
     pass
 
 
+def verbosity_options(command: Callable) -> Callable:
+    """Add the `-v/--verbose` and `-q/--quiet` options to a command."""
+    command = click.option(
+        "-q",
+        "--quiet",
+        count=True,
+        help="Show fewer messages (warnings, then only errors).",
+    )(command)
+    return click.option(
+        "-v",
+        "--verbose",
+        count=True,
+        help="Show more messages (the value of every field).",
+    )(command)
+
+
+def parse_shard(
+    ctx: click.Context, param: click.Parameter, value: Optional[str]
+) -> Any:
+    """Parse the `--shard` option into a `pdfpop.shard.Shard`."""
+    if value is None:
+        return None
+    import pdfpop.shard
+
+    try:
+        return pdfpop.shard.parse(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+
 @main.command()
 @click.argument("form", type=click.Path(path_type=pathlib.Path, exists=True))
-def config(form: pathlib.Path) -> None:
+@verbosity_options
+def config(form: pathlib.Path, verbose: int, quiet: int) -> None:
     """Generate a PDF form configuration file."""
-    pdfpop.commands.config(form_path=form)
+    import pdfpop.commands
+
+    with pdfpop.log.configured(verbose - quiet):
+        pdfpop.commands.config(form_path=form)
+
+
+@main.command(name="compile")
+@click.argument("config", type=click.Path(path_type=pathlib.Path, exists=True))
+@verbosity_options
+def compile_config(config: pathlib.Path, verbose: int, quiet: int) -> None:
+    """Compile a configuration and its form for faster runs.
+
+    The compiled form is saved next to CONFIG and used by `run` for as long as
+    neither CONFIG nor the form changes.
+    """
+    import pdfpop.commands
+
+    with pdfpop.log.configured(verbose - quiet):
+        pdfpop.commands.compile_config(config_path=config)
 
 
 @main.command()
 @click.argument("config", type=click.Path(path_type=pathlib.Path, exists=True))
-@click.argument("data", type=click.Path(path_type=pathlib.Path, exists=True))
+@click.argument(
+    "data",
+    type=click.Path(path_type=pathlib.Path, exists=True, allow_dash=True),
+)
 # @click.option("-o", "--output", default="populated.pdf", help="Output file path.")
-def run(config: pathlib.Path, data: pathlib.Path) -> None:
-    """Populate a PDF form with data as prescribed by the configuration file."""
-    pdfpop.commands.run(config_path=config, data_path=data)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of worker processes. [default: number of CPUs]",
+)
+@click.option(
+    "--all-columns",
+    is_flag=True,
+    help="Read every data column, not only those used by the configuration.",
+)
+@click.option(
+    "--vectorize/--no-vectorize",
+    default=True,
+    show_default=True,
+    help="Evaluate field mappings for batches of rows at a time.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip rows whose output is up to date according to the manifest.",
+)
+@click.option(
+    "--merge",
+    type=click.Path(path_type=pathlib.Path, dir_okay=False),
+    default=None,
+    help="Save every populated row as the pages of a single PDF file.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Save outputs as the form followed by only the modified objects.",
+)
+@click.option(
+    "--summary",
+    is_flag=True,
+    help="Show a single line for each row.",
+)
+@click.option(
+    "--appearances",
+    is_flag=True,
+    help="Generate the appearance of every populated field.",
+)
+@click.option(
+    "--flatten",
+    is_flag=True,
+    help="Draw the populated fields into the pages and remove the form.",
+)
+@click.option(
+    "--dedup",
+    type=click.Choice(pdfpop.dedup.METHODS),
+    default=None,
+    help="Reuse the output of an earlier row with identical fields as a hard "
+    "link, reflink or copy.",
+)
+@click.option(
+    "--template-cache",
+    type=click.IntRange(min=1),
+    default=pdfpop.cache.DEFAULT_MAX_TEMPLATES,
+    show_default=True,
+    help="Number of parsed forms to keep when rows select different forms.",
+)
+@click.option(
+    "--template-cache-memory",
+    type=click.IntRange(min=1),
+    default=pdfpop.cache.DEFAULT_MAX_BYTES >> 20,
+    show_default=True,
+    help="Estimated memory (in MiB) that parsed forms may use.",
+)
+@click.option(
+    "--io-threads",
+    type=click.IntRange(min=0),
+    default=pdfpop.pipeline.IO_THREADS,
+    show_default=True,
+    help="Threads that write outputs while the next rows are populated.",
+)
+@click.option(
+    "--shard",
+    metavar="I/N",
+    callback=parse_shard,
+    default=None,
+    help="Only populate shard I of N of the rows (e.g., 2/4).",
+)
+@click.option(
+    "--shard-key",
+    metavar="COLUMN",
+    default=None,
+    help="Assign rows to shards by a hash of COLUMN instead of by row index.",
+)
+@click.option(
+    "--status",
+    type=click.Path(path_type=pathlib.Path, dir_okay=False),
+    default=None,
+    help="Save the status of each row as JSON Lines. "
+    "[default with --shard: pdfpop-status-I-of-N.jsonl]",
+)
+@click.option(
+    "--metrics",
+    type=click.Path(path_type=pathlib.Path, dir_okay=False),
+    default=None,
+    help="Save the time and memory use of each stage and row as JSON.",
+)
+@click.option(
+    "--profile",
+    type=click.Path(path_type=pathlib.Path, dir_okay=False),
+    default=None,
+    help="Profile the run with cProfile and save the statistics.",
+)
+@verbosity_options
+def run(
+    config: pathlib.Path,
+    data: pathlib.Path,
+    jobs: Optional[int],
+    all_columns: bool,
+    vectorize: bool,
+    resume: bool,
+    merge: Optional[pathlib.Path],
+    incremental: bool,
+    summary: bool,
+    appearances: bool,
+    flatten: bool,
+    dedup: Optional[str],
+    template_cache: int,
+    template_cache_memory: int,
+    io_threads: int,
+    shard: Any,
+    shard_key: Optional[str],
+    status: Optional[pathlib.Path],
+    metrics: Optional[pathlib.Path],
+    profile: Optional[pathlib.Path],
+    verbose: int,
+    quiet: int,
+) -> None:
+    """Populate a PDF form with data as prescribed by the configuration file.
+
+    DATA may be a CSV, JSON Lines, Parquet or Microsoft Excel file, or `-` to
+    read CSV or JSON Lines from standard input.
+
+    With `--shard`, several runs (e.g., on different machines) each populate
+    their own rows of DATA; combine their status with `merge-manifests`.
+    """
+    import pdfpop.commands
+
+    if shard_key is not None:
+        if shard is None:
+            raise click.UsageError("--shard-key requires --shard.")
+        shard = shard._replace(key=shard_key)
+    with pdfpop.log.configured(verbose - quiet):
+        pdfpop.commands.run(
+            config_path=config,
+            data_path=data,
+            jobs=jobs,
+            all_columns=all_columns,
+            options=pdfpop.commands.OutputOptions(
+                vectorize=vectorize,
+                resume=resume,
+                incremental=incremental,
+                summary=summary,
+                appearances=appearances,
+                flatten=flatten,
+                dedup=dedup,
+            ),
+            merge=merge,
+            max_templates=template_cache,
+            max_template_bytes=template_cache_memory << 20,
+            io_threads=io_threads,
+            shard=shard,
+            status_path=status,
+            metrics_path=metrics,
+            profile_path=profile,
+        )
+
+
+@main.command(name="merge-manifests")
+@click.argument(
+    "statuses",
+    metavar="STATUS...",
+    nargs=-1,
+    required=True,
+    type=click.Path(path_type=pathlib.Path, exists=True, dir_okay=False),
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(path_type=pathlib.Path, dir_okay=False),
+    default=None,
+    help="Save the combined status of every row as JSON Lines.",
+)
+@verbosity_options
+def merge_manifests(
+    statuses: tuple[pathlib.Path, ...],
+    output: Optional[pathlib.Path],
+    verbose: int,
+    quiet: int,
+) -> None:
+    """Combine the status manifests of the shards of a run.
+
+    Reports the rows that failed or that no shard populated, and exits with an
+    error if there are any.
+    """
+    import pdfpop.commands
+
+    with pdfpop.log.configured(verbose - quiet):
+        pdfpop.commands.merge_manifests(
+            status_paths=statuses, output_path=output
+        )
+
+
+@main.command()
+@click.argument(
+    "configs",
+    metavar="CONFIG...",
+    nargs=-1,
+    required=True,
+    type=click.Path(path_type=pathlib.Path, exists=True, dir_okay=False),
+)
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    show_default=True,
+    help="Address to listen on.",
+)
+@click.option(
+    "--port",
+    type=click.IntRange(min=0, max=65535),
+    default=8000,
+    show_default=True,
+    help="Port to listen on.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(path_type=pathlib.Path, dir_okay=False),
+    default=None,
+    help="Listen on a Unix domain socket instead of a TCP port.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of worker threads. [default: number of CPUs]",
+)
+@click.option(
+    "--queue-limit",
+    type=click.IntRange(min=0),
+    default=64,
+    show_default=True,
+    help="Number of requests that may wait for a worker.",
+)
+@verbosity_options
+def serve(
+    configs: tuple[pathlib.Path, ...],
+    host: str,
+    port: int,
+    socket_path: Optional[pathlib.Path],
+    workers: Optional[int],
+    queue_limit: int,
+    verbose: int,
+    quiet: int,
+) -> None:
+    """Serve PDF forms populated with JSON rows over HTTP.
+
+    Each CONFIG is served at `POST /fill/<name>`, where `<name>` is the file
+    name of the configuration without its extension. With a single
+    configuration, `POST /fill` may be used as well.
+    """
+    import pdfpop.commands
+
+    with pdfpop.log.configured(verbose - quiet, capacity=1):
+        pdfpop.commands.serve(
+            configs,
+            host=host,
+            port=port,
+            socket_path=socket_path,
+            workers=workers,
+            queue_limit=queue_limit,
+        )
 
 
 if __name__ == "__main__":
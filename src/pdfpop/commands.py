@@ -1,13 +1,74 @@
 """Module for pdfpop commands."""
-from typing import Any
+from typing import Any, Iterable, Iterator, NamedTuple, Optional, Union
+import collections
+import concurrent.futures
+import contextlib
 import errno
+import itertools
+import json
+import logging
 import os
 import pathlib
+import time
 
-import pandas as pd
+import pdfrw
 
+import pdfpop.artifact
+import pdfpop.cache
+import pdfpop.data
+import pdfpop.dedup
 import pdfpop.form_config
+import pdfpop.log
+import pdfpop.manifest
+import pdfpop.metrics
 import pdfpop.pdf
+import pdfpop.pipeline
+import pdfpop.shard
+
+
+BATCH_SIZE = 256
+WORKER_CHUNK_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+
+class OutputOptions(NamedTuple):
+    """Options of `run` that control how the output of each row is made.
+
+    With `vectorize`, field mappings are evaluated for batches of rows at a
+    time (see `CompiledSection.evaluate_batch`). With `resume`, rows whose
+    output is recorded as populated from the same row data, configuration,
+    form and output options (see `content`) are skipped.
+
+    With `incremental`, each output is saved as the original form followed by
+    an incremental update that only contains the modified objects. With
+    `appearances`, an appearance stream is generated for every populated
+    field so that viewers do not have to render the fields. With `flatten`,
+    the fields are drawn into the page content and the form is removed (see
+    `pdfpop.appearance`).
+
+    With `summary`, a single line is logged at the INFO level for each row
+    instead of its usual status messages. With `dedup` ("hardlink",
+    "reflink" or "copy"), rows that set the same fields of the same form to
+    the same values as an earlier row reuse its output instead of being
+    populated again (see `pdfpop.dedup`).
+    """
+
+    vectorize: bool = True
+    resume: bool = False
+    incremental: bool = False
+    summary: bool = False
+    appearances: bool = False
+    flatten: bool = False
+    dedup: Optional[str] = None
+
+    def content(self, template: pdfpop.pdf.FormTemplate) -> dict[str, bool]:
+        """Return the options that change the outputs of a template."""
+        return {
+            "incremental": self.incremental and template.supports_update,
+            "appearances": self.appearances,
+            "flatten": self.flatten,
+        }
 
 
 def config(form_path: pathlib.Path) -> None:
@@ -28,55 +89,1189 @@ def config(form_path: pathlib.Path) -> None:
     form_cfg.data["io"]["output_name"] = str(f"pdfpop-{form_path.stem}.pdf")
     form_cfg.data["fields"] = pdfpop.pdf.get_fields_info(form_path)
     form_cfg.save()
-    print(f'Generated form configuration file "{form_cfg.path}".')
+    logger.info('Generated form configuration file "%s".', form_cfg.path)
 
 
-def run(config_path: pathlib.Path, data_path: pathlib.Path) -> None:
-    """Generate a populated PDF file."""
+def compile_config(config_path: pathlib.Path) -> None:
+    """Compile a form configuration and its form into an artifact.
+
+    `run` loads the artifact instead of parsing the form and compiling the
+    mappings for as long as neither changes (see `pdfpop.artifact`).
+    """
     if not config_path.exists():
         raise FileNotFoundError(
             errno.ENOENT, os.strerror(errno.ENOENT), str(config_path)
         )
     form_cfg = pdfpop.form_config.FormConfig(config_path)
     form_cfg.load()
-    data = _build_data_dict(data_path)
-    if len(data) == 0:
-        print("No entries found in data file. Exiting.")
+    artifact = pdfpop.artifact.compile_config(form_cfg)
+    artifact_path = pdfpop.artifact.save(form_cfg, artifact)
+    logger.info('Compiled form configuration saved to "%s".', artifact_path)
+
+
+def run(
+    config_path: pathlib.Path,
+    data_path: pathlib.Path,
+    jobs: Optional[int] = None,
+    all_columns: bool = False,
+    options: OutputOptions = OutputOptions(),
+    merge: Optional[pathlib.Path] = None,
+    max_templates: int = pdfpop.cache.DEFAULT_MAX_TEMPLATES,
+    max_template_bytes: int = pdfpop.cache.DEFAULT_MAX_BYTES,
+    io_threads: int = pdfpop.pipeline.IO_THREADS,
+    shard: Optional[pdfpop.shard.Shard] = None,
+    status_path: Optional[pathlib.Path] = None,
+    metrics_path: Optional[pathlib.Path] = None,
+    profile_path: Optional[pathlib.Path] = None,
+) -> None:
+    """Generate a populated PDF file.
+
+    Rows are distributed across `jobs` worker processes (by default one per
+    CPU). The status of each row is reported in row order regardless of the
+    number of jobs, and a failing row does not stop the remaining rows.
+
+    Only the data columns used by the configuration are read unless
+    `all_columns` is set or the columns cannot be determined statically.
+    The output of each row is made as set by `options` (see `OutputOptions`).
+
+    Every populated output is recorded in a manifest in its output directory,
+    so that `options.resume` can skip the rows whose output is up to date.
+
+    With `merge`, every row is appended to a single PDF file at that path
+    instead of being saved to its own output. Rows are then populated in this
+    process and no manifest is recorded.
+
+    With `options.dedup`, the share of reused outputs is logged at the end of
+    the run. With several jobs, identical outputs are found in this process,
+    so each distinct output is populated once whichever worker writes it.
+
+    Parsed forms are kept in a least recently used cache of at most
+    `max_templates` templates and about `max_template_bytes` bytes, so rows
+    that select one of several forms parse each of them once (see
+    `pdfpop.cache`).
+
+    If the configuration was compiled with `compile_config` and neither it
+    nor its form changed since, the compiled mappings and form are used.
+
+    In a single process, rows are read ahead by a reader thread and outputs
+    are written by `io_threads` threads while the next rows are populated.
+    At most `pdfpop.pipeline.PIPELINE_DEPTH` rows wait to be populated and
+    at most as many outputs wait to be written, which bounds memory use. With
+    `io_threads` set to 0, each row is read, populated and written before the
+    next one.
+
+    With `shard`, only the rows of that shard of the data file are populated
+    (see `pdfpop.shard`). The status of each of its rows is recorded in the
+    status manifest at `status_path` (by default `Shard.status_name` in the
+    current directory). `status_path` may also be given without a shard, to
+    record the status of every row.
+
+    The status of each row is logged at the INFO level and the value of each
+    field at the DEBUG level (see `pdfpop.log`), unless `options.summary` is
+    set.
+
+    With `metrics_path`, the wall time and peak memory use of each stage and
+    row are saved there as JSON (see `pdfpop.metrics`). With `profile_path`,
+    the run is profiled with cProfile and the statistics are dumped there.
+    """
+    if merge is not None and options.resume:
+        raise RuntimeError("Merged output cannot be resumed.")
+    if merge is not None and options.dedup is not None:
+        raise RuntimeError("Merged output cannot be de-duplicated.")
+    if not config_path.exists():
+        raise FileNotFoundError(
+            errno.ENOENT, os.strerror(errno.ENOENT), str(config_path)
+        )
+    metrics = pdfpop.metrics.NULL_METRICS
+    with contextlib.ExitStack() as stack:
+        if profile_path is not None:
+            stack.enter_context(pdfpop.metrics.profiled(profile_path))
+        if metrics_path is not None:
+            metrics = pdfpop.metrics.Metrics()
+            stack.callback(metrics.save, metrics_path)
+        _run(
+            config_path,
+            data_path,
+            jobs,
+            all_columns,
+            options,
+            (max_templates, max_template_bytes),
+            io_threads,
+            merge,
+            shard,
+            status_path,
+            metrics,
+        )
+
+
+def merge_manifests(
+    status_paths: Iterable[pathlib.Path],
+    output_path: Optional[pathlib.Path] = None,
+) -> None:
+    """Combine the status manifests of the shards of a run.
+
+    The number of rows with each status is logged, and a `RuntimeError` is
+    raised if any row failed or was not recorded by any shard, or if a shard
+    is missing or did not finish. With `output_path`, the status of every
+    row, including the missing ones, is saved there as JSON Lines.
+    """
+    status_paths = list(status_paths)
+    for status_path in status_paths:
+        if not status_path.exists():
+            raise FileNotFoundError(
+                errno.ENOENT, os.strerror(errno.ENOENT), str(status_path)
+            )
+    combined = pdfpop.shard.combine(status_paths)
+    missing = combined.missing
+    counts = collections.Counter(
+        entry["status"] for entry in combined.rows.values()
+    )
+    counts[pdfpop.shard.MISSING] = len(missing)
+    logger.info(
+        "Combined the status of %d rows from %d of %d shards: %s.",
+        combined.total,
+        combined.shards - len(combined.missing_shards),
+        combined.shards,
+        ", ".join(f"{count} {status}" for status, count in counts.items()),
+    )
+    if output_path is not None:
+        with output_path.open("w", encoding="utf-8") as f:
+            for row in range(1, combined.total + 1):
+                entry = combined.rows.get(row)
+                if entry is None:
+                    entry = {"row": row, "status": pdfpop.shard.MISSING}
+                f.write(json.dumps(entry) + "\n")
+        logger.info('Combined status manifest saved to "%s".', output_path)
+    problems = []
+    if combined.missing_shards:
+        problems.append(
+            f"missing shards {_format_rows(combined.missing_shards)}"
+        )
+    if combined.unfinished_shards:
+        problems.append(
+            f"unfinished shards {_format_rows(combined.unfinished_shards)}"
+        )
+    failed = combined.with_status(pdfpop.shard.FAILED)
+    if failed:
+        problems.append(f"failed rows {_format_rows(failed)}")
+    if missing:
+        problems.append(f"missing rows {_format_rows(missing)}")
+    if problems:
+        raise RuntimeError(f"Incomplete run: {'; '.join(problems)}.")
+
+
+def serve(
+    config_paths: Iterable[pathlib.Path],
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    socket_path: Optional[pathlib.Path] = None,
+    workers: Optional[int] = None,
+    queue_limit: int = 64,
+) -> None:
+    """Serve populated forms over HTTP until interrupted.
+
+    Rows are populated by `workers` threads (by default one per CPU) and at
+    most `queue_limit` further requests wait for a worker (see
+    `pdfpop.server`). The service listens on the Unix domain socket
+    `socket_path` if given and on `host:port` otherwise.
+    """
+    import pdfpop.server
+
+    config_paths = list(config_paths)
+    for config_path in config_paths:
+        if not config_path.exists():
+            raise FileNotFoundError(
+                errno.ENOENT, os.strerror(errno.ENOENT), str(config_path)
+            )
+    if socket_path is not None and socket_path.exists():
+        raise FileExistsError(
+            errno.EEXIST, os.strerror(errno.EEXIST), str(socket_path)
+        )
+    server = pdfpop.server.make_server(
+        config_paths,
+        host=host,
+        port=port,
+        socket_path=socket_path,
+        workers=workers or os.cpu_count() or 1,
+        queue_limit=queue_limit,
+    )
+    if socket_path is None:
+        host, port = server.server_address[:2]
+        logger.info("Serving on http://%s:%d.", host, port)
+    else:
+        logger.info('Serving on "%s".', socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None:
+            socket_path.unlink(missing_ok=True)
+
+
+def _run(
+    config_path: pathlib.Path,
+    data_path: pathlib.Path,
+    jobs: Optional[int],
+    all_columns: bool,
+    options: OutputOptions,
+    cache_limits: tuple[int, int],
+    io_threads: int,
+    merge: Optional[pathlib.Path],
+    shard: Optional[pdfpop.shard.Shard],
+    status_path: Optional[pathlib.Path],
+    metrics: pdfpop.metrics.Metrics,
+) -> None:
+    """Populate the rows of a data file as described by `run`.
+
+    The `cache_limits` are the `max_templates` and `max_template_bytes`
+    arguments of `run`.
+    """
+    form_cfg = pdfpop.form_config.FormConfig(config_path)
+    form_cfg.load()
+    if status_path is not None and shard is None:
+        shard = pdfpop.shard.Shard(1, 1)
+    elif shard is not None and status_path is None:
+        status_path = pathlib.Path(shard.status_name)
+    results = _Results(merge is not None, shard is None or shard.count == 1)
+    with contextlib.ExitStack() as stack:
+        stack.callback(results.close)
+        if shard is not None:
+            results.status = stack.enter_context(
+                contextlib.closing(
+                    pdfpop.shard.StatusManifest(
+                        status_path,
+                        shard,
+                        {
+                            "data": str(data_path),
+                            "config_digest": form_cfg.digest,
+                        },
+                    )
+                )
+            )
+        _run_rows(
+            form_cfg,
+            data_path,
+            jobs,
+            all_columns,
+            options,
+            cache_limits,
+            io_threads,
+            merge,
+            shard,
+            results,
+            metrics,
+        )
+    if results.status is not None:
+        logger.info(
+            'Status of the rows of shard %s saved to "%s".', shard, status_path
+        )
+    if results.failed:
+        raise RuntimeError(
+            f"Failed to populate {len(results.failed)} of {results.total} "
+            f"rows: {', '.join(map(str, results.failed))}."
+        )
+
+
+def _run_rows(
+    form_cfg: pdfpop.form_config.FormConfig,
+    data_path: pathlib.Path,
+    jobs: Optional[int],
+    all_columns: bool,
+    options: OutputOptions,
+    cache_limits: tuple[int, int],
+    io_threads: int,
+    merge: Optional[pathlib.Path],
+    shard: Optional[pdfpop.shard.Shard],
+    results: "_Results",
+    metrics: pdfpop.metrics.Metrics,
+) -> None:
+    """Populate the rows (of a shard) of a data file into `results`."""
+    with metrics.stage("artifact"):
+        artifact = pdfpop.artifact.load(form_cfg)
+    expressions = None if artifact is None else artifact.expressions
+    header = []
+    shard_key = None if shard is None else shard.key
+    data_rows = 0
+
+    def select_columns(columns: list[str]) -> Optional[frozenset[str]]:
+        header.extend(columns)
+        if shard_key is not None and shard_key not in columns:
+            raise RuntimeError(
+                f'Shard key column "{shard_key}" is not in the data.'
+            )
+        if all_columns:
+            return None
+        selected = pdfpop.form_config.CompiledConfig(
+            form_cfg, columns, expressions
+        ).columns
+        if selected is not None and shard_key is not None:
+            selected |= {shard_key}
+        return selected
+
+    def index_rows(
+        rows: Iterator[dict[str, Any]]
+    ) -> Iterator[tuple[int, dict[str, Any]]]:
+        nonlocal data_rows
+        for idx, row in enumerate(rows):
+            data_rows = idx + 1
+            yield idx, row
+
+    rows = pdfpop.data.read_rows(data_path, select_columns)
+    if metrics.enabled:
+        rows = _timed_rows(rows, metrics)
+    first_row = next(rows, None)
+    if first_row is None:
+        logger.warning("No entries found in data file. Exiting.")
+        if results.status is not None:
+            results.status.finish(0)
         return
-    fields = _strip_field_type(form_cfg.data["fields"])
-    for idx, row in enumerate(data):
-        io = pdfpop.form_config.interpret(form_cfg.data["io"], row)
-        form_path = pathlib.Path(io["form"])
-        print(f'\nPopulating form "{form_path}" for row {idx+1}.')
-        row_fields = pdfpop.form_config.interpret(
-            form_cfg.data["fields"], row, verbose=True
+    rows = index_rows(itertools.chain([first_row], rows))
+    if shard is not None:
+        rows = shard.select(rows)
+    with metrics.stage("compile"):
+        compiled = pdfpop.form_config.CompiledConfig(
+            form_cfg, header, expressions
+        )
+    for key, error in compiled.errors.items():
+        logger.warning(
+            'Mapping for "%s" does not compile and will be used as text: %s.',
+            key,
+            error.msg if isinstance(error, SyntaxError) else error,
         )
+    jobs = 1 if merge is not None else jobs or os.cpu_count() or 1
+    output_stats = collections.Counter()
+    if jobs == 1:
+        with contextlib.ExitStack() as stack:
+            writer = None
+            if merge is not None:
+                writer = stack.enter_context(
+                    pdfpop.pdf.MergedFormWriter(
+                        merge, options.appearances, options.flatten
+                    )
+                )
+            runner = _RowRunner(
+                compiled,
+                form_cfg.digest,
+                options,
+                writer,
+                metrics,
+                _template_cache(cache_limits, artifact),
+            )
+            if writer is None and io_threads > 0:
+                _run_pipelined(runner, rows, results, metrics, io_threads)
+            else:
+                _run_serial(runner, rows, results, metrics)
+            metrics.count_cache("templates", runner.templates.drain_stats())
+            if runner.outputs is not None:
+                output_stats.update(runner.outputs.drain_stats())
+        if writer is not None:
+            logger.info('Merged populated forms saved to "%s".', merge)
+    else:
+        dispatcher = _Dispatcher(rows)
+        if options.dedup is not None:
+            dispatcher = _Dispatcher(
+                rows,
+                _RowRunner(
+                    compiled,
+                    form_cfg.digest,
+                    options,
+                    metrics=metrics,
+                    templates=_template_cache(cache_limits, artifact),
+                ),
+                jobs * 2 * WORKER_CHUNK_SIZE,
+            )
+        _run_parallel(
+            form_cfg.path,
+            header,
+            dispatcher,
+            jobs,
+            options,
+            cache_limits,
+            artifact is not None,
+            results,
+            output_stats,
+            metrics,
+        )
+    if options.dedup is not None:
+        metrics.count_cache("outputs", dict(output_stats))
+        reused, total_outputs = output_stats["hits"], sum(output_stats.values())
+        logger.info(
+            "Reused identical outputs for %d of %d populated rows (%.1f%%).",
+            reused,
+            total_outputs,
+            100 * reused / total_outputs if total_outputs else 0,
+        )
+    if results.status is not None:
+        results.status.finish(data_rows)
+
+
+class _Results:
+    """The outcome of each row, recorded in manifests as rows finish."""
+
+    def __init__(self, merged: bool, compact: bool = True) -> None:
+        """Initialize empty results, of a merged run if `merged`.
+
+        With `compact`, the manifests are compacted when they are closed.
+        Sharded runs do not compact them, since other shards may still be
+        recording to the same manifests.
+        """
+        self.total = 0
+        self.failed = []
+        self.status: Optional[pdfpop.shard.StatusManifest] = None
+        self._merged = merged
+        self._compact = compact
+        self._manifests = {}
+
+    def record(self, idx: int, entry: Optional[dict[str, Any]]) -> None:
+        """Record a row that was populated, or skipped if `entry` is `None`.
+
+        The output of a populated row is recorded in the manifest of its
+        directory.
+        """
+        self.total += 1
+        if entry is not None:
+            output_dir = pathlib.Path(entry["output"]).parent
+            if output_dir not in self._manifests:
+                self._manifests[output_dir] = pdfpop.manifest.Manifest(
+                    output_dir
+                )
+            self._manifests[output_dir].record(entry)
+        if self.status is None:
+            return
+        if entry is not None:
+            self.status.record(idx, pdfpop.shard.POPULATED, entry["output"])
+        elif self._merged:
+            self.status.record(idx, pdfpop.shard.MERGED)
+        else:
+            self.status.record(idx, pdfpop.shard.SKIPPED)
+
+    def fail(self, idx: int, message: str) -> None:
+        """Record and report a row that failed to populate."""
+        self.total += 1
+        logger.error(message)
+        self.failed.append(idx + 1)
+        if self.status is not None:
+            self.status.record(idx, pdfpop.shard.FAILED, error=message)
+
+    def close(self) -> None:
+        """Close (and compact) the manifests that rows were recorded in."""
+        for manifest in self._manifests.values():
+            manifest.close(self._compact)
+
+
+class _Output(NamedTuple):
+    """A populated form that has yet to be written to its output path."""
+
+    idx: int
+    template: pdfpop.pdf.FormTemplate
+    populated: Optional[Union[bytes, pdfpop.pdf.Rewrite, pdfrw.PdfDict]]
+    path: pathlib.Path
+    entry: dict[str, Any]
+    fields: dict[str, Any]
+    source: Optional[pathlib.Path] = None
+
+
+class _RowRunner:
+    """Populate rows using a compiled configuration and cached templates."""
+
+    def __init__(
+        self,
+        compiled: pdfpop.form_config.CompiledConfig,
+        config_digest: str,
+        options: OutputOptions = OutputOptions(),
+        writer: Optional[pdfpop.pdf.MergedFormWriter] = None,
+        metrics: pdfpop.metrics.Metrics = pdfpop.metrics.NULL_METRICS,
+        templates: Optional[pdfpop.cache.TemplateCache] = None,
+    ) -> None:
+        """Initialize the runner with empty template and manifest caches.
+
+        If a writer is given, populated forms are added to it instead of being
+        saved to their own output paths. With `options.summary`, a single
+        line is logged for each row and the usual status messages are only
+        logged at the DEBUG level. With `options.dedup`, the outputs written
+        are indexed in `outputs` and rows with identical ones reuse them.
+        """
+        self._compiled = compiled
+        self._config_digest = config_digest
+        self._options = options
+        self._status_level = logging.DEBUG if options.summary else logging.INFO
+        self._writer = writer
+        self.metrics = metrics
+        if templates is None:
+            templates = pdfpop.cache.TemplateCache()
+        self.templates = templates
+        self.outputs = None
+        if options.dedup is not None:
+            self.outputs = pdfpop.dedup.OutputIndex(options.dedup)
+        self._manifests = {}
+
+    def prepare(
+        self, chunk: list[tuple[int, dict[str, Any]]], evaluate: bool = False
+    ) -> Iterator[tuple[int, dict[str, Any], Optional[tuple[Any, ...]]]]:
+        """Attach the field values of a chunk of rows, if vectorizing.
+
+        With `evaluate`, the values are attached when not vectorizing as
+        well, evaluated one row at a time.
+        """
+        if self._options.vectorize:
+            with self.metrics.stage("interpret"):
+                batch = self._compiled.fields.evaluate_batch(
+                    [row for _, row in chunk]
+                )
+        elif evaluate:
+            with self.metrics.stage("interpret"):
+                batch = [
+                    tuple(self._compiled.fields.evaluate(row).values())
+                    for _, row in chunk
+                ]
+        else:
+            batch = itertools.repeat(None)
+        for (idx, row), values in zip(chunk, batch):
+            yield idx, row, values
+
+    def __call__(
+        self,
+        idx: int,
+        row: dict[str, Any],
+        values: Optional[tuple[Any, ...]] = None,
+        source: Optional[pathlib.Path] = None,
+    ) -> Optional[dict[str, Any]]:
+        """Populate the form for a single row and report its status.
+
+        Returns the manifest entry of the populated output, or `None` if the
+        row was skipped because its output is up to date or was merged.
+        `source` is as for `fill`.
+        """
+        output = self.fill(idx, row, values, source)
+        if output is None:
+            return None
+        try:
+            if output.source is not None:
+                self.reuse(output)
+            else:
+                with self.metrics.stage("write"):
+                    pdfpop.pdf.write_form(
+                        output.template, output.populated, output.path
+                    )
+        except Exception:
+            self.forget(output)
+            raise
+        return self.finish(output)
+
+    def fill(
+        self,
+        idx: int,
+        row: dict[str, Any],
+        values: Optional[tuple[Any, ...]] = None,
+        source: Optional[pathlib.Path] = None,
+    ) -> Optional[_Output]:
+        """Populate the form for a single row without writing it.
+
+        Returns `None` if the row was skipped because its output is up to
+        date or was merged. If an earlier row has an identical output, the
+        form is not populated and the output has that output as `source`.
+        When de-duplicating, `source` is an identical output that was written
+        elsewhere (e.g., by another worker).
+        """
+        with self.metrics.stage("interpret"):
+            io = self._compiled.io.evaluate(row)
+        form_path = pathlib.Path(io["form"])
+        template = self.templates.get(form_path, self.metrics)
+        if self._writer is not None:
+            self._log_start(form_path, idx)
+            row_fields = self._fields(row, values)
+            with self.metrics.stage("merge"):
+                self._writer.add(template, row_fields)
+            self._log_end(
+                'Populated form added to "%s".',
+                self._writer.path,
+                idx,
+                row_fields,
+            )
+            return None
         output_path = pathlib.Path(io["output_dir"]) / io["output_name"]
-        _run_single_row(form_path, row_fields, output_path)
-        print(f'Populated form saved to "{output_path}".')
+        options = self._options.content(template)
+        entry = pdfpop.manifest.make_entry(
+            idx, row, self._config_digest, template.digest, output_path, options
+        )
+        if self._options.resume and self._manifest(output_path).is_current(
+            entry
+        ):
+            logger.info(
+                'Skipping row %d: "%s" is up to date.', idx + 1, output_path
+            )
+            return None
+        self._log_start(form_path, idx)
+        row_fields = self._fields(row, values)
+        if self.outputs is not None:
+            key = pdfpop.dedup.make_key(template.digest, options, row_fields)
+            if source is not None:
+                self.outputs.add(key, source)
+            source = self.outputs.get(key)
+            if source is not None:
+                self.outputs.add(key, output_path)
+                return _Output(
+                    idx, template, None, output_path, entry, row_fields, source
+                )
+        with self.metrics.stage("fill"):
+            populated = template.fill(
+                row_fields,
+                self._options.incremental,
+                self._options.appearances,
+                self._options.flatten,
+            )
+        if self.outputs is not None:
+            self.outputs.add(key, output_path)
+        return _Output(idx, template, populated, output_path, entry, row_fields)
 
+    def output_key(
+        self, row: dict[str, Any], values: tuple[Any, ...]
+    ) -> tuple[str, pathlib.Path]:
+        """Return the de-duplication key and the output path of a row."""
+        with self.metrics.stage("interpret"):
+            io = self._compiled.io.evaluate(row)
+        template = self.templates.get(pathlib.Path(io["form"]), self.metrics)
+        key = pdfpop.dedup.make_key(
+            template.digest,
+            self._options.content(template),
+            self._compiled.fields.bind(values),
+        )
+        return key, pathlib.Path(io["output_dir"]) / io["output_name"]
 
-def _build_data_dict(data_path: pathlib.Path) -> dict:
-    """Build a data frame from a CSV file."""
-    if not data_path.exists():
-        raise FileNotFoundError(
-            errno.ENOENT, os.strerror(errno.ENOENT), str(data_path)
+    def reuse(self, output: _Output) -> None:
+        """Write an output by reusing the identical output of its source."""
+        with self.metrics.stage("write"):
+            self.outputs.reuse(output.source, output.path)
+
+    def forget(self, output: _Output) -> None:
+        """Stop reusing an output, e.g., because it failed to be written."""
+        if self.outputs is not None:
+            self.outputs.discard(output.path)
+
+    def finish(self, output: _Output) -> dict[str, Any]:
+        """Report that an output was written and return its manifest entry."""
+        self._log_end(
+            'Identical populated form reused for "%s".'
+            if output.source is not None
+            else 'Populated form saved to "%s".',
+            output.path,
+            output.idx,
+            output.fields,
         )
-    if data_path.suffix in [".xls", ".xlsx"]:
-        df = pd.read_excel(data_path, header=0)
-        df = df.where(pd.notnull(df), None).fillna("").astype(str)
-        return df.to_dict("records")
-    else:
-        raise RuntimeError("Unsupported data file type: {data_path.suffix}.")
+        return output.entry
+
+    def _log_start(self, form_path: pathlib.Path, idx: int) -> None:
+        """Log that a row is being populated."""
+        logger.log(
+            self._status_level,
+            'Populating form "%s" for row %d.',
+            form_path,
+            idx + 1,
+        )
+
+    def _log_end(
+        self,
+        message: str,
+        output_path: pathlib.Path,
+        idx: int,
+        row_fields: dict[str, Any],
+    ) -> None:
+        """Log that a row was populated, or its summary."""
+        logger.log(self._status_level, message, output_path)
+        if self._options.summary:
+            logger.info(
+                'Row %d: set %d and ignored %d fields in "%s".',
+                idx + 1,
+                len(row_fields),
+                len(self._compiled.fields.ignored),
+                output_path,
+            )
+
+    def _fields(
+        self, row: dict[str, Any], values: Optional[tuple[Any, ...]]
+    ) -> dict[str, Any]:
+        """Return the field values of a row, logging each of them."""
+        with self.metrics.stage("interpret"):
+            if values is None:
+                fields = self._compiled.fields.evaluate(row, verbose=True)
+            else:
+                fields = self._compiled.fields.bind(values, verbose=True)
+        self.metrics.count_fields(
+            len(fields), len(self._compiled.fields.ignored)
+        )
+        return fields
+
+    def _manifest(self, output_path: pathlib.Path) -> pdfpop.manifest.Manifest:
+        """Return the loaded manifest for the directory of an output."""
+        output_dir = output_path.parent
+        if output_dir not in self._manifests:
+            manifest = pdfpop.manifest.Manifest(output_dir)
+            manifest.load()
+            self._manifests[output_dir] = manifest
+        return self._manifests[output_dir]
+
+
+_WORKER_RUNNER: Optional[_RowRunner] = None
+_WORKER_LOG: Optional[pdfpop.log.RecordBuffer] = None
+
+
+def _run_serial(
+    runner: _RowRunner,
+    rows: Iterator[tuple[int, dict[str, Any]]],
+    results: _Results,
+    metrics: pdfpop.metrics.Metrics,
+) -> None:
+    """Populate indexed rows in this process."""
+    for chunk in _chunked(rows, BATCH_SIZE):
+        for idx, row, values in runner.prepare(chunk):
+            try:
+                with metrics.row(idx):
+                    entry = runner(idx, row, values)
+            except Exception as e:
+                results.fail(idx, _failure_message(idx, e))
+            else:
+                results.record(idx, entry)
+
+
+def _run_pipelined(
+    runner: _RowRunner,
+    rows: Iterator[tuple[int, dict[str, Any]]],
+    results: _Results,
+    metrics: pdfpop.metrics.Metrics,
+    io_threads: int,
+) -> None:
+    """Populate indexed rows in this process, overlapping reading and writing.
+
+    Rows are read ahead by a reader thread, while mappings are evaluated and
+    forms populated and rendered in this thread (both hold the GIL). The
+    rendered outputs are written by `io_threads` threads. Each queue holds at
+    most `pdfpop.pipeline.PIPELINE_DEPTH` rows. The messages of each row are
+    deferred until its output is written, so that they are logged in row
+    order as in a serial run. The time of each row in `metrics` includes the
+    time its output took to write, but not the time it waited to be written.
+    """
+    pending = collections.deque()
+    timings = {}
+
+    def finish_oldest() -> None:
+        idx, output, records, future = pending.popleft()
+        pdfpop.log.replay(records)
+        try:
+            seconds = future.result()
+        except Exception as e:
+            metrics.finish_row(timings.pop(idx), failed=True)
+            results.fail(idx, _failure_message(idx, e))
+            if output is not None:
+                runner.forget(output)
+        else:
+            metrics.finish_row(timings.pop(idx), seconds or 0.0)
+            results.record(
+                idx, None if output is None else runner.finish(output)
+            )
+
+    def reuse(
+        output: _Output, source: Optional[concurrent.futures.Future]
+    ) -> float:
+        if source is not None and source.exception() is not None:
+            raise RuntimeError(
+                f'Identical output "{output.source}" was not written.'
+            )
+        start = time.perf_counter()
+        runner.reuse(output)
+        return time.perf_counter() - start
+
+    def write(output: _Output, data: tuple[pdfpop.pdf.Chunk, ...]) -> float:
+        start = time.perf_counter()
+        _write_output(output.path, data, metrics)
+        return time.perf_counter() - start
+
+    with contextlib.ExitStack() as stack:
+        executor = stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=io_threads, thread_name_prefix="pdfpop-write"
+            )
+        )
+        rows = stack.enter_context(
+            contextlib.closing(pdfpop.pipeline.read_ahead(rows))
+        )
+        for chunk in _chunked(rows, BATCH_SIZE):
+            for idx, row, values in runner.prepare(chunk):
+                future = concurrent.futures.Future()
+                output = None
+                try:
+                    with pdfpop.log.deferred() as records, metrics.row(
+                        idx, deferred=True
+                    ) as row_metrics:
+                        output = runner.fill(idx, row, values)
+                        if output is not None and output.source is None:
+                            with metrics.stage("render"):
+                                data = pdfpop.pdf.render_form(
+                                    output.template, output.populated
+                                )
+                except Exception as e:
+                    if output is not None:
+                        runner.forget(output)
+                    output = None
+                    future.set_exception(e)
+                else:
+                    if output is None:
+                        future.set_result(None)
+                    else:
+                        # Outputs that share a path, as their own or as the
+                        # output they reuse, are written in row order.
+                        source = _last_write(pending, output.source)
+                        paths = _paths(output)
+                        while any(
+                            pending_output is not None
+                            and paths & _paths(pending_output)
+                            for _, pending_output, _, _ in pending
+                        ):
+                            finish_oldest()
+                        if output.source is not None:
+                            future = executor.submit(reuse, output, source)
+                        else:
+                            future = executor.submit(write, output, data)
+                timings[idx] = row_metrics
+                pending.append((idx, output, records.drain(), future))
+                while len(pending) > pdfpop.pipeline.PIPELINE_DEPTH:
+                    finish_oldest()
+        while pending:
+            finish_oldest()
+
 
+def _paths(output: _Output) -> set[pathlib.Path]:
+    """Return the paths that writing an output reads or writes."""
+    if output.source is None:
+        return {output.path}
+    return {output.path, output.source}
 
-def _strip_field_type(fields: dict[str, str]) -> dict[str, str]:
-    """Strip the bracket enclosed field type from the field name."""
-    return {k.split(" [")[0]: v for k, v in fields.items()}
 
+def _last_write(
+    pending: Iterable[
+        tuple[int, Optional[_Output], Any, concurrent.futures.Future]
+    ],
+    path: Optional[pathlib.Path],
+) -> Optional[concurrent.futures.Future]:
+    """Return the future of the last pending output written to a path."""
+    future = None
+    for _, output, _, pending_future in pending:
+        if output is not None and output.source is None and output.path == path:
+            future = pending_future
+    return future
 
-def _run_single_row(
-    form: pathlib.Path, row: dict[str, Any], output_path: pathlib.Path
+
+class _Dispatcher:
+    """The rows to submit to worker processes, in chunks.
+
+    With a runner, the output of each row is de-duplicated here, across
+    workers: rows whose output is identical to that of a row being populated
+    are held back until it is written, then submitted with its output as the
+    source to reuse. If that row fails, the next identical row is populated
+    instead. Rows that write to the output of such a row no longer reuse it.
+    At most `max_held` rows are held back before reading stops.
+    """
+
+    def __init__(
+        self,
+        rows: Iterator[tuple[int, dict[str, Any]]],
+        runner: Optional[_RowRunner] = None,
+        max_held: int = 0,
+    ) -> None:
+        """Initialize the dispatcher of indexed rows."""
+        self._rows = rows
+        self._runner = runner
+        self._max_held = max_held
+        self._ready = collections.deque()
+        self._sources = {}
+        self._held = {}
+        self._held_rows = 0
+        self._index = None if runner is None else runner.outputs
+
+    def chunk(self, size: int) -> list[tuple]:
+        """Return the next chunk of at most `size` rows to submit.
+
+        Without a runner, the rows are `(idx, row)` pairs. Otherwise, they
+        are `(idx, row, values, source)` (see `_RowRunner.fill`). The chunk
+        is empty once every row was submitted, or while too many are held.
+        """
+        if self._runner is None:
+            return list(itertools.islice(self._rows, size))
+        chunk = []
+        while len(chunk) < size:
+            while self._ready and len(chunk) < size:
+                chunk.append(self._ready.popleft())
+            if len(chunk) == size or self._held_rows >= self._max_held:
+                break
+            rows = list(itertools.islice(self._rows, size - len(chunk)))
+            if not rows:
+                break
+            for idx, row, values in self._runner.prepare(rows, evaluate=True):
+                self._route(idx, row, values)
+        return chunk
+
+    def finish(self, idx: int, written: bool) -> None:
+        """Release the rows held back for a row that finished.
+
+        If its output was `written` (or is up to date), they reuse it.
+        """
+        source = self._sources.pop(idx, None)
+        if source is None:
+            return
+        key, path = source
+        held = self._held.pop(key)
+        self._held_rows -= len(held)
+        if written:
+            self._index.add(key, path)
+            self._ready.extend((i, r, v, path) for i, r, v, _ in held)
+        elif held:
+            self._populate(key, *held.pop(0))
+            self._held[key] = held
+            self._held_rows += len(held)
+
+    def _route(
+        self, idx: int, row: dict[str, Any], values: tuple[Any, ...]
+    ) -> None:
+        """Submit a row, with the output it reuses, or hold it back."""
+        try:
+            key, path = self._runner.output_key(row, values)
+        except Exception:
+            # The row fails in its worker, which reports why.
+            self._ready.append((idx, row, values, None))
+            return
+        for other, (other_key, other_path) in list(self._sources.items()):
+            if other_path == path and other_key != key:
+                self._cancel(other)
+        if key in self._held:
+            self._held[key].append((idx, row, values, path))
+            self._held_rows += 1
+            return
+        source = self._index.get(key)
+        if source != path:
+            self._index.discard(path)
+        if source is not None:
+            self._ready.append((idx, row, values, source))
+        else:
+            self._populate(key, idx, row, values, path)
+
+    def _populate(
+        self,
+        key: str,
+        idx: int,
+        row: dict[str, Any],
+        values: tuple[Any, ...],
+        path: pathlib.Path,
+    ) -> None:
+        """Submit a row to be populated as the source of a key."""
+        self._sources[idx] = key, path
+        self._held.setdefault(key, [])
+        self._ready.append((idx, row, values, None))
+
+    def _cancel(self, idx: int) -> None:
+        """Stop holding rows back for a row whose output is overwritten."""
+        key, _ = self._sources.pop(idx)
+        held = self._held.pop(key)
+        self._held_rows -= len(held)
+        if held:
+            self._populate(key, *held.pop(0))
+            self._held[key] = held
+            self._held_rows += len(held)
+
+
+def _run_parallel(
+    config_path: pathlib.Path,
+    columns: list[str],
+    dispatcher: _Dispatcher,
+    jobs: int,
+    options: OutputOptions,
+    cache_limits: tuple[int, int],
+    use_artifact: bool,
+    results: _Results,
+    output_stats: collections.Counter,
+    metrics: pdfpop.metrics.Metrics,
 ) -> None:
-    """Run a single row of data."""
-    pdfpop.pdf.populate_form(form, row, output_path)
+    """Populate the rows of a dispatcher in worker processes.
+
+    The `options` are those of each worker's `_RowRunner`, and the
+    `cache_limits` those of its template cache. With
+    `use_artifact`, workers load the compiled artifact of the configuration.
+    Workers log at the level of the pdfpop logger and the messages of each
+    row are logged here in row order.
+
+    Rows are submitted in chunks with a bounded number of chunks in flight so
+    that memory use does not depend on the number of rows. The metrics
+    recorded by the workers are merged into `metrics` and the statistics of
+    their output indexes added to `output_stats`.
+    """
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=_init_worker,
+        initargs=(
+            config_path,
+            columns,
+            options,
+            cache_limits,
+            use_artifact,
+            metrics.enabled,
+            logging.getLogger(pdfpop.log.LOGGER_NAME).getEffectiveLevel(),
+        ),
+    ) as executor:
+
+        def submit() -> bool:
+            chunk = dispatcher.chunk(WORKER_CHUNK_SIZE)
+            if chunk:
+                pending.append(executor.submit(_run_worker_rows, chunk))
+            return bool(chunk)
+
+        while len(pending) < jobs * 2 and submit():
+            pass
+        while pending:
+            rows_done, stats, snapshot = pending.popleft().result()
+            if snapshot is not None:
+                metrics.merge(snapshot)
+            if stats is not None:
+                output_stats.update(stats)
+            for idx, records, error, entry in rows_done:
+                dispatcher.finish(idx, error is None)
+                pdfpop.log.replay(records)
+                if error is not None:
+                    results.fail(idx, error)
+                else:
+                    results.record(idx, entry)
+            while len(pending) < jobs * 2 and submit():
+                pass
+
+
+def _chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of at most `size` items from an iterable."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _init_worker(
+    config_path: pathlib.Path,
+    columns: list[str],
+    options: OutputOptions,
+    cache_limits: tuple[int, int],
+    use_artifact: bool,
+    metrics_enabled: bool,
+    log_level: int,
+) -> None:
+    """Load and compile the configuration once per worker process."""
+    global _WORKER_LOG
+    global _WORKER_RUNNER
+    _WORKER_LOG = pdfpop.log.capture(log_level)
+    form_cfg = pdfpop.form_config.FormConfig(config_path)
+    form_cfg.load()
+    artifact = pdfpop.artifact.load(form_cfg) if use_artifact else None
+    compiled = pdfpop.form_config.CompiledConfig(
+        form_cfg, columns, None if artifact is None else artifact.expressions
+    )
+    _WORKER_RUNNER = _RowRunner(
+        compiled,
+        form_cfg.digest,
+        options,
+        templates=_template_cache(cache_limits, artifact),
+    )
+    if metrics_enabled:
+        _WORKER_RUNNER.metrics = pdfpop.metrics.Metrics()
+
+
+def _template_cache(
+    cache_limits: tuple[int, int],
+    artifact: Optional[pdfpop.artifact.Artifact],
+) -> pdfpop.cache.TemplateCache:
+    """Return a template cache that holds the templates of an artifact."""
+    templates = pdfpop.cache.TemplateCache(*cache_limits)
+    if artifact is not None:
+        for form_path, template in artifact.templates.items():
+            templates.add(form_path, template)
+    return templates
+
+
+def _run_worker_rows(
+    chunk: list[tuple],
+) -> tuple[
+    list[
+        tuple[
+            int,
+            list[pdfpop.log.LogRecord],
+            Optional[str],
+            Optional[dict[str, Any]],
+        ]
+    ],
+    Optional[dict[str, int]],
+    Optional[dict[str, Any]],
+]:
+    """Populate a chunk of rows (see `_Dispatcher.chunk`) in a worker.
+
+    Returns the log records, error message and manifest entry of each row,
+    the statistics of the output index (if de-duplicating) and a snapshot of
+    the metrics recorded for the chunk (if enabled).
+    """
+    metrics = _WORKER_RUNNER.metrics
+    if metrics.enabled:
+        metrics = _WORKER_RUNNER.metrics = pdfpop.metrics.Metrics()
+    if chunk and len(chunk[0]) == 2:
+        chunk = [(*row, None) for row in _WORKER_RUNNER.prepare(chunk)]
+    results = []
+    for idx, row, values, source in chunk:
+        error, entry = None, None
+        try:
+            with metrics.row(idx):
+                entry = _WORKER_RUNNER(idx, row, values, source)
+        except Exception as e:
+            error = _failure_message(idx, e)
+        results.append((idx, _WORKER_LOG.drain(), error, entry))
+    metrics.count_cache("templates", _WORKER_RUNNER.templates.drain_stats())
+    stats = None
+    if _WORKER_RUNNER.outputs is not None:
+        stats = _WORKER_RUNNER.outputs.drain_stats()
+    return results, stats, metrics.snapshot() if metrics.enabled else None
+
+
+def _format_rows(rows: list[int]) -> str:
+    """Return sorted row (or shard) numbers with runs shown as ranges."""
+    ranges = []
+    for _, group in itertools.groupby(
+        enumerate(rows), lambda item: item[1] - item[0]
+    ):
+        numbers = [number for _, number in group]
+        if len(numbers) == 1:
+            ranges.append(str(numbers[0]))
+        else:
+            ranges.append(f"{numbers[0]}-{numbers[-1]}")
+    return ", ".join(ranges)
+
+
+def _failure_message(idx: int, error: Exception) -> str:
+    """Return the status message for a row that failed to populate."""
+    return f"Failed to populate row {idx+1}: {type(error).__name__}: {error}"
+
+
+def _write_output(
+    output_path: pathlib.Path,
+    data: tuple[pdfpop.pdf.Chunk, ...],
+    metrics: pdfpop.metrics.Metrics = pdfpop.metrics.NULL_METRICS,
+) -> None:
+    """Write the chunks of a rendered PDF to a new file (see `write_form`)."""
+    with metrics.stage("write"):
+        output_path.unlink(missing_ok=True)
+        with output_path.open("wb") as f:
+            for chunk in data:
+                f.write(chunk)
+
+
+def _timed_rows(
+    rows: Iterator[dict[str, Any]], metrics: pdfpop.metrics.Metrics
+) -> Iterator[dict[str, Any]]:
+    """Yield rows, recording the time spent reading them as a stage."""
+    while True:
+        with metrics.stage("load"):
+            row = next(rows, None)
+        if row is None:
+            return
+        yield row
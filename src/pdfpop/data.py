@@ -0,0 +1,257 @@
+"""Data file handling for pdfpop.
+
+Rows are read lazily so that memory use does not grow with the number of rows
+in the data file. Every value is provided as a string, with missing values as
+empty strings. Each value is converted on its own, so that whole numbers are
+read without a decimal part (e.g., "45") whatever the other values of their
+column. Duplicate column names are made unique with a numbered suffix (e.g.,
+"Name.1"), and unnamed columns are named after their position (e.g.,
+"Unnamed: 4").
+"""
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Iterable,
+    Iterator,
+    Optional,
+    TextIO,
+)
+import csv
+import errno
+import json
+import math
+import os
+import pathlib
+import sys
+
+
+STDIN_PATH = pathlib.Path("-")
+PARQUET_BATCH_SIZE = 1024
+
+ColumnSelector = Callable[[list[str]], Optional[Collection[str]]]
+
+
+def read_rows(
+    data_path: pathlib.Path, select_columns: Optional[ColumnSelector] = None
+) -> Iterator[dict[str, str]]:
+    """Lazily read the rows of a data file (or stdin if the path is `-`).
+
+    If given, `select_columns` is called with the header of the data file
+    once it has been read and returns the columns to read, or `None` to read
+    every column. Columns that are not selected are never converted.
+    """
+    if data_path == STDIN_PATH:
+        return _read_stdin(sys.stdin, select_columns)
+    if not data_path.exists():
+        raise FileNotFoundError(
+            errno.ENOENT, os.strerror(errno.ENOENT), str(data_path)
+        )
+    readers = _get_readers()
+    if data_path.suffix not in readers:
+        raise RuntimeError(f"Unsupported data file type: {data_path.suffix}.")
+    return readers[data_path.suffix](data_path, select_columns)
+
+
+def _get_readers() -> dict:
+    """Return a dictionary of file suffix to row reader function."""
+    return {
+        ".csv": _read_csv,
+        ".jsonl": _read_json_lines,
+        ".parquet": _read_parquet,
+        ".xls": _read_xls,
+        ".xlsx": _read_xlsx,
+    }
+
+
+def _read_csv(
+    data_path: pathlib.Path, select_columns: Optional[ColumnSelector]
+) -> Iterator[dict[str, str]]:
+    """Read rows from a CSV file with a header row."""
+    with data_path.open(newline="", encoding="utf-8-sig") as f:
+        yield from _csv_rows(f, select_columns)
+
+
+def _read_json_lines(
+    data_path: pathlib.Path, select_columns: Optional[ColumnSelector]
+) -> Iterator[dict[str, str]]:
+    """Read rows from a JSON Lines file of objects."""
+    with data_path.open(encoding="utf-8") as f:
+        yield from _json_lines_rows(f, select_columns)
+
+
+def _read_parquet(
+    data_path: pathlib.Path, select_columns: Optional[ColumnSelector]
+) -> Iterator[dict[str, str]]:
+    """Read rows from a Parquet file one record batch at a time."""
+    try:
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError(
+            "Reading Parquet data files requires the pyarrow package."
+        ) from e
+    parquet = pyarrow.parquet.ParquetFile(data_path)
+    columns = _select(parquet.schema_arrow.names, select_columns)
+    batches = parquet.iter_batches(
+        batch_size=PARQUET_BATCH_SIZE, columns=columns
+    )
+    for batch in batches:
+        values = [column.to_pylist() for column in batch.columns]
+        for row in zip(*values):
+            yield {k: _to_str(v) for k, v in zip(columns, row)}
+
+
+def _read_xlsx(
+    data_path: pathlib.Path, select_columns: Optional[ColumnSelector]
+) -> Iterator[dict[str, str]]:
+    """Stream rows from the first sheet of a Microsoft Excel workbook.
+
+    Blank rows are read as rows of empty values, so that rows keep their
+    index, except at the end of the sheet.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(data_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # Rows are read whatever the recorded dimensions, which may be wrong,
+        # but columns with an empty header still count when they are in them.
+        width = sheet.max_column or 0
+        sheet.reset_dimensions()
+        values = sheet.iter_rows(values_only=True)
+        header = next(values, None)
+        if header is None:
+            return
+        header = _unique_header(header + (None,) * (width - len(header)))
+        columns = _select(header, select_columns)
+        indexes = [header.index(column) for column in columns]
+        blank_rows = 0
+        for row in values:
+            if all(value is None for value in row):
+                blank_rows += 1
+                continue
+            for _ in range(blank_rows):
+                yield dict.fromkeys(columns, "")
+            blank_rows = 0
+            yield {
+                column: _to_str(row[idx] if idx < len(row) else None)
+                for column, idx in zip(columns, indexes)
+            }
+    finally:
+        workbook.close()
+
+
+def _read_xls(
+    data_path: pathlib.Path, select_columns: Optional[ColumnSelector]
+) -> Iterator[dict[str, str]]:
+    """Read rows from the first sheet of a legacy Microsoft Excel workbook.
+
+    Values are converted one by one, as for `.xlsx` workbooks, rather than by
+    column.
+    """
+    import pandas as pd
+
+    header = pd.read_excel(data_path, header=0, nrows=0).columns
+    names = _unique_header(header)
+    if not names:
+        return
+    columns = _select(names, select_columns)
+    # Columns are selected by position, since pandas may read their names as
+    # numbers or dates. An empty selection would read every column, so the
+    # first column is read to count the rows instead.
+    positions = [names.index(column) for column in columns] or [0]
+    df = pd.read_excel(data_path, header=0, usecols=positions, dtype=object)
+    for row in df.itertuples(index=False, name=None):
+        yield {column: _to_str(value) for column, value in zip(columns, row)}
+
+
+def _read_stdin(
+    stream: TextIO, select_columns: Optional[ColumnSelector]
+) -> Iterator[dict[str, str]]:
+    """Read JSON Lines (if the first line is an object) or CSV from a stream."""
+    first_line = stream.readline()
+    lines = _prepend(first_line, stream)
+    if first_line.lstrip().startswith("{"):
+        yield from _json_lines_rows(lines, select_columns)
+    else:
+        yield from _csv_rows(lines, select_columns)
+
+
+def _csv_rows(
+    lines: Iterator[str], select_columns: Optional[ColumnSelector]
+) -> Iterator[dict[str, str]]:
+    """Yield rows from CSV lines with a header row."""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = _unique_header(header)
+    columns = _select(header, select_columns)
+    indexes = [header.index(column) for column in columns]
+    for row in reader:
+        if not row:
+            continue
+        yield {
+            column: row[idx] if idx < len(row) else ""
+            for column, idx in zip(columns, indexes)
+        }
+
+
+def _json_lines_rows(
+    lines: Iterator[str], select_columns: Optional[ColumnSelector]
+) -> Iterator[dict[str, str]]:
+    """Yield rows from JSON Lines using the keys of the first object."""
+    columns = None
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if columns is None:
+            columns = _select(list(record), select_columns)
+        yield {k: _to_str(record.get(k)) for k in columns}
+
+
+def _select(
+    header: list[str], select_columns: Optional[ColumnSelector]
+) -> list[str]:
+    """Return the header columns that should be read, in header order."""
+    selected = select_columns(header) if select_columns else None
+    if selected is None:
+        return header
+    return [column for column in header if column in selected]
+
+
+def _unique_header(header: Iterable[Any]) -> list[str]:
+    """Return the column names of a header row, unique and named.
+
+    Unnamed columns are named after their position, and repeated names are
+    numbered from the second one on (e.g., "Name", "Name.1").
+    """
+    names = [
+        f"Unnamed: {idx}" if name is None or name == "" else str(name)
+        for idx, name in enumerate(header)
+    ]
+    counts = {}
+    for idx, name in enumerate(names):
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        names[idx] = name
+        counts[name] = count + 1
+    return names
+
+
+def _prepend(line: str, stream: TextIO) -> Iterator[str]:
+    """Yield the given line followed by the remaining lines of a stream."""
+    if line:
+        yield line
+    yield from stream
+
+
+def _to_str(value: Any) -> str:
+    """Convert a data value to a string, treating missing values as empty."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value)
@@ -0,0 +1,121 @@
+"""De-duplication of populated outputs.
+
+Rows that set the same fields of the same form to the same values produce
+the same PDF. With de-duplication, the first of these rows is populated and
+written as usual, and the outputs of later rows are made from its output
+instead: as a hard link, a reflink (a copy-on-write clone, on file systems
+that support it) or a plain copy. Each method falls back to the next one when
+the file system does not support it.
+
+Outputs are always written as new files rather than overwritten in place (see
+`pdfpop.pdf.write_form`), so that writing an output never changes the files
+it is linked to.
+"""
+from typing import Any, Optional
+import errno
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+
+
+HARDLINK = "hardlink"
+REFLINK = "reflink"
+COPY = "copy"
+METHODS = (HARDLINK, REFLINK, COPY)
+
+# The FICLONE ioctl of Linux, which clones a file into another.
+_FICLONE = 0x40049409
+
+
+class OutputIndex:
+    """Index of the outputs written so far, keyed by their content."""
+
+    def __init__(self, method: str = HARDLINK) -> None:
+        """Initialize an empty index that reuses outputs with `method`."""
+        if method not in METHODS:
+            raise RuntimeError(f"Unknown de-duplication method: {method}.")
+        self._method = method
+        self._paths = {}
+        self._keys = {}
+        self._stats = _empty_stats()
+
+    def get(self, key: str) -> Optional[pathlib.Path]:
+        """Return the output written with a key, if any, counting a hit."""
+        path = self._paths.get(key)
+        self._stats["hits" if path is not None else "misses"] += 1
+        return path
+
+    def add(self, key: str, path: pathlib.Path) -> None:
+        """Record that an output is (about to be) written with a key."""
+        self.discard(path)
+        if key not in self._paths:
+            self._paths[key] = path
+            self._keys[path] = key
+
+    def discard(self, path: pathlib.Path) -> None:
+        """Forget an output, e.g., because it is overwritten or failed."""
+        key = self._keys.pop(path, None)
+        if key is not None:
+            del self._paths[key]
+
+    def reuse(self, source: pathlib.Path, target: pathlib.Path) -> None:
+        """Make an output from the output of an earlier row."""
+        if source != target:
+            reuse(source, target, self._method)
+
+    def drain_stats(self) -> dict[str, int]:
+        """Return and reset the hit and miss counts."""
+        stats, self._stats = self._stats, _empty_stats()
+        return stats
+
+
+def make_key(
+    form_digest: str, options: dict[str, Any], fields: dict[str, Any]
+) -> str:
+    """Return the key of the output of a form populated with fields.
+
+    `options` are the options that change the output (see
+    `pdfpop.commands.OutputOptions.content`).
+    """
+    data = json.dumps(
+        [form_digest, options, fields], sort_keys=True, default=str
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def reuse(source: pathlib.Path, target: pathlib.Path, method: str) -> None:
+    """Replace `target` with the content of `source`.
+
+    A hard link falls back to a reflink, which falls back to a copy.
+    """
+    target.unlink(missing_ok=True)
+    if method == HARDLINK:
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            pass
+    if method in (HARDLINK, REFLINK):
+        try:
+            _reflink(source, target)
+            return
+        except OSError:
+            target.unlink(missing_ok=True)
+    shutil.copyfile(source, target)
+
+
+def _reflink(source: pathlib.Path, target: pathlib.Path) -> None:
+    """Clone a file on a file system that supports copy-on-write."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+    with source.open("rb") as src, target.open("wb") as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def _empty_stats() -> dict[str, int]:
+    """Return zeroed index statistics."""
+    return {"hits": 0, "misses": 0}
@@ -1,8 +1,25 @@
 """Form configuration handling for pdfpop."""
 from __future__ import annotations
-from typing import Any
+from typing import TYPE_CHECKING, Any, Callable, Iterable, NamedTuple, Optional
+import ast
+import builtins
+import hashlib
 import json
+import logging
+import operator
 import pathlib
+import symtable
+import types
+
+if TYPE_CHECKING:
+    import pandas
+
+
+COLUMN = "column"
+LITERAL = "literal"
+EXPRESSION = "expression"
+
+logger = logging.getLogger(__name__)
 
 
 class FormConfig:
@@ -30,6 +47,12 @@ class FormConfig:
         """Configuration data getter."""
         return self._data
 
+    @property
+    def digest(self) -> str:
+        """Return the hex digest of the configuration data."""
+        data = json.dumps(self._data, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(data).hexdigest()
+
     def exists(self) -> bool:
         """Return whether the configuration exists."""
         return self._path.exists()
@@ -45,46 +68,456 @@ class FormConfig:
             self._data = json.load(f)
 
 
+class CompiledField(NamedTuple):
+    """A single configuration mapping compiled ahead of time."""
+
+    key: str
+    kind: str
+    source: Any
+    function: Callable[[dict[str, Any]], Any]
+    columns: Optional[frozenset[str]]
+
+
+class CompiledExpression(NamedTuple):
+    """The compiled code of an expression mapping and what it uses."""
+
+    code: types.CodeType
+    columns: Optional[frozenset[str]]
+    vectorizable: bool
+
+
+class CompiledSection:
+    """A configuration section with every mapping compiled once.
+
+    Each mapping is sorted by kind when the section is compiled: ignored
+    (`null`), a reference to one of the data columns, a literal value, or a
+    Python expression. Expressions are compiled into functions of `data` so
+    evaluating a row involves no source building or compilation. Strings that
+    do not compile, or that use names nothing defines (e.g., `N/A`), are
+    treated as literal text; those that were meant to be function bodies
+    (i.e., contain `return`) are recorded in `errors`. An expression that
+    fails for a row, or returns `None`, is replaced by its text with a warning.
+    """
+
+    def __init__(
+        self,
+        section: dict[str, Any],
+        columns: Iterable[str],
+        expressions: Optional[dict[str, CompiledExpression]] = None,
+    ) -> None:
+        """Compile the section for data with the given columns.
+
+        Expressions found in `expressions` (see `compile_expressions`) are
+        not compiled again.
+        """
+        columns = set(columns)
+        expressions = expressions or {}
+        vectorized = {}
+        self._fields = []
+        self._ignored = []
+        self._errors = {}
+        for key, value in section.items():
+            if value is None:
+                self._ignored.append(key)
+            elif isinstance(value, str) and value in columns:
+                self._fields.append(
+                    CompiledField(
+                        key,
+                        COLUMN,
+                        value,
+                        operator.itemgetter(value),
+                        frozenset([value]),
+                    )
+                )
+            elif not isinstance(value, str):
+                self._fields.append(_literal_field(key, value))
+            else:
+                expression = expressions.get(value)
+                try:
+                    if expression is None:
+                        expression = compile_expression(key, value)
+                except (SyntaxError, NameError) as e:
+                    if "return" in value:
+                        self._errors[key] = e
+                    else:
+                        logger.debug('Mapping for "%s" is used as text.', key)
+                    self._fields.append(_literal_field(key, value))
+                    continue
+                function = _function(expression.code)
+                self._fields.append(
+                    CompiledField(
+                        key,
+                        EXPRESSION,
+                        value,
+                        _with_fallback(key, function, value),
+                        expression.columns,
+                    )
+                )
+                if expression.vectorizable:
+                    vectorized[key] = function
+        self._vectorized = vectorized
+
+    @property
+    def fields(self) -> list[CompiledField]:
+        """Compiled (non-ignored) mappings getter."""
+        return self._fields
+
+    @property
+    def ignored(self) -> list[str]:
+        """Ignored keys getter."""
+        return self._ignored
+
+    @property
+    def errors(self) -> dict[str, Exception]:
+        """Getter for the compile errors of function body mappings."""
+        return self._errors
+
+    @property
+    def columns(self) -> Optional[frozenset[str]]:
+        """Return the data columns used by the section.
+
+        `None` is returned if an expression accesses the data in a way that
+        cannot be determined statically (e.g., `data[name]` or `data.items()`).
+        """
+        return _union_columns(field.columns for field in self._fields)
+
+    @property
+    def keys(self) -> tuple[str, ...]:
+        """Return the keys of the values produced for each row."""
+        return tuple(field.key for field in self._fields)
+
+    def evaluate(
+        self, data: dict[str, Any], verbose: bool = False
+    ) -> dict[str, Any]:
+        """Evaluate the section against a row of data."""
+        values = tuple(field.function(data) for field in self._fields)
+        return self.bind(values, verbose=verbose)
+
+    def evaluate_batch(
+        self, rows: list[dict[str, Any]]
+    ) -> list[tuple[Any, ...]]:
+        """Evaluate the section against a batch of rows.
+
+        Column and literal mappings, and expressions that only concatenate
+        columns and string constants, are resolved for the whole batch at
+        once. Other expressions (or vectorized expressions that fail) are
+        evaluated row by row. A tuple of values ordered by `keys` is returned
+        for each row.
+        """
+        batch = _BatchColumns(rows)
+        columns = []
+        for field in self._fields:
+            if field.kind == COLUMN:
+                columns.append([row[field.source] for row in rows])
+                continue
+            if field.kind == LITERAL:
+                columns.append([field.source] * len(rows))
+                continue
+            values = None
+            function = self._vectorized.get(field.key)
+            if function is not None:
+                values = _evaluate_vectorized(function, batch)
+            if values is None:
+                values = [field.function(row) for row in rows]
+            columns.append(values)
+        if not columns:
+            return [()] * len(rows)
+        return list(zip(*columns))
+
+    def bind(
+        self, values: tuple[Any, ...], verbose: bool = False
+    ) -> dict[str, Any]:
+        """Return a row's values keyed by field, logging them if verbose."""
+        interpreted = dict(zip(self.keys, values))
+        if verbose and logger.isEnabledFor(logging.DEBUG):
+            for key, value in interpreted.items():
+                logger.debug('Set field "%s" to "%s"', key, value)
+            for key in self._ignored:
+                logger.debug('Ignored field "%s"', key)
+        return interpreted
+
+
+class CompiledConfig:
+    """A form configuration compiled for data with a known set of columns."""
+
+    def __init__(
+        self,
+        form_cfg: FormConfig,
+        columns: Iterable[str],
+        expressions: Optional[dict[str, CompiledExpression]] = None,
+    ) -> None:
+        """Compile the IO and fields sections of the configuration.
+
+        `expressions` are as for `CompiledSection`.
+        """
+        columns = list(columns)
+        self._io = CompiledSection(form_cfg.data["io"], columns, expressions)
+        self._fields = CompiledSection(
+            strip_field_types(form_cfg.data["fields"]), columns, expressions
+        )
+
+    @property
+    def io(self) -> CompiledSection:
+        """Compiled IO section getter."""
+        return self._io
+
+    @property
+    def fields(self) -> CompiledSection:
+        """Compiled fields section getter."""
+        return self._fields
+
+    @property
+    def errors(self) -> dict[str, Exception]:
+        """Getter for the compile errors of both sections."""
+        return {**self._io.errors, **self._fields.errors}
+
+    @property
+    def columns(self) -> Optional[frozenset[str]]:
+        """Return the data columns used by the configuration, if known."""
+        return _union_columns([self._io.columns, self._fields.columns])
+
+
 def get_default_path(form_path: pathlib.Path) -> pathlib.Path:
     """Return the default configuration path for the specified form."""
     return pathlib.Path().cwd() / f"pdfpop-{form_path.stem}.json"
 
 
+def strip_field_types(fields: dict[str, Any]) -> dict[str, Any]:
+    """Strip the bracket enclosed field type from the field names."""
+    return {k.split(" [")[0]: v for k, v in fields.items()}
+
+
 def interpret(
     section: dict[str, Any], data: dict[str, Any], verbose: bool = False
 ) -> dict[str, Any]:
     """Interpret the configuration section."""
+    return CompiledSection(section, data).evaluate(data, verbose=verbose)
 
-    def wrap_logic(logic: str) -> str:
-        """Returns a function wrapping the given logic."""
-        if "return" in logic:
-            return f"def fn(data):\n    {logic}\nrv = fn(data)\n"
-        return f"rv = {logic}\n"
-
-    interpreted = {}
-    ignore_list = []
-    for key, value in section.items():
-        if value is None:
-            ignore_list.append(key)
-            continue
-        elif value in data:
-            interpreted[key] = data[value]
-        elif isinstance(value, int) or isinstance(value, float):
-            interpreted[key] = value
-        else:
-            global_env = {}
-            local_env = {"data": data, "rv": None}
-            expr = wrap_logic(value)
-            try:
-                exec(expr, global_env, local_env)
-            except Exception as e:
-                pass
-            interpreted[key] = (
-                local_env["rv"] if local_env["rv"] is not None else value
+
+def compile_expressions(
+    form_cfg: FormConfig,
+) -> dict[str, CompiledExpression]:
+    """Compile every mapping of a configuration that is an expression.
+
+    The result is keyed by the source of each expression. Mappings that do
+    not compile (see `compile_expression`) are left out.
+    """
+    expressions = {}
+    for section in (form_cfg.data["io"], form_cfg.data["fields"]):
+        for key, value in section.items():
+            if isinstance(value, str) and value not in expressions:
+                try:
+                    expressions[value] = compile_expression(key, value)
+                except (SyntaxError, NameError):
+                    pass
+    return expressions
+
+
+def compile_expression(key: str, logic: str) -> CompiledExpression:
+    """Compile mapping logic into the code of a function of the row data.
+
+    Logic containing `return` is used as a function body, anything else as an
+    expression. The data columns the logic uses, and whether it can be
+    evaluated on whole columns, are determined as well. Raises a `SyntaxError`
+    if the logic is not valid Python, or a `NameError` if it uses a name that
+    neither it, `data` nor the builtins define.
+    """
+    if "return" in logic:
+        source = f"def fn(data):\n    {logic}\n"
+    else:
+        source = f"def fn(data):\n    return {logic}\n"
+    tree = ast.parse(source, f"<{key}>")
+    undefined = _undefined_names(source, f"<{key}>")
+    if undefined:
+        raise NameError(f"name '{min(undefined)}' is not defined")
+    return CompiledExpression(
+        compile(tree, f"<{key}>", "exec"),
+        _referenced_columns(tree),
+        _is_vectorizable(logic),
+    )
+
+
+def _constant(value: Any) -> Callable[[dict[str, Any]], Any]:
+    """Return a mapping function that always returns the given value."""
+    return lambda data: value
+
+
+def _literal_field(key: str, value: Any) -> CompiledField:
+    """Return a compiled mapping for a literal value."""
+    return CompiledField(key, LITERAL, value, _constant(value), frozenset())
+
+
+def _union_columns(
+    columns: Iterable[Optional[frozenset[str]]],
+) -> Optional[frozenset[str]]:
+    """Return the union of column sets, or `None` if any is unknown."""
+    union = set()
+    for used in columns:
+        if used is None:
+            return None
+        union |= used
+    return frozenset(union)
+
+
+def _function(code: types.CodeType) -> Callable[[dict[str, Any]], Any]:
+    """Return the function of the row data defined by compiled logic."""
+    namespace = {}
+    exec(code, namespace)
+    return namespace["fn"]
+
+
+def _with_fallback(
+    key: str, fn: Callable[[dict[str, Any]], Any], logic: str
+) -> Callable[[dict[str, Any]], Any]:
+    """Return a mapping function that falls back to the logic string.
+
+    The logic string is used, with a warning, when evaluation fails or
+    returns `None`.
+    """
+
+    def evaluate(data: dict[str, Any]) -> Any:
+        try:
+            rv = fn(data)
+        except Exception as e:
+            logger.warning(
+                'Mapping for "%s" failed (%s: %s) and is used as text.',
+                key,
+                type(e).__name__,
+                e,
             )
-        if verbose:
-            print(f'Set field "{key}" to "{interpreted[key]}"')
-    if verbose:
-        for key in ignore_list:
-            print(f'Ignored field "{key}"')
-    return interpreted
+            return logic
+        if rv is None:
+            logger.warning(
+                'Mapping for "%s" returned None and is used as text.', key
+            )
+            return logic
+        return rv
+
+    return evaluate
+
+
+def _undefined_names(source: str, filename: str) -> set[str]:
+    """Return the global names that source uses but does not define."""
+    module = symtable.symtable(source, filename, "exec")
+    defined = set(dir(builtins))
+    defined.update(
+        symbol.get_name()
+        for symbol in module.get_symbols()
+        if symbol.is_assigned() or symbol.is_imported()
+    )
+    used = set()
+    pending = list(module.get_children())
+    while pending:
+        table = pending.pop()
+        pending.extend(table.get_children())
+        used.update(
+            symbol.get_name()
+            for symbol in table.get_symbols()
+            if symbol.is_global() and symbol.is_referenced()
+        )
+    return used - defined
+
+
+def _is_vectorizable(logic: str) -> bool:
+    """Return whether an expression can be evaluated on whole columns.
+
+    Only expressions that concatenate `data["name"]` columns and string
+    constants are vectorized, since those behave the same on a column of
+    strings as on a single string.
+    """
+    try:
+        tree = ast.parse(logic, mode="eval")
+    except SyntaxError:
+        return False
+    uses_data = False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript):
+            if not (
+                isinstance(node.value, ast.Name)
+                and node.value.id == "data"
+                and isinstance(node.slice, ast.Constant)
+            ):
+                return False
+            uses_data = True
+        elif isinstance(node, ast.BinOp):
+            if not isinstance(node.op, ast.Add):
+                return False
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, str):
+                return False
+        elif isinstance(node, ast.Name):
+            if node.id != "data":
+                return False
+        elif not isinstance(node, (ast.Expression, ast.Load, ast.Add)):
+            return False
+    return uses_data
+
+
+class _BatchColumns(dict):
+    """Columns of a batch of rows, built as `pandas.Series` on first access."""
+
+    def __init__(self, rows: list[dict[str, Any]]) -> None:
+        """Initialize the columns for the given rows."""
+        super().__init__()
+        self.rows = rows
+
+    def __missing__(self, key: str) -> pandas.Series:
+        import pandas as pd
+
+        column = pd.Series([row[key] for row in self.rows], dtype=object)
+        self[key] = column
+        return column
+
+
+def _evaluate_vectorized(
+    function: Callable[[dict[str, Any]], Any], batch: _BatchColumns
+) -> Optional[list[Any]]:
+    """Evaluate an expression on whole columns, or `None` if that fails."""
+    import pandas as pd
+
+    try:
+        result = function(batch)
+    except Exception:
+        return None
+    if not isinstance(result, pd.Series) or len(result) != len(batch.rows):
+        return None
+    return result.tolist()
+
+
+def _referenced_columns(tree: ast.AST) -> Optional[frozenset[str]]:
+    """Return the columns accessed through `data` in a compiled mapping.
+
+    Only `data["name"]` and `data.get("name", ...)` accesses can be resolved;
+    any other use of `data` makes the accessed columns unknown (`None`).
+    """
+    parents = {
+        child: node
+        for node in ast.walk(tree)
+        for child in ast.iter_child_nodes(node)
+    }
+    columns = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Name) or node.id != "data":
+            continue
+        parent = parents[node]
+        if (
+            isinstance(parent, ast.Subscript)
+            and isinstance(parent.slice, ast.Constant)
+            and isinstance(parent.slice.value, str)
+        ):
+            columns.add(parent.slice.value)
+            continue
+        call = parents.get(parent)
+        if (
+            isinstance(parent, ast.Attribute)
+            and parent.attr == "get"
+            and isinstance(call, ast.Call)
+            and call.func is parent
+            and call.args
+            and isinstance(call.args[0], ast.Constant)
+            and isinstance(call.args[0].value, str)
+        ):
+            columns.add(call.args[0].value)
+            continue
+        return None
+    return frozenset(columns)
@@ -0,0 +1,130 @@
+"""Logging configuration for pdfpop.
+
+Status messages are logged to the `pdfpop` logger hierarchy at these levels:
+
+* DEBUG: every field that is set or ignored and every coerced value.
+* INFO: the status of each row.
+* WARNING: mappings that do not compile and data files without rows.
+* ERROR: rows that fail to populate.
+
+The command line interface shows INFO and above by default. Records are
+buffered and written in batches so that logging does not cost one write per
+message, and messages below the configured level are never formatted.
+"""
+from typing import Iterator, Optional, TextIO
+import contextlib
+import logging
+import sys
+
+
+LOGGER_NAME = "pdfpop"
+BUFFER_CAPACITY = 512
+LEVELS = (logging.ERROR, logging.WARNING, logging.INFO, logging.DEBUG)
+DEFAULT_LEVEL = logging.INFO
+
+LogRecord = tuple[str, int, str]
+
+
+class RecordBuffer(logging.Handler):
+    """Handler that keeps the records it handles until they are drained."""
+
+    def __init__(self) -> None:
+        """Initialize an empty buffer."""
+        super().__init__()
+        self._records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Keep the logger name, level and message of a record."""
+        message = self.format(record)
+        self._records.append((record.name, record.levelno, message))
+
+    def drain(self) -> list[LogRecord]:
+        """Return and forget the records handled so far."""
+        records, self._records = self._records, []
+        return records
+
+
+def get_level(verbosity: int) -> int:
+    """Return the logging level for a verbosity (`-q` is -1, `-v` is 1)."""
+    idx = LEVELS.index(DEFAULT_LEVEL) + verbosity
+    return LEVELS[min(max(idx, 0), len(LEVELS) - 1)]
+
+
+@contextlib.contextmanager
+def configured(
+    verbosity: int = 0,
+    stream: Optional[TextIO] = None,
+    capacity: int = BUFFER_CAPACITY,
+) -> Iterator[logging.Handler]:
+    """Log pdfpop messages to a stream (standard output by default).
+
+    Messages are buffered until `capacity` records are pending, an error is
+    logged, or the context exits. Long-running commands use a capacity of 1
+    so that messages are written as they are logged.
+    """
+    import logging.handlers
+
+    target = logging.StreamHandler(sys.stdout if stream is None else stream)
+    handler = logging.handlers.MemoryHandler(
+        capacity, flushLevel=logging.ERROR, target=target
+    )
+    with _replaced_handlers(handler, get_level(verbosity)):
+        try:
+            yield handler
+        finally:
+            handler.close()
+
+
+def capture(level: int) -> RecordBuffer:
+    """Keep pdfpop messages in a buffer instead of writing them.
+
+    This is used by worker processes, which send the records of each row to
+    the main process to be logged in row order.
+    """
+    buffer = RecordBuffer()
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(buffer)
+    logger.setLevel(level)
+    logger.propagate = False
+    return buffer
+
+
+@contextlib.contextmanager
+def deferred() -> Iterator[RecordBuffer]:
+    """Keep pdfpop messages in a buffer for the duration of the context.
+
+    Unlike `capture`, the handlers of the pdfpop logger are restored on exit.
+    This is used to log the messages of a row once its output is written.
+    """
+    buffer = RecordBuffer()
+    level = logging.getLogger(LOGGER_NAME).getEffectiveLevel()
+    with _replaced_handlers(buffer, level):
+        yield buffer
+
+
+def replay(records: list[LogRecord]) -> None:
+    """Log records that were captured in another process or deferred."""
+    for name, level, message in records:
+        logging.getLogger(name).log(level, "%s", message)
+
+
+@contextlib.contextmanager
+def _replaced_handlers(handler: logging.Handler, level: int) -> Iterator[None]:
+    """Temporarily make a handler the only handler of the pdfpop logger."""
+    logger = logging.getLogger(LOGGER_NAME)
+    handlers, saved_level, propagate = (
+        logger.handlers[:],
+        logger.level,
+        logger.propagate,
+    )
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    try:
+        yield
+    finally:
+        logger.handlers = handlers
+        logger.setLevel(saved_level)
+        logger.propagate = propagate
@@ -0,0 +1,137 @@
+"""Output manifest handling for pdfpop.
+
+A manifest is kept next to the populated forms in each output directory. It
+records, for every populated output, digests of the row data, configuration,
+form and output options it was populated with so that unchanged outputs can be
+skipped when a run is resumed. Entries are appended as JSON Lines as soon as
+each output is written, so a manifest survives an interrupted run. When a run
+finishes, the manifest is compacted to the latest entry of each output.
+"""
+from typing import Any, Union
+import hashlib
+import json
+import os
+import pathlib
+
+
+MANIFEST_NAME = "pdfpop-manifest.jsonl"
+DIGEST_KEYS = ("row_digest", "config_digest", "form_digest", "options_digest")
+
+
+class Manifest:
+    """Record of the outputs populated into a directory."""
+
+    def __init__(self, output_dir: pathlib.Path) -> None:
+        """Initialize an empty manifest for the given output directory."""
+        self._path = output_dir / MANIFEST_NAME
+        self._entries = {}
+        self._file = None
+
+    @property
+    def path(self) -> pathlib.Path:
+        """Manifest path getter."""
+        return self._path
+
+    @property
+    def entries(self) -> dict[str, dict[str, Any]]:
+        """Getter for the latest entry of each output path."""
+        return self._entries
+
+    def load(self) -> None:
+        """Load the manifest from disk, if it exists."""
+        if not self._path.exists():
+            return
+        with self._path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A partially written final line from an interrupted run.
+                    continue
+                self._entries[entry["output"]] = entry
+
+    def is_current(self, entry: dict[str, Any]) -> bool:
+        """Return whether the output of an entry exists and is up to date."""
+        current = self._entries.get(entry["output"])
+        if current is None or not pathlib.Path(entry["output"]).exists():
+            return False
+        return all(current.get(key) == entry[key] for key in DIGEST_KEYS)
+
+    def record(self, entry: dict[str, Any]) -> None:
+        """Append an entry to the manifest on disk.
+
+        The manifest file is kept open for the next entries until `close` is
+        called, and each entry is flushed so that it survives an interrupted
+        run.
+        """
+        if self._file is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self._path.open("a", encoding="utf-8")
+            if self._file.tell() > 0 and not _ends_line(self._path):
+                # End the partially written final line of an interrupted run.
+                self._file.write("\n")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self._entries[entry["output"]] = entry
+
+    def close(self, compact: bool = True) -> None:
+        """Close the manifest file, if entries were recorded.
+
+        With `compact`, the manifest is then compacted (see `compact`).
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if compact:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the manifest with only the latest entry of each output.
+
+        The manifest is replaced by a new file, so that it is never left
+        partially written.
+        """
+        self.load()
+        temp_path = self._path.with_name(f"{self._path.name}.tmp")
+        with temp_path.open("w", encoding="utf-8") as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, self._path)
+
+
+def make_entry(
+    idx: int,
+    row: dict[str, Any],
+    config_digest: str,
+    form_digest: str,
+    output_path: pathlib.Path,
+    options: dict[str, Any],
+) -> dict[str, Any]:
+    """Return the manifest entry for a row.
+
+    `options` are the options that change the output (see
+    `pdfpop.commands.OutputOptions.content`).
+    """
+    return {
+        "row": idx + 1,
+        "output": str(output_path),
+        "row_digest": digest(json.dumps(row, sort_keys=True, default=str)),
+        "config_digest": config_digest,
+        "form_digest": form_digest,
+        "options_digest": digest(json.dumps(options, sort_keys=True)),
+    }
+
+
+def digest(data: Union[str, bytes]) -> str:
+    """Return the hex digest of a string or bytes."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _ends_line(path: pathlib.Path) -> bool:
+    """Return whether a non-empty file ends with a line ending."""
+    with path.open("rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
@@ -0,0 +1,287 @@
+"""Run instrumentation for pdfpop.
+
+A `Metrics` object records the wall time and memory use of each stage of a
+run (reading the data, compiling the configuration, evaluating the mappings,
+parsing the form, filling and writing) and of each row, as well as the hits
+and misses of caches. Only the slowest rows are kept individually, so memory
+use does not grow with the number of rows.
+
+The memory use of a stage or row is the change of the resident set size (RSS)
+of the process while it ran (`rss_delta`, summed over the calls of a stage),
+which includes the memory used by other threads meanwhile, and the peak RSS
+of the process when it finished (`max_rss_so_far`), which is the peak of the
+whole run so far rather than of the stage itself. The RSS delta is only
+available on Linux.
+
+When instrumentation is disabled, `NULL_METRICS` is used instead. Its hooks
+return a shared no-op context manager, so leaving them in place costs close to
+nothing.
+"""
+from typing import Any, Iterator, Optional
+import contextlib
+import cProfile
+import heapq
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+
+
+SLOWEST_ROWS = 10
+
+
+class Metrics:
+    """Wall time and memory use of the stages and rows of a run."""
+
+    enabled = True
+
+    def __init__(self) -> None:
+        """Initialize empty metrics."""
+        self._start = time.perf_counter()
+        self._stages = {}
+        self._rows = {"count": 0, "failed": 0, "seconds": 0.0}
+        self._fields = {"set": 0, "ignored": 0}
+        self._caches = {}
+        self._slowest = []
+        self._row = None
+        self._worker_peak_rss = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Record the wall time and memory use of a stage.
+
+        Stages may be recorded from several threads at once.
+        """
+        start, start_rss = time.perf_counter(), current_rss()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            rss_delta = _delta(start_rss, current_rss())
+            with self._lock:
+                stage = self._stages.get(name)
+                if stage is None:
+                    stage = self._stages[name] = {
+                        "seconds": 0.0,
+                        "calls": 0,
+                        "rss_delta": None,
+                    }
+                stage["seconds"] += seconds
+                stage["calls"] += 1
+                stage["rss_delta"] = _sum(stage["rss_delta"], rss_delta)
+                stage["max_rss_so_far"] = peak_rss()
+
+    @contextlib.contextmanager
+    def row(
+        self, idx: int, deferred: bool = False
+    ) -> Iterator[Optional[dict[str, Any]]]:
+        """Record the wall time, memory use and field counts of a row.
+
+        With `deferred`, the row is yielded and only recorded once it is
+        passed to `finish_row`, so that work done for it elsewhere (e.g.,
+        writing its output in another thread) can be added to it.
+        """
+        self._row = {"row": idx + 1, "fields_set": 0, "fields_ignored": 0}
+        start, start_rss = time.perf_counter(), current_rss()
+        failed = False
+        try:
+            yield self._row
+        except Exception:
+            failed = True
+            raise
+        finally:
+            row, self._row = self._row, None
+            row["seconds"] = time.perf_counter() - start
+            row["rss_delta"] = _delta(start_rss, current_rss())
+            row["max_rss_so_far"] = peak_rss()
+            row["failed"] = failed
+            if not deferred:
+                self._add_row(row)
+
+    def finish_row(
+        self, row: dict[str, Any], seconds: float = 0.0, failed: bool = False
+    ) -> None:
+        """Record a deferred row, adding the time spent on it elsewhere."""
+        row["seconds"] += seconds
+        row["failed"] = row["failed"] or failed
+        self._add_row(row)
+
+    def count_fields(self, fields_set: int, fields_ignored: int) -> None:
+        """Record the number of fields set and ignored for the current row."""
+        if self._row is not None:
+            self._row["fields_set"] += fields_set
+            self._row["fields_ignored"] += fields_ignored
+
+    def count_cache(self, name: str, stats: dict[str, int]) -> None:
+        """Add counts (e.g., hits and misses) to the statistics of a cache."""
+        cache = self._caches.setdefault(name, {})
+        for key, value in stats.items():
+            cache[key] = cache.get(key, 0) + value
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return the recorded metrics in a form that can be merged."""
+        return {
+            "stages": self._stages,
+            "rows": self._rows,
+            "fields": self._fields,
+            "caches": self._caches,
+            "slowest": [row for _, _, row in self._slowest],
+            "peak_rss": peak_rss(),
+        }
+
+    def merge(self, snapshot: dict[str, Any]) -> None:
+        """Merge the snapshot of another process (e.g., a worker) into these."""
+        for name, other in snapshot["stages"].items():
+            stage = self._stages.setdefault(
+                name,
+                {
+                    "seconds": 0.0,
+                    "calls": 0,
+                    "rss_delta": None,
+                    "max_rss_so_far": None,
+                },
+            )
+            stage["seconds"] += other["seconds"]
+            stage["calls"] += other["calls"]
+            stage["rss_delta"] = _sum(stage["rss_delta"], other["rss_delta"])
+            stage["max_rss_so_far"] = _max(
+                stage["max_rss_so_far"], other["max_rss_so_far"]
+            )
+        for key, value in snapshot["rows"].items():
+            self._rows[key] += value
+        for key, value in snapshot["fields"].items():
+            self._fields[key] += value
+        for name, stats in snapshot["caches"].items():
+            self.count_cache(name, stats)
+        for row in snapshot["slowest"]:
+            self._push_slowest(row)
+        self._worker_peak_rss = _max(
+            self._worker_peak_rss, snapshot["peak_rss"]
+        )
+
+    def report(self) -> dict[str, Any]:
+        """Return a summary of the recorded metrics."""
+        return {
+            "seconds": time.perf_counter() - self._start,
+            "peak_rss": peak_rss(),
+            "worker_peak_rss": self._worker_peak_rss,
+            "stages": self._stages,
+            "rows": self._rows,
+            "fields": self._fields,
+            "caches": self._caches,
+            "slowest_rows": [
+                row for _, _, row in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+    def save(self, metrics_path: pathlib.Path) -> None:
+        """Save the summary of the recorded metrics as JSON."""
+        with metrics_path.open("w") as f:
+            json.dump(self.report(), f, indent=4)
+
+    def _add_row(self, row: dict[str, Any]) -> None:
+        """Add the metrics of a finished row to the totals."""
+        self._rows["count"] += 1
+        self._rows["failed"] += row["failed"]
+        self._rows["seconds"] += row["seconds"]
+        self._fields["set"] += row["fields_set"]
+        self._fields["ignored"] += row["fields_ignored"]
+        self._push_slowest(row)
+
+    def _push_slowest(self, row: dict[str, Any]) -> None:
+        """Keep a row if it is one of the slowest rows so far."""
+        item = (row["seconds"], -row["row"], row)
+        if len(self._slowest) < SLOWEST_ROWS:
+            heapq.heappush(self._slowest, item)
+        elif item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+
+class _NullMetrics(Metrics):
+    """Metrics that record nothing."""
+
+    enabled = False
+
+    def stage(self, name: str) -> contextlib.nullcontext:
+        """Return a context manager that does nothing."""
+        return _NULL_CONTEXT
+
+    def row(self, idx: int, deferred: bool = False) -> contextlib.nullcontext:
+        """Return a context manager that does nothing."""
+        return _NULL_CONTEXT
+
+    def finish_row(
+        self,
+        row: Optional[dict[str, Any]],
+        seconds: float = 0.0,
+        failed: bool = False,
+    ) -> None:
+        """Do nothing."""
+        pass
+
+    def count_fields(self, fields_set: int, fields_ignored: int) -> None:
+        """Do nothing."""
+        pass
+
+    def count_cache(self, name: str, stats: dict[str, int]) -> None:
+        """Do nothing."""
+        pass
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
+NULL_METRICS = _NullMetrics()
+
+
+@contextlib.contextmanager
+def profiled(profile_path: pathlib.Path) -> Iterator[None]:
+    """Profile the body with cProfile and dump the statistics to a file."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+
+def peak_rss() -> Optional[int]:
+    """Return the peak RSS of this process in bytes, if it is available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def current_rss() -> Optional[int]:
+    """Return the current RSS of this process in bytes, if it is available."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _delta(start: Optional[int], end: Optional[int]) -> Optional[int]:
+    """Return the change between two optional values."""
+    return None if start is None or end is None else end - start
+
+
+def _sum(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    """Return the sum of two optional values."""
+    if a is None or b is None:
+        return a if b is None else b
+    return a + b
+
+
+def _max(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    """Return the larger of two optional values."""
+    if a is None or b is None:
+        return a if b is None else b
+    return max(a, b)
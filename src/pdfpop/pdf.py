@@ -4,68 +4,1081 @@ Contains adaptations from:
 * WestHealth/pdf-form-filler (https://github.com/WestHealth/pdf-form-filler)
     * Copyright (c) 2021, West Health Institute
 """
+from typing import Any, BinaryIO, NamedTuple, Optional, Union
+import hashlib
+import io
+import logging
+import mmap
 import pathlib
 
 import pdfrw
 
+import pdfpop.appearance
+import pdfpop.reader
 
-def get_fields_info(form_path: pathlib.Path) -> dict[str, str]:
-    """Return a list of field info for a form."""
-    form = pdfrw.PdfReader(form_path)
-    return _iterate_pages(form)
+
+OFF = pdfpop.appearance.OFF
+# The estimated memory use of a parsed object, with its share of the indexes.
+PARSED_OBJECT_SIZE = 2048
+
+# A chunk of PDF data: serialized objects, or (a view of) a mapped form.
+Chunk = Union[bytes, memoryview, mmap.mmap]
+
+logger = logging.getLogger(__name__)
+
+
+class IndexedField(NamedTuple):
+    """Precomputed information about a single form field.
+
+    Annotations are stored as positions into the list of objects that a
+    template copies for each population. Choice fields map each display
+    value of their options to its encoded export value, and radio buttons
+    list the export name of each kid, so that populating them is a lookup.
+    """
+
+    name: str
+    type: Optional[str]
+    annotation: int
+    widgets: tuple[int, ...]
+    options: Optional[dict[str, pdfrw.PdfString]]
+    exports: Optional[tuple[Optional[pdfrw.PdfName], ...]]
+
+
+class Rewrite(NamedTuple):
+    """A populated mapped form, as the chunks of a complete PDF.
+
+    Modified objects are serialized, and every other object is a view of its
+    bytes in the mapped form (see `FormTemplate.rewrite`).
+    """
+
+    chunks: tuple[Chunk, ...]
+
+
+class FormTemplate:
+    """A PDF form that is parsed once and cloned for each population.
+
+    Only the objects that population may modify (widget annotations, their
+    field hierarchy, the AcroForm dictionary and every object that refers to
+    them) are copied by a clone. Page content, fonts, images and other
+    resources are shared between the template and all of its clones.
+
+    Forms are read as bytes and their objects are only parsed when they are
+    needed (see `pdfpop.reader`), so that the objects that population does not
+    touch are never parsed at all.
+    """
+
+    def __init__(
+        self,
+        form_path: pathlib.Path,
+        mapped: bool = True,
+        memory_map: bool = False,
+    ) -> None:
+        """Initialize the template from the form at the given path.
+
+        Unless `mapped` is false, the form is read lazily if possible. With
+        `memory_map`, its file is memory-mapped rather than read into memory,
+        which is only safe if the file does not change while the template is
+        used (see `pdfpop.reader`).
+        """
+        self._path = form_path
+        self._memory_map = memory_map
+        if mapped:
+            self._reader = pdfpop.reader.open_reader(
+                form_path, memory_map=memory_map
+            )
+        else:
+            self._reader = pdfrw.PdfReader(form_path)
+        self._mapped = isinstance(self._reader, pdfpop.reader.MappedReader)
+        self._mutable, self._shared = _find_mutable_objects(
+            self._reader, self._mapped
+        )
+        positions = {id(obj): pos for pos, obj in enumerate(self._mutable)}
+        self._trailer = positions[id(self._reader)]
+        self._pages = [positions[id(page)] for page in self._reader.pages]
+        self._fields = _index_fields(self._reader, positions)
+        self._has_annotations = any(
+            page["/Annots"] is not None for page in self._reader.pages
+        )
+        self._owners = _find_owners(self._mutable, positions)
+        self._root = positions.get(id(self._reader.Root))
+        self._appearances = None
+        self._source = None
+        self._digest = None
+
+    @property
+    def path(self) -> pathlib.Path:
+        """Template path getter."""
+        return self._path
+
+    @property
+    def fields(self) -> dict[str, IndexedField]:
+        """Field index getter."""
+        return self._fields
+
+    @property
+    def mapped(self) -> bool:
+        """Return whether the form is parsed lazily from its bytes."""
+        return self._mapped
+
+    @property
+    def digest(self) -> str:
+        """Return the hex digest of the form file."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.source).hexdigest()
+        return self._digest
+
+    @property
+    def source(self) -> Union[bytes, mmap.mmap]:
+        """Getter for the bytes of the form file."""
+        if self._source is None:
+            if self._mapped:
+                self._source = self._reader.data
+            else:
+                self._source = self._path.read_bytes()
+        return self._source
+
+    @property
+    def memory_size(self) -> int:
+        """Return an estimate of the memory used by the template, in bytes.
+
+        This is the size of the form bytes kept in memory (none if they are
+        memory-mapped) plus `PARSED_OBJECT_SIZE` for each parsed object.
+        Unmapped forms keep the content of their streams instead of their
+        bytes, which is estimated by their file size.
+        """
+        if not self._mapped:
+            kept = self._path.stat().st_size
+        elif self._memory_map:
+            kept = 0
+        else:
+            kept = len(self._reader.data)
+        parsed = len(self._mutable) + len(self._shared)
+        return kept + parsed * PARSED_OBJECT_SIZE
+
+    @property
+    def supports_update(self) -> bool:
+        """Return whether populations can be written as incremental updates."""
+        return self._reader.Encrypt is None
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Return the state of the template for pickling.
+
+        The shared objects are kept as a list, since their ids do not survive
+        pickling. The source and the appearance builder are left out and
+        derived again when needed (see `pdfpop.artifact`). Mapped templates
+        keep the state of their reader instead of the reader, which is also
+        their trailer, and keep their digest for as long as the form file is
+        unchanged; only the bytes of the form are read again.
+        """
+        state = dict(self.__dict__)
+        state["_shared"] = list(self._shared.values())
+        state["_appearances"] = None
+        state["_source"] = None
+        if self._mapped:
+            state["_mutable"] = list(self._mutable)
+            state["_mutable"][self._trailer] = None
+            state["_reader"] = self._reader.state(
+                [*self._mutable, *state["_shared"]]
+            )
+        else:
+            state["_digest"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        """Restore the state of a pickled template.
+
+        Mapped templates whose form file has changed are initialized again.
+        """
+        self.__dict__.update(state)
+        self._shared = {id(obj): obj for obj in state["_shared"]}
+        if not self._mapped:
+            return
+        try:
+            self._reader = pdfpop.reader.MappedReader.restore(
+                self._path,
+                state["_reader"],
+                [self._mutable[pos] for pos in self._pages],
+                self._memory_map,
+            )
+        except RuntimeError:
+            self.__init__(self._path, memory_map=self._memory_map)
+            return
+        self._mutable[self._trailer] = self._reader
+
+    def shares(self, obj: Any) -> bool:
+        """Return whether an object is shared by the template's clones.
+
+        Objects of a mapped form that are parsed after the template was
+        initialized are shared as well.
+        """
+        if id(obj) in self._shared:
+            return True
+        return self._mapped and self._reader.loaded(obj.indirect) is obj
+
+    def clone(self) -> pdfrw.PdfDict:
+        """Return a trailer that can be populated without altering the form."""
+        return self._trailer_of(self._copy())
+
+    def populate(
+        self, data: dict, appearances: bool = False, flatten: bool = False
+    ) -> pdfrw.PdfDict:
+        """Return a clone of the form populated with the given data.
+
+        With `appearances`, an appearance stream is generated for every
+        populated widget instead of asking viewers to render the fields (see
+        `pdfpop.appearance`). With `flatten`, appearances are generated and
+        every widget is drawn into its page, leaving no form behind.
+        """
+        copies, _ = self._populate(data, appearances, flatten)
+        return self._trailer_of(copies)
+
+    def update(
+        self, data: dict, appearances: bool = False, flatten: bool = False
+    ) -> bytes:
+        """Return an incremental update that populates the form with data.
+
+        Appending the update to the form's source bytes produces the populated
+        PDF. Only the objects that population modified are written, under
+        their original object numbers, followed by a cross-reference section
+        and a trailer that points back to the form's own cross-references.
+        `appearances` and `flatten` are as for `populate`.
+        """
+        if not self.supports_update:
+            raise RuntimeError(f'Form "{self._path}" is encrypted.')
+        copies, modified = self._populate(data, appearances, flatten)
+        return _UpdateFormatter(self).format(self._changed(copies, modified))
+
+    def rewrite(
+        self, data: dict, appearances: bool = False, flatten: bool = False
+    ) -> Rewrite:
+        """Return a mapped form populated with data as a complete PDF.
+
+        Only the objects that population modified (and the objects of object
+        streams) are serialized. Every other object, such as page content and
+        images, is copied from the mapped form as is. `appearances` and
+        `flatten` are as for `populate`.
+        """
+        if not self._mapped:
+            raise RuntimeError(f'Form "{self._path}" is not read lazily.')
+        copies, modified = self._populate(data, appearances, flatten)
+        return _RewriteFormatter(self).format(self._changed(copies, modified))
+
+    def fill(
+        self,
+        data: dict,
+        incremental: bool = False,
+        appearances: bool = False,
+        flatten: bool = False,
+    ) -> Union[bytes, Rewrite, pdfrw.PdfDict]:
+        """Return the form populated with data, ready for `write_form`.
+
+        With `incremental`, this is an incremental update (see `update`) if
+        the form supports them. Otherwise, mapped forms are rewritten (see
+        `rewrite`) and other forms are populated (see `populate`).
+        """
+        if incremental and self.supports_update:
+            return self.update(data, appearances, flatten)
+        if self._mapped:
+            return self.rewrite(data, appearances, flatten)
+        return self.populate(data, appearances, flatten)
+
+    def _populate(
+        self, data: dict, appearances: bool = False, flatten: bool = False
+    ) -> tuple[list, set[int]]:
+        """Return populated copies of the mutable objects.
+
+        The positions of the copies that were modified are returned as well.
+        """
+        copies = self._copy()
+        modified = set()
+        strategies = _get_strategies()
+        builder = self._builder() if appearances or flatten else None
+        for key, value in data.items():
+            field = self._fields.get(key)
+            if field is not None:
+                annotation = copies[field.annotation]
+                strategies[field.type](annotation, value, field)
+                modified.add(field.annotation)
+                modified.update(field.widgets)
+                if builder is not None:
+                    for pos in field.widgets:
+                        builder.apply(
+                            field.type,
+                            annotation,
+                            copies[pos],
+                            value,
+                            field.options,
+                        )
+        if flatten:
+            for pos in self._pages:
+                pdfpop.appearance.flatten_page(copies[pos])
+                modified.add(pos)
+            if self._root is not None:
+                copies[self._root].AcroForm = None
+                modified.add(self._root)
+        elif self._has_annotations and not appearances:
+            acro_form = copies[self._trailer].Root.AcroForm
+            acro_form.update(
+                pdfrw.PdfDict(NeedAppearances=pdfrw.PdfObject("true"))
+            )
+            modified.add(copies.index(acro_form))
+        return copies, modified
+
+    def _changed(self, copies: list, modified: set[int]) -> list:
+        """Return the indirect copies that own a modified copy, in order."""
+        owners = {self._owners[pos] for pos in modified}
+        owners.discard(None)
+        return [copies[pos] for pos in sorted(owners)]
+
+    def _builder(self) -> pdfpop.appearance.AppearanceBuilder:
+        """Return the appearance builder of the form, creating it if needed."""
+        if self._appearances is None:
+            self._appearances = pdfpop.appearance.AppearanceBuilder(
+                self._reader.Root.AcroForm
+            )
+        return self._appearances
+
+    def _copy(self) -> list:
+        """Return copies of the mutable objects, in template order."""
+        copies = []
+        for obj in self._mutable:
+            if isinstance(obj, pdfrw.PdfArray):
+                copy = pdfrw.PdfArray()
+            else:
+                copy = pdfrw.PdfDict()
+                copy._stream = obj.stream
+            copy.indirect = obj.indirect
+            copies.append(copy)
+        by_id = {id(obj): copy for obj, copy in zip(self._mutable, copies)}
+        for obj, copy in zip(self._mutable, copies):
+            if isinstance(obj, pdfrw.PdfArray):
+                copy.extend(
+                    by_id.get(id(value), value) for value in list.__iter__(obj)
+                )
+            else:
+                for key, value in dict.items(obj):
+                    dict.__setitem__(copy, key, by_id.get(id(value), value))
+        return copies
+
+    def _trailer_of(self, copies: list) -> pdfrw.PdfDict:
+        """Return the trailer of a set of copies with its pages attached."""
+        trailer = copies[self._trailer]
+        trailer.private.pages = [copies[pos] for pos in self._pages]
+        return trailer
+
+
+class _ObjectFormatter:
+    """Serialize PDF objects the way `pdfrw.PdfWriter` does.
+
+    Subclasses decide how indirect objects are numbered and written by
+    implementing `_reference`.
+    """
+
+    def _reference(self, obj: Any) -> str:
+        """Return a reference to an indirect object."""
+        raise NotImplementedError
+
+    def _unparsed(self, ref: pdfrw.objects.pdfindirect.PdfIndirect) -> str:
+        """Return a reference to an object of a form that is not parsed yet.
+
+        The object is parsed and referenced like any other indirect object.
+        """
+        obj = ref.real_value()
+        return "null" if obj is None else self._value(obj)
+
+    def _value(self, obj: Any) -> str:
+        """Return the serialization of a value inside another object."""
+        if isinstance(obj, pdfrw.objects.pdfindirect.PdfIndirect):
+            return self._unparsed(obj)
+        if isinstance(obj, pdfrw.PdfDict):
+            indirect = obj.indirect or obj.stream is not None
+        else:
+            indirect = getattr(obj, "indirect", False)
+        if indirect:
+            return self._reference(obj)
+        return self._format(obj)
+
+    def _format(self, obj: Any) -> str:
+        """Return the serialization of an object's body."""
+        if isinstance(obj, (list, tuple)):
+            values = list.__iter__(obj) if isinstance(obj, list) else obj
+            return f"[{' '.join(self._value(x) for x in values)}]"
+        if isinstance(obj, dict):
+            if not isinstance(obj, pdfrw.PdfDict):
+                obj = pdfrw.PdfDict(obj)
+            pairs = sorted(
+                (getattr(key, "encoded", None) or key, value)
+                for key, value in dict.items(obj)
+                if value is not None
+            )
+            result = "<<%s>>" % " ".join(
+                f"{key} {self._value(value)}" for key, value in pairs
+            )
+            if obj.stream is not None:
+                result = f"{result}\nstream\n{obj.stream}\nendstream"
+            return result
+        if hasattr(obj, "indirect"):
+            return str(getattr(obj, "encoded", None) or obj)
+        return pdfrw.pdfwriter.user_fmt(obj)
+
+
+class MergedFormWriter(_ObjectFormatter):
+    """Write populated forms as the pages of a single PDF.
+
+    Each added form's pages are appended to the output and written to disk
+    immediately, so only the page numbers are kept in memory. Objects that are
+    shared by a template's clones (page content, fonts, images) are written
+    once and referenced by every page that uses them. The fields of each added
+    form are grouped under a `row<N>` parent field so that their fully
+    qualified names do not clash.
+    """
+
+    def __init__(
+        self,
+        output_path: pathlib.Path,
+        appearances: bool = False,
+        flatten: bool = False,
+    ) -> None:
+        """Initialize the writer and start the output file.
+
+        `appearances` and `flatten` are as for `FormTemplate.populate`.
+        """
+        self._path = output_path
+        self._appearances = appearances
+        self._flatten = flatten
+        self._file = output_path.open("wb")
+        self._offsets = {}
+        self._count = 0
+        self._templates = []
+        self._shared_numbers = {}
+        self._row_numbers = {}
+        self._row_objects = []
+        self._pending = []
+        self._page_numbers = []
+        self._field_numbers = []
+        self._acro_form = None
+        self._write("%PDF-1.3\n%\xe2\xe3\xcf\xd3\n")
+        self._pages_number = self._reserve()
+        self._root_number = self._reserve()
+
+    @property
+    def path(self) -> pathlib.Path:
+        """Output path getter."""
+        return self._path
+
+    def __enter__(self) -> "MergedFormWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def add(self, template: FormTemplate, data: dict) -> None:
+        """Populate a template with data and append its pages."""
+        if template not in self._templates:
+            self._templates.append(template)
+        form = template.populate(data, self._appearances, self._flatten)
+        row = len(self._field_numbers) + 1
+        if form.Root.AcroForm is not None:
+            if self._acro_form is None:
+                self._acro_form = form.Root.AcroForm
+            fields = form.Root.AcroForm["/Fields"] or []
+            parent = pdfrw.IndirectPdfDict(
+                T=pdfrw.objects.pdfstring.PdfString.encode(f"row{row}"),
+                Kids=pdfrw.PdfArray(fields),
+            )
+            for field in fields:
+                field.Parent = parent
+            self._field_numbers.append(self._reference(parent))
+        for page in form.pages:
+            for key in ("Resources", "MediaBox", "CropBox", "Rotate"):
+                if getattr(page, key) is None:
+                    setattr(page, key, getattr(page.inheritable, key))
+            page.Parent = None
+            page.indirect = True
+            self._page_numbers.append(self._reference(page))
+        self._flush()
+        self._row_numbers.clear()
+        self._row_objects.clear()
+
+    def close(self) -> None:
+        """Write the page tree, catalog and cross-reference table."""
+        if self._file.closed:
+            return
+        pages = f"[{' '.join(self._page_numbers)}]"
+        body = (
+            f"<</Count {len(self._page_numbers)} /Kids {pages} /Type /Pages>>"
+        )
+        self._write_object(self._pages_number, body)
+        acro_form = ""
+        if self._acro_form is not None:
+            extra = "".join(
+                f" {key} {self._value(self._acro_form[key])}"
+                for key in ("/DA", "/DR")
+                if self._acro_form[key] is not None
+            )
+            fields = f"[{' '.join(self._field_numbers)}]"
+            if not self._appearances:
+                extra = f" /NeedAppearances true{extra}"
+            acro_form = f" /AcroForm <</Fields {fields}{extra}>>"
+        root = f"<<{acro_form} /Pages {self._pages_number} 0 R /Type /Catalog>>"
+        self._write_object(self._root_number, root)
+        self._flush()
+        xref_offset = self._file.tell()
+        self._write(f"xref\n0 {self._count + 1}\n0000000000 65535 f\r\n")
+        for number in range(1, self._count + 1):
+            self._write(f"{self._offsets[number]:010d} 00000 n\r\n")
+        self._write(
+            f"trailer\n\n<</Root {self._root_number} 0 R "
+            f"/Size {self._count + 1}>>\nstartxref\n{xref_offset}\n%%EOF\n"
+        )
+        self._file.close()
+
+    def _reserve(self) -> int:
+        """Reserve the next object number."""
+        self._count += 1
+        return self._count
+
+    def _reference(self, obj: Any) -> str:
+        """Return a reference to an indirect object, queueing it if new."""
+        shared = any(template.shares(obj) for template in self._templates)
+        numbers = self._shared_numbers if shared else self._row_numbers
+        number = numbers.get(id(obj))
+        if number is None:
+            number = numbers[id(obj)] = self._reserve()
+            self._pending.append((number, obj))
+            if not shared:
+                # Keep the object alive so that its id is not reused.
+                self._row_objects.append(obj)
+        return f"{number} 0 R"
+
+    def _flush(self) -> None:
+        """Write every queued object, including those they reference."""
+        while self._pending:
+            number, obj = self._pending.pop()
+            self._write_object(number, self._format(obj))
+
+    def _write_object(self, number: int, body: str) -> None:
+        """Write an indirect object to the output."""
+        self._offsets[number] = self._file.tell()
+        self._write(f"{number} 0 obj\n{body}\nendobj\n")
+
+    def _write(self, data: str) -> None:
+        """Write PDF data to the output."""
+        self._file.write(pdfrw.py23_diffs.convert_store(data))
+
+
+class _UpdateFormatter(_ObjectFormatter):
+    """Format the incremental update of a populated form template."""
+
+    def __init__(self, template: FormTemplate) -> None:
+        """Initialize the formatter for a template's form."""
+        self._template = template
+        self._size = int(template._reader.Size)
+        self._numbers = {}
+        self._pending = []
+
+    def format(self, objects: list) -> bytes:
+        """Return the update that replaces the given indirect objects."""
+        source = self._template.source
+        offset = len(source)
+        chunks = []
+        if source[-1:] not in (b"\n", b"\r"):
+            chunks.append(b"\n")
+            offset += 1
+        entries = {}
+        for number, generation, chunk in self._serialize(objects):
+            entries[number] = "%010d %05d n" % (offset, generation)
+            chunks.append(chunk)
+            offset += len(chunk)
+        chunks.append(
+            self._cross_references(entries, offset, Prev=_startxref(source))
+        )
+        return b"".join(chunks)
+
+    def _serialize(self, objects: list) -> list[tuple[int, int, bytes]]:
+        """Return the given indirect objects and the new objects they refer to.
+
+        Each object is returned with its number and generation.
+        """
+        serialized = []
+        self._pending.extend((obj.indirect, obj) for obj in objects)
+        while self._pending:
+            (number, generation), obj = self._pending.pop()
+            chunk = pdfrw.py23_diffs.convert_store(
+                f"{number} {generation} obj\n{self._format(obj)}\nendobj\n"
+            )
+            serialized.append((number, generation, chunk))
+        return serialized
+
+    def _cross_references(
+        self, entries: dict[int, str], offset: int, **trailer: Any
+    ) -> bytes:
+        """Return a cross-reference section at an offset and its trailer.
+
+        `entries` map object numbers to their entries (without line ending)
+        and `trailer` holds extra trailer entries.
+        """
+        xref = ["xref\n"]
+        numbers = sorted(entries)
+        start = 0
+        while start < len(numbers):
+            end = start + 1
+            while end < len(numbers) and numbers[end] == numbers[end - 1] + 1:
+                end += 1
+            xref.append(f"{numbers[start]} {end - start}\n")
+            xref.extend(
+                f"{entries[number]}\r\n" for number in numbers[start:end]
+            )
+            start = end
+        trailer = pdfrw.PdfDict(
+            Size=self._size,
+            Root=self._template._reader.Root,
+            Info=self._template._reader.Info,
+            ID=self._template._reader.ID,
+            **trailer,
+        )
+        xref.append(
+            f"trailer\n{self._format(trailer)}\n"
+            f"startxref\n{offset}\n%%EOF\n"
+        )
+        return pdfrw.py23_diffs.convert_store("".join(xref))
+
+    def _unparsed(self, ref: pdfrw.objects.pdfindirect.PdfIndirect) -> str:
+        """Return a reference to an object of the form, without parsing it."""
+        return "%s %s R" % ref
+
+    def _reference(self, obj: Any) -> str:
+        """Return a reference to an indirect object, numbering it if new."""
+        if isinstance(obj.indirect, tuple):
+            return "%s %s R" % obj.indirect
+        number = self._numbers.get(id(obj))
+        if number is None:
+            number = self._numbers[id(obj)] = self._size
+            self._size += 1
+            self._pending.append(((number, 0), obj))
+        return f"{number} 0 R"
+
+
+class _RewriteFormatter(_UpdateFormatter):
+    """Format a populated mapped form template as a complete PDF.
+
+    Objects that population did not modify are copied from the mapped form,
+    in the order of the form. Objects of object streams are parsed and
+    written on their own, and object and cross-reference streams are left
+    out, so that the PDF has a single cross-reference table.
+    """
+
+    def format(self, objects: list) -> Rewrite:
+        """Return the PDF in which the given indirect objects are replaced."""
+        reader = self._template._reader
+        chunks = [
+            pdfrw.py23_diffs.convert_store(
+                f"%PDF-{reader.version}\n%\xe2\xe3\xcf\xd3\n"
+            )
+        ]
+        offset = len(chunks[0])
+        serialized = self._serialize(objects)
+        replaced = {number for number, _, _ in serialized}
+        copied = []
+        for number, generation, extent in reader.objects():
+            if number in replaced:
+                continue
+            if extent is None:
+                obj = reader.load(number, generation)
+                chunk = pdfrw.py23_diffs.convert_store(
+                    f"{number} {generation} obj\n{self._format(obj)}\n"
+                    "endobj\n"
+                )
+                serialized.append((number, generation, chunk))
+            else:
+                copied.append((extent, number, generation))
+        entries = {0: "0000000000 65535 f"}
+        data = memoryview(reader.data)
+        run_start = run_end = None
+        for (start, end), number, generation in sorted(copied):
+            if start != run_end:
+                if run_start is not None:
+                    chunks.append(data[run_start:run_end])
+                    offset += run_end - run_start
+                run_start = start
+            run_end = end
+            entries[number] = "%010d %05d n" % (
+                offset + start - run_start,
+                generation,
+            )
+        if run_start is not None:
+            chunks.append(data[run_start:run_end])
+            offset += run_end - run_start
+        for number, generation, chunk in serialized:
+            entries[number] = "%010d %05d n" % (offset, generation)
+            chunks.append(chunk)
+            offset += len(chunk)
+        self._size = max(self._size, max(entries) + 1)
+        for number in range(self._size):
+            entries.setdefault(number, "0000000000 65535 f")
+        chunks.append(self._cross_references(entries, offset))
+        return Rewrite(tuple(chunks))
+
+
+def _startxref(source: bytes) -> int:
+    """Return the offset of the last cross-reference section of a PDF."""
+    position = source.rfind(b"startxref")
+    if position < 0:
+        raise RuntimeError("PDF has no cross-reference section.")
+    return int(source[position + len(b"startxref") :].split()[0])
+
+
+def get_fields_info(form_path: pathlib.Path) -> dict[str, None]:
+    """Return a configuration entry for each field of a form.
+
+    Fields are discovered from the `/AcroForm /Fields` tree of the form, so
+    only the field dictionaries are loaded and the page tree is not walked.
+    The form is memory-mapped if possible (see `pdfpop.reader`), so the rest
+    of the form is not even read.
+    Forms without a usable field tree fall back to the widget annotations of
+    every page. Entries are keyed by `"<qualified name> [<type>]"`.
+    """
+    form = pdfpop.reader.open_reader(
+        form_path, False, _FieldReader, memory_map=True
+    )
+    fields_info = _iterate_fields(form)
+    if not fields_info:
+        logger.warning(
+            'Form "%s" has no AcroForm fields; '
+            "looking for fields in page annotations.",
+            form_path,
+        )
+        fields_info = _iterate_pages(pdfrw.PdfReader.readpages(form, form.Root))
+    return fields_info
+
+
+class _FieldReader(pdfrw.PdfReader):
+    """PDF reader that does not walk the page tree when it is opened.
+
+    This reader is used for forms that cannot be read lazily. pdfrw loads
+    indirect objects on first access, so fields are discovered without
+    loading pages or their content. The pages are only needed for forms
+    without a usable field tree.
+    """
+
+    def readpages(self, node: pdfrw.PdfDict) -> list:
+        """Skip the page tree (it is walked separately if needed)."""
+        return []
 
 
 def populate_form(
-    form_path: pathlib.Path, data: dict, output_path: pathlib.Path
+    form: Union[pathlib.Path, FormTemplate],
+    data: dict,
+    output_path: pathlib.Path,
+    incremental: bool = False,
+    appearances: bool = False,
+    flatten: bool = False,
 ) -> None:
-    """Populate a PDF form with data and output to a new PDF."""
-    form = pdfrw.PdfReader(form_path)
-    strategies = _get_strategies()
+    """Populate a PDF form with data and output to a new PDF.
+
+    With `incremental`, the output is the original form followed by an
+    incremental update (see `FormTemplate.update`) instead of a complete
+    PDF. Encrypted forms are never updated incrementally. `appearances` and
+    `flatten` are as for `FormTemplate.populate`.
+    """
+    if not isinstance(form, FormTemplate):
+        form = FormTemplate(form)
+    populated = form.fill(data, incremental, appearances, flatten)
+    write_form(form, populated, output_path)
+
+
+def write_form(
+    form: FormTemplate,
+    populated: Union[bytes, Rewrite, pdfrw.PdfDict],
+    output: Union[pathlib.Path, BinaryIO],
+) -> None:
+    """Write a populated form (see `FormTemplate.fill`) to a PDF.
+
+    The output is either a path or a writable binary stream. An existing file
+    at the path is replaced by a new file rather than overwritten, so that
+    files linked to it are left intact (see `pdfpop.dedup`).
+    """
+    if isinstance(output, pathlib.Path):
+        output.unlink(missing_ok=True)
+    if isinstance(populated, pdfrw.PdfDict):
+        pdfrw.PdfWriter().write(output, populated)
+    elif isinstance(output, pathlib.Path):
+        with output.open("wb") as f:
+            for chunk in render_form(form, populated):
+                f.write(chunk)
+    else:
+        for chunk in render_form(form, populated):
+            output.write(chunk)
+
+
+def render_form(
+    form: FormTemplate, populated: Union[bytes, Rewrite, pdfrw.PdfDict]
+) -> tuple[Chunk, ...]:
+    """Return a populated form (see `FormTemplate.fill`) as chunks of bytes.
+
+    The PDF is the concatenation of the returned chunks, so the source of the
+    form is not copied for incremental updates, nor are the objects that a
+    rewrite copies from the mapped form.
+    """
+    if isinstance(populated, bytes):
+        return form.source, populated
+    if isinstance(populated, Rewrite):
+        return populated.chunks
+    output = io.BytesIO()
+    pdfrw.PdfWriter().write(output, populated)
+    return (output.getvalue(),)
+
+
+def _find_mutable_objects(
+    form: pdfrw.pdfreader.PdfReader, parsed_only: bool = False
+) -> tuple[list, dict[int, Any]]:
+    """Return the objects of a form that must be copied to populate it.
+
+    These are the annotations and fields that population updates, the
+    AcroForm dictionary, and every object that (transitively) refers to one
+    of them so that no shared object ever points at a stale original. The
+    remaining objects, which clones share, are returned as well (by id).
+
+    With `parsed_only`, only the objects of a mapped form that are parsed
+    (the pages, fields and the objects that lead to them) are searched, so
+    the rest of the form is left unparsed. Unparsed objects refer to the
+    copies by object number (see `FormTemplate.rewrite`).
+    """
+    seeds = [form, *form.pages]
+    if form.Root.AcroForm is not None:
+        seeds.append(form.Root.AcroForm)
     for page in form.pages:
-        annotations = page["/Annots"]
-        if annotations is None:
+        for annotation in page["/Annots"] or []:
+            while annotation is not None:
+                seeds.append(annotation)
+                seeds.extend(annotation["/Kids"] or [])
+                annotation = annotation["/Parent"]
+
+    referrers = {}
+    seen = {id(form): form}
+    pending = [form]
+    while pending:
+        obj = pending.pop()
+        if parsed_only:
+            children = _parsed_children(form, obj)
+        elif isinstance(obj, pdfrw.PdfDict):
+            children = obj.itervalues()
+        else:
+            children = iter(obj)
+        for child in children:
+            if not isinstance(child, (pdfrw.PdfDict, pdfrw.PdfArray)):
+                if getattr(child, "indirect", False):
+                    seen[id(child)] = child
+                continue
+            referrers.setdefault(id(child), []).append(obj)
+            if id(child) not in seen:
+                seen[id(child)] = child
+                pending.append(child)
+
+    mutable = {}
+    while seeds:
+        obj = seeds.pop()
+        if id(obj) in mutable:
             continue
-        for annotation in annotations:
-            if annotation["/Subtype"] == "/Widget":
-                if not annotation["/T"]:
-                    annotation = annotation["/Parent"]
-                key = annotation["/T"].to_unicode()
-                if key in data:
-                    ft = _field_type(annotation)
-                    strategies[ft](annotation, data[key])
-        form.Root.AcroForm.update(
-            pdfrw.PdfDict(NeedAppearances=pdfrw.PdfObject("true"))
+        mutable[id(obj)] = obj
+        seeds.extend(referrers.get(id(obj), []))
+    shared = {key: obj for key, obj in seen.items() if key not in mutable}
+    return list(mutable.values()), shared
+
+
+def _parsed_children(form: pdfpop.reader.MappedReader, obj: Any) -> list[Any]:
+    """Return the values of a container that are parsed.
+
+    References to parsed objects are replaced by the objects themselves, and
+    references to unparsed objects are skipped.
+    """
+    if isinstance(obj, pdfrw.PdfDict):
+        items = list(dict.items(obj))
+        setitem = dict.__setitem__
+    else:
+        items = list(enumerate(list.__iter__(obj)))
+        setitem = list.__setitem__
+    children = []
+    for key, value in items:
+        if isinstance(value, pdfrw.objects.pdfindirect.PdfIndirect):
+            value = form.loaded(value)
+            if value is None:
+                continue
+            setitem(obj, key, value)
+        children.append(value)
+    return children
+
+
+def _find_owners(mutable: list, positions: dict[int, int]) -> list:
+    """Return the position of the indirect object containing each object.
+
+    Indirect objects own themselves. Objects that are only contained by the
+    trailer have no owner (`None`).
+    """
+    containers = {}
+    for pos, obj in enumerate(mutable):
+        if isinstance(obj, pdfrw.PdfDict):
+            values = dict.values(obj)
+        else:
+            values = list.__iter__(obj)
+        for value in values:
+            child = positions.get(id(value))
+            if child is not None and not mutable[child].indirect:
+                containers[child] = pos
+    owners = []
+    for pos, obj in enumerate(mutable):
+        while pos is not None and not mutable[pos].indirect:
+            pos = containers.get(pos)
+        owners.append(pos)
+    return owners
+
+
+def _index_fields(
+    form: pdfrw.pdfreader.PdfReader, positions: dict[int, int]
+) -> dict[str, IndexedField]:
+    """Map the qualified name of each field to its index entry."""
+    widgets = {}
+    annotations = {}
+    for page in form.pages:
+        for annotation in page["/Annots"] or []:
+            if annotation["/Subtype"] != "/Widget":
+                continue
+            field = annotation if annotation["/T"] else annotation["/Parent"]
+            key = _qualified_name(field)
+            annotations.setdefault(key, field)
+            widgets.setdefault(key, []).append(positions[id(annotation)])
+    return {
+        key: IndexedField(
+            name=key,
+            type=_field_type(field),
+            annotation=positions[id(field)],
+            widgets=tuple(widgets[key]),
+            options=_option_table(field["/Opt"]),
+            exports=_export_names(field["/Kids"]),
+        )
+        for key, field in annotations.items()
+    }
+
+
+def _option_table(
+    options: Optional[pdfrw.PdfArray],
+) -> Optional[dict[str, pdfrw.PdfString]]:
+    """Map the display value of each choice option to its export value.
+
+    An option is either an `[export display]` pair or a single string that is
+    both. Later options win if several share a display value.
+    """
+    if options is None:
+        return None
+    table = {}
+    for option in options:
+        if isinstance(option, pdfrw.PdfArray):
+            export, display = option[0], option[1]
+        else:
+            export = display = option
+        table[display.to_unicode()] = pdfrw.PdfString.encode(
+            export.to_unicode()
         )
-    pdfrw.PdfWriter().write(output_path, form)
+    return table
+
 
+def _export_names(
+    kids: Optional[pdfrw.PdfArray],
+) -> Optional[tuple[Optional[pdfrw.PdfName], ...]]:
+    """Return the export name of each kid of a button field.
 
-def _iterate_pages(form: pdfrw.pdfreader.PdfReader) -> dict[str, str]:
-    """Iterate through pages in a form."""
+    The export name of a kid is the name of its normal appearance other than
+    `/Off`, or `None` if it has none.
+    """
+    if kids is None:
+        return None
+    exports = []
+    for kid in kids:
+        appearances = kid["/AP"] and kid["/AP"]["/N"]
+        names = appearances.keys() if isinstance(appearances, dict) else []
+        exports.append(next((name for name in names if name != OFF), None))
+    return tuple(exports)
+
+
+def _qualified_name(field: pdfrw.PdfDict) -> str:
+    """Return the fully qualified name of a field."""
+    names = []
+    while field is not None:
+        if field["/T"] is not None:
+            names.append(field["/T"].to_unicode())
+        field = field["/Parent"]
+    return ".".join(reversed(names))
+
+
+def _iterate_fields(form: pdfrw.pdfreader.PdfReader) -> dict[str, None]:
+    """Iterate through the AcroForm field tree of a form.
+
+    Terminal fields (those whose kids, if any, are widgets without a name)
+    are listed by qualified name in tree order. Malformed trees yield no
+    fields.
+    """
+    acro_form = form.Root and form.Root["/AcroForm"]
+    fields = acro_form and acro_form["/Fields"]
+    if not isinstance(fields, pdfrw.PdfArray):
+        return {}
     fields_info = {}
-    for page in form.pages:
+    seen = set()
+    pending = [("", field) for field in reversed(fields)]
+    while pending:
+        prefix, field = pending.pop()
+        if not isinstance(field, pdfrw.PdfDict) or id(field) in seen:
+            continue
+        seen.add(id(field))
+        name = field["/T"]
+        if name is not None:
+            name = name.to_unicode()
+            prefix = f"{prefix}.{name}" if prefix else name
+        kids = field["/Kids"]
+        if not isinstance(kids, pdfrw.PdfArray):
+            kids = []
+        named_kids = [
+            kid
+            for kid in kids
+            if isinstance(kid, pdfrw.PdfDict) and kid["/T"] is not None
+        ]
+        if named_kids:
+            pending.extend((prefix, kid) for kid in reversed(named_kids))
+        elif prefix:
+            fields_info[f"{prefix} [{_field_type(field)}]"] = None
+    return fields_info
+
+
+def _iterate_pages(pages: list[pdfrw.PdfDict]) -> dict[str, None]:
+    """Iterate through the widget annotations of pages."""
+    fields_info = {}
+    for page in pages:
         _iterate_annotations(page, fields_info)
     return fields_info
 
 
 def _iterate_annotations(
-    page: pdfrw.objects.pdfdict.PdfDict, fields_info: dict[str, str]
+    page: pdfrw.objects.pdfdict.PdfDict, fields_info: dict[str, None]
 ) -> None:
     """Iterate through annotations on a page."""
-    annotations = page["/Annots"]
-    for annotation in annotations:
+    for annotation in page["/Annots"] or []:
         if annotation["/Subtype"] != "/Widget":
             continue
         if not annotation["/T"]:
             annotation = annotation["/Parent"]
-        key = annotation["/T"].to_unicode()
+            if annotation is None:
+                continue
+        key = _qualified_name(annotation)
         ft = _field_type(annotation)
         fields_info[f"{key} [{ft}]"] = None
 
 
 def _field_type(annotation) -> str:
-    """Return the field type of an annotation."""
-    ft = annotation["/FT"]
-    ff = annotation["/Ff"]
+    """Return the field type of an annotation.
+
+    The type and flags are inherited from the parent fields, if unset.
+    """
+    ft = annotation.inheritable["/FT"]
+    ff = annotation.inheritable["/Ff"]
     if ft == "/Tx":
         return "text"
     if ft == "/Ch":
@@ -91,7 +1104,7 @@ def _get_strategies() -> dict:
     }
 
 
-def _checkbox_strategy(annotation, value) -> None:
+def _checkbox_strategy(annotation, value, field: IndexedField) -> None:
     if not isinstance(value, bool):
         orig_value = value
         value = value.lower() in [
@@ -104,67 +1117,46 @@ def _checkbox_strategy(annotation, value) -> None:
             "check",
             "checked",
         ]
-        field = annotation["/T"].to_unicode()
-        print(f'Treat "{orig_value}" as "{value}" for field "{field}"')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                'Treat "%s" as "%s" for field "%s"',
+                orig_value,
+                value,
+                annotation["/T"].to_unicode(),
+            )
     if value:
         val_str = pdfrw.objects.pdfname.BasePdfName("/Yes")
     else:
-        val_str = pdfrw.objects.pdfname.BasePdfName("/Off")
+        val_str = OFF
     annotation.update(pdfrw.PdfDict(V=val_str))
 
 
-def _combo_box_strategy(annotation, value) -> None:
-    export = None
-    for each in annotation["/Opt"]:
-        if each[1].to_unicode() == value:
-            export = each[0].to_unicode()
-    if export is None:
-        raise KeyError(f"Export Value: {value} Not Found")
-    pdfstr = pdfrw.objects.pdfstring.PdfString.encode(export)
+def _combo_box_strategy(annotation, value, field: IndexedField) -> None:
+    pdfstr = _export_value(field, value)
     annotation.update(pdfrw.PdfDict(V=pdfstr, AS=pdfstr, AP=""))
 
 
-def _list_box_strategy(annotation, values) -> None:
-    field = annotation["/T"].to_unicode()
-    pdfstrs = []
-    for value in values:
-        export = None
-        for each in annotation["/Opt"]:
-            if each[1].to_unicode() == value:
-                export = each[0].to_unicode()
-        if export is None:
-            raise KeyError(f"Export Value: {value} Not Found")
-        pdfstrs.append(pdfrw.objects.pdfstring.PdfString.encode(export))
+def _list_box_strategy(annotation, values, field: IndexedField) -> None:
+    pdfstrs = [_export_value(field, value) for value in values]
     empty = ["" for _ in range(len(pdfstrs))]
     annotation.update(pdfrw.PdfDict(V=pdfstrs, AS=pdfstrs, AP=empty))
 
 
-RADIO_BUTTON_CACHE = {}
+def _export_value(field: IndexedField, value: str) -> pdfrw.PdfString:
+    """Return the export value of a choice field option by display value."""
+    export = field.options.get(value) if field.options else None
+    if export is None:
+        raise KeyError(f"Export Value: {value} Not Found")
+    return export
 
 
-def _radio_button_strategy(annotation, value) -> None:
-    field = annotation["/T"].to_unicode()
-    if field in RADIO_BUTTON_CACHE:
-        return
-    else:
-        RADIO_BUTTON_CACHE[field] = True
-    for each in annotation["/Kids"]:
-        # determine the export value of each kid
-        keys = each["/AP"]["/N"].keys()
-        if ["/Off"] in keys:
-            keys.remove("/Off")
-        export = keys[0]
-
-        if f"/{value}" == export:
-            val_str = pdfrw.objects.pdfname.BasePdfName(f"/{value}")
-        else:
-            val_str = pdfrw.objects.pdfname.BasePdfName(f"/Off")
-        each.update(pdfrw.PdfDict(AS=val_str))
-    annotation.update(
-        pdfrw.PdfDict(V=pdfrw.objects.pdfname.BasePdfName(f"/{value}"))
-    )
+def _radio_button_strategy(annotation, value, field: IndexedField) -> None:
+    selected = pdfrw.PdfName(str(value))
+    for kid, export in zip(annotation["/Kids"], field.exports or ()):
+        kid.update(pdfrw.PdfDict(AS=selected if export == selected else OFF))
+    annotation.update(pdfrw.PdfDict(V=selected))
 
 
-def _text_box_strategy(annotation, value) -> None:
+def _text_box_strategy(annotation, value, field: IndexedField) -> None:
     pdfstr = pdfrw.objects.pdfstring.PdfString.encode(value)
     annotation.update(pdfrw.PdfDict(V=pdfstr, AS=pdfstr, AP=""))
@@ -0,0 +1,56 @@
+"""Bounded pipeline stages of single-process runs.
+
+In a single process, rows are read ahead by a reader thread and outputs are
+written by `IO_THREADS` threads while the next rows are populated. At most
+`PIPELINE_DEPTH` items wait between two stages, so that memory use stays
+bounded however fast one stage is compared to the others.
+
+The module only depends on the standard library, so that the CLI can show
+these defaults without importing the commands.
+"""
+from typing import Any, Iterator
+import contextlib
+import queue
+import threading
+
+
+IO_THREADS = 4
+PIPELINE_DEPTH = 32
+
+
+def read_ahead(
+    rows: Iterator[dict[str, Any]], depth: int = PIPELINE_DEPTH
+) -> Iterator[dict[str, Any]]:
+    """Yield rows that a reader thread reads up to `depth` rows ahead.
+
+    Errors raised while reading are raised here, in the consuming thread.
+    """
+    rows_queue = queue.Queue(depth)
+    stop = threading.Event()
+
+    def read() -> None:
+        try:
+            for row in rows:
+                rows_queue.put((row, None))
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            rows_queue.put((None, e))
+        else:
+            rows_queue.put((None, None))
+
+    threading.Thread(target=read, name="pdfpop-read", daemon=True).start()
+    try:
+        while True:
+            row, error = rows_queue.get()
+            if error is not None:
+                raise error
+            if row is None:
+                return
+            yield row
+    finally:
+        # Unblock the reader so that it notices it should stop.
+        stop.set()
+        with contextlib.suppress(queue.Empty):
+            while True:
+                rows_queue.get_nowait()
@@ -0,0 +1,122 @@
+"""In-process API for populating forms without intermediate files.
+
+A `Populator` loads a configuration once and keeps the parsed form templates
+and compiled mappings warm, so that each call only evaluates the mappings,
+fills a clone of the template and serializes it. Templates are kept in a
+`TemplateCache` and parsed again when their file is modified. It is safe to
+share one instance between threads.
+"""
+from typing import Any, BinaryIO, Iterable, Optional, Union
+import collections
+import io
+import pathlib
+import threading
+
+import pdfpop.cache
+import pdfpop.form_config
+import pdfpop.pdf
+
+
+# The number of compiled configurations kept for different sets of columns.
+MAX_COMPILED = 16
+
+
+class Populator:
+    """Populate the form of a configuration with rows of data in memory."""
+
+    def __init__(
+        self,
+        config: Union[pathlib.Path, pdfpop.form_config.FormConfig],
+        form: Optional[Union[pathlib.Path, pdfpop.pdf.FormTemplate]] = None,
+        columns: Optional[Iterable[str]] = None,
+        incremental: bool = False,
+        appearances: bool = False,
+        flatten: bool = False,
+        templates: Optional[pdfpop.cache.TemplateCache] = None,
+    ) -> None:
+        """Initialize the populator from a configuration.
+
+        If `form` is given it is used instead of the form of the
+        configuration. If the data columns are known ahead of time, passing
+        them as `columns` compiles the configuration once up front; otherwise
+        it is compiled for each distinct set of row keys that the mappings
+        refer to, of which the `MAX_COMPILED` most recently used are kept.
+        Other row keys are ignored. With `incremental`, outputs are written as
+        incremental updates of the form (see `FormTemplate.update`).
+        `appearances` and `flatten` are as for `FormTemplate.populate`. The
+        forms selected by rows are kept in `templates`, which may be shared
+        with other populators.
+        """
+        if isinstance(config, pdfpop.form_config.FormConfig):
+            self._form_cfg = config
+        else:
+            self._form_cfg = pdfpop.form_config.FormConfig(config)
+            self._form_cfg.load()
+        if isinstance(form, pathlib.Path):
+            form = pdfpop.pdf.FormTemplate(form)
+        self._form = form
+        self._incremental = incremental
+        self._appearances = appearances
+        self._flatten = flatten
+        self._lock = threading.Lock()
+        if templates is None:
+            templates = pdfpop.cache.TemplateCache()
+        self._templates = templates
+        self._compiled = collections.OrderedDict()
+        self._names = frozenset(
+            value
+            for section in ("io", "fields")
+            for value in self._form_cfg.data[section].values()
+            if isinstance(value, str)
+        )
+        if columns is not None:
+            self._compile(frozenset(columns))
+
+    def populate(self, row: dict[str, Any]) -> bytes:
+        """Return the form populated with a row of data as PDF bytes."""
+        output = io.BytesIO()
+        self.write(row, output)
+        return output.getvalue()
+
+    def write(self, row: dict[str, Any], output: BinaryIO) -> None:
+        """Write the form populated with a row of data to a binary stream."""
+        compiled = self._compile(frozenset(row))
+        template = self._template(compiled, row)
+        fields = compiled.fields.evaluate(row)
+        populated = template.fill(
+            fields, self._incremental, self._appearances, self._flatten
+        )
+        pdfpop.pdf.write_form(template, populated, output)
+
+    def _compile(
+        self, columns: frozenset[str]
+    ) -> pdfpop.form_config.CompiledConfig:
+        """Return the configuration compiled for a set of columns.
+
+        Only the columns that a mapping may refer to (i.e., that are equal to
+        a string mapping) change how the configuration is compiled.
+        """
+        columns &= self._names
+        with self._lock:
+            compiled = self._compiled.get(columns)
+            if compiled is not None:
+                self._compiled.move_to_end(columns)
+                return compiled
+            compiled = pdfpop.form_config.CompiledConfig(
+                self._form_cfg, columns
+            )
+            self._compiled[columns] = compiled
+            if len(self._compiled) > MAX_COMPILED:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def _template(
+        self,
+        compiled: pdfpop.form_config.CompiledConfig,
+        row: dict[str, Any],
+    ) -> pdfpop.pdf.FormTemplate:
+        """Return the parsed template of the form for a row."""
+        if self._form is not None:
+            return self._form
+        form_path = pathlib.Path(compiled.io.evaluate(row)["form"])
+        return self._templates.get(form_path)
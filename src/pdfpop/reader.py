@@ -0,0 +1,370 @@
+"""Lazily-resolved reading of PDF files from their bytes.
+
+`pdfrw.PdfReader` decodes a whole PDF into a string before parsing it. A
+`MappedReader` keeps the bytes of the file as they are instead and only
+parses its cross-reference sections when it is opened. Each indirect object
+is parsed from its own bytes when it is first accessed, and the bytes of
+every object stay available (see `objects`), so that objects that are never
+accessed (e.g., page content and images) can be copied to an output as is
+instead of being decoded and serialized again.
+
+The bytes are read into memory unless the reader is asked to memory-map the
+file. Mapping opens very large files faster, but a process that reads a
+mapped file after it was truncated is killed with `SIGBUS`, so it is only
+suitable for files that do not change while they are read.
+
+Encrypted files, and files whose cross-reference sections do not match their
+objects, are not read lazily: `open_reader` parses them with pdfrw instead.
+"""
+from typing import Any, Iterable, Iterator, Optional, Union
+import bisect
+import logging
+import mmap
+import os
+import pathlib
+import re
+import threading
+
+import pdfrw
+from pdfrw.objects.pdfindirect import PdfIndirect
+from pdfrw.py23_diffs import convert_load
+from pdfrw.tokens import PdfTokens
+from pdfrw.uncompress import uncompress
+
+
+# The size of the first window in which a cross-reference section is parsed
+# if its end is unknown. The window grows until the section fits.
+SECTION_WINDOW = 1 << 16
+
+_OBJECT_HEADER = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj\b")
+_EOL = b"\r\n"
+
+logger = logging.getLogger(__name__)
+
+
+class MappedReader(pdfrw.PdfReader):
+    """A PDF reader that keeps the bytes of its file and parses objects lazily.
+
+    The reader is a trailer dictionary with the pages of the document, like
+    `pdfrw.PdfReader`, and is used the same way. Indirect objects are parsed
+    on first access, which is thread-safe.
+    """
+
+    def __init__(
+        self, path: pathlib.Path, pages: bool = True, memory_map: bool = False
+    ) -> None:
+        """Read the PDF at the given path and parse its cross-references.
+
+        With `pages`, the page tree is walked (see `pdfrw.PdfReader.pages`).
+        With `memory_map`, the file is memory-mapped instead of read into
+        memory. Raises a `RuntimeError` if the file cannot be read lazily.
+        """
+        self._open(path, memory_map)
+        data = self.data
+        if data[:5] != b"%PDF-":
+            raise RuntimeError("PDF header not at beginning of file")
+        self.private.version = data[5:8].decode("latin-1")
+        trailer = self._read_cross_references()
+        if pdfrw.PdfName.Encrypt in trailer:
+            raise RuntimeError("PDF is encrypted")
+        for key, value in dict.items(trailer):
+            if key in ("/Root", "/Info", "/ID", "/Size"):
+                dict.__setitem__(self, key, value)
+        self.private.pages = self.readpages(self.Root) if pages else []
+
+    @classmethod
+    def restore(
+        cls,
+        path: pathlib.Path,
+        state: dict[str, Any],
+        pages: list,
+        memory_map: bool = False,
+    ) -> "MappedReader":
+        """Return a reader of a PDF from its state (see `state`).
+
+        Nothing is parsed: the cross-references, trailer and parsed objects
+        are those of the state, and `pages` are the page objects. Raises a
+        `RuntimeError` if the file has changed since the state was taken.
+        """
+        reader = cls.__new__(cls)
+        reader._open(path, memory_map)
+        if reader.signature != state["signature"]:
+            raise RuntimeError(f'PDF "{path}" has changed')
+        private = reader.private
+        private.version = state["version"]
+        private.entries = state["entries"]
+        private.compressed = state["compressed"]
+        private.xref_streams = state["xref_streams"]
+        for key, obj in state["objects"].items():
+            if isinstance(obj, PdfIndirect):
+                obj._loader = reader.loadindirect
+                reader.deferred_objects.add(key)
+            reader.indirect_objects[key] = obj
+        dict.update(reader, state["trailer"])
+        private.pages = pages
+        return reader
+
+    def state(self, objects: Iterable[Any]) -> dict[str, Any]:
+        """Return the state of the reader without its bytes, for pickling.
+
+        Of the parsed objects, only the given ones are kept. The others are
+        parsed again when they are accessed, and so are the objects that are
+        not parsed yet, whose references are kept.
+        """
+        kept = {id(obj) for obj in objects}
+        return {
+            "signature": self.signature,
+            "version": self.version,
+            "entries": self.entries,
+            "compressed": self.compressed,
+            "xref_streams": self.xref_streams,
+            "trailer": dict(dict.items(self)),
+            "objects": {
+                key: obj
+                for key, obj in self.indirect_objects.items()
+                if isinstance(obj, PdfIndirect) or id(obj) in kept
+            },
+        }
+
+    @property
+    def data(self) -> Union[bytes, mmap.mmap]:
+        """Getter for the bytes of the file (mapped if it is)."""
+        return vars(self)["data"]
+
+    @property
+    def signature(self) -> tuple[int, int]:
+        """Getter for the size and modification time of the file."""
+        return vars(self)["signature"]
+
+    def objects(self) -> Iterator[tuple[int, int, Optional[tuple[int, int]]]]:
+        """Yield the number, generation and extent of every object.
+
+        The extent is the range of the bytes of an object in the file, from
+        its `obj` header to its `endobj` keyword and line ending. Objects
+        stored in object streams have no extent. Object and cross-reference
+        streams are left out, since their objects are listed on their own.
+        """
+        streams = set(self.compressed.values()) | self.xref_streams
+        for number, (generation, extent) in sorted(self.entries.items()):
+            if number not in streams:
+                yield number, generation, extent
+
+    def loaded(self, key: Any) -> Optional[Any]:
+        """Return the indirect object with a key if it is loaded yet."""
+        if not isinstance(key, tuple):
+            return None
+        obj = self.indirect_objects.get(tuple(key))
+        return None if isinstance(obj, PdfIndirect) else obj
+
+    def load(self, number: int, generation: int = 0) -> Any:
+        """Return an indirect object by number, parsing it if needed."""
+        obj = self.findindirect(number, generation)
+        return obj.real_value() if isinstance(obj, PdfIndirect) else obj
+
+    def loadindirect(self, key: tuple[int, int], *args: Any) -> Any:
+        """Parse an indirect object from its bytes in the file."""
+        with self.lock:
+            result = self.indirect_objects.get(key)
+            if not isinstance(result, PdfIndirect):
+                return result
+            number, generation = key
+            entry = self.entries.get(number)
+            if entry is None or entry[0] != generation:
+                logger.warning("Did not find PDF object %s.", key)
+                return None
+            if entry[1] is None:
+                self._load_object_stream(self.compressed[number])
+                return self.loaded(key)
+            source = self._tokens(*entry[1])
+            source.multiple(3)  # The header is checked when opening.
+            obj = self._read_object(source, key)
+            tok = source.next()
+            if tok == "stream" and isinstance(obj, pdfrw.PdfDict):
+                self.readstream(obj, self.findstream(obj, tok, source), source)
+            elif tok != "endobj":
+                source.error("Expected 'endobj' token")
+            return obj
+
+    def _read_object(self, source: PdfTokens, key: tuple[int, int]) -> Any:
+        """Parse an object at the position of a source and register it."""
+        obj = source.next()
+        func = self.special.get(obj)
+        if func is not None:
+            obj = func(source)
+        obj.indirect = key
+        self.indirect_objects[key] = obj
+        self.deferred_objects.discard(key)
+        return obj
+
+    def _load_object_stream(self, number: int) -> None:
+        """Parse the objects of an object stream that are still current.
+
+        Objects that a later revision of the file replaced are skipped.
+        """
+        entry = self.entries.get(number)
+        if number in self.loaded_streams or entry is None:
+            return
+        self.loaded_streams.add(number)
+        stream = self.load(number, entry[0])
+        if stream is None or stream.Type != "/ObjStm":
+            logger.warning("PDF object %d is not an object stream.", number)
+            return
+        if not uncompress([stream]):
+            logger.warning("Could not decompress object stream %d.", number)
+            return
+        source = PdfTokens(stream.stream, 0, False, self.verbose)
+        first = int(stream.First)
+        members = [
+            (int(source.next()), first + int(source.next()))
+            for _ in range(int(stream.N))
+        ]
+        for member, offset in members:
+            key = (member, 0)
+            if self.compressed.get(member) == number and not self.loaded(key):
+                source.floc = offset
+                self._read_object(source, key)
+
+    def _open(self, path: pathlib.Path, memory_map: bool) -> None:
+        """Read (or map) the bytes of a PDF and set up the parser state."""
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if memory_map:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+        private = self.private
+        private.data = data
+        private.signature = (stat.st_size, stat.st_mtime_ns)
+        private.verbose = True
+        private.lock = threading.RLock()
+        private.indirect_objects = {}
+        private.deferred_objects = set()
+        private.loaded_streams = set()
+        private.special = {
+            "<<": self.readdict,
+            "[": self.readarray,
+            "endobj": self.empty_obj,
+        }
+        for tok in r"\ ( ) < > { } ] >> %".split():
+            self.special[tok] = self.badtoken
+
+    def _read_cross_references(self) -> pdfrw.PdfDict:
+        """Parse every cross-reference section and return the trailer.
+
+        Later sections (which come first in the `/Prev` chain) take
+        precedence over earlier ones, as in `pdfrw.PdfReader`.
+        """
+        data = self.data
+        position = data.rfind(b"startxref")
+        if position < 0:
+            raise RuntimeError('Did not find "startxref" at end of file')
+        offset = int(data[position + len(b"startxref") :].split()[0])
+        trailer = None
+        entries = {}
+        compressed = {}
+        sections = []
+        starts = {len(data)}
+        while offset is not None:
+            if offset in sections:
+                raise RuntimeError("Cross-reference sections form a loop")
+            sections.append(offset)
+            starts.add(offset)
+            section, offsets, streams = self._read_section(offset)
+            for (number, generation), start in offsets.items():
+                entries.setdefault(number, (generation, start))
+                starts.add(start)
+            for stream, members in streams.items():
+                for number, _ in members:
+                    if number not in entries:
+                        entries[number] = (0, None)
+                        compressed[number] = stream
+            if trailer is None:
+                trailer = section
+            else:
+                for key, value in dict.items(section):
+                    dict.setdefault(trailer, key, value)
+            prev = dict.get(section, "/Prev")
+            offset = None if prev is None else int(prev)
+        starts = sorted(starts)
+        private = self.private
+        private.compressed = compressed
+        private.xref_streams = set()
+        private.entries = {}
+        for number, (generation, start) in entries.items():
+            extent = None
+            if start is not None:
+                extent = self._extent(number, generation, start, starts)
+                if start in sections:
+                    self.xref_streams.add(number)
+            self.entries[number] = (generation, extent)
+        return trailer
+
+    def _read_section(
+        self, offset: int
+    ) -> tuple[pdfrw.PdfDict, dict[tuple[int, int], int], dict[int, list]]:
+        """Parse the cross-reference section at an offset.
+
+        Returns the section's trailer, the offsets of its objects and the
+        objects of each of its object streams.
+        """
+        end = self.data.find(b"startxref", offset)
+        size = end - offset if end >= 0 else SECTION_WINDOW
+        while True:
+            source = self._tokens(offset, offset + size)
+            source.obj_offsets = {}
+            try:
+                section, is_stream = self.parsexref(source)
+            except (pdfrw.PdfParseError, StopIteration):
+                if offset + size >= len(self.data):
+                    raise
+                size *= 4
+                continue
+            streams = section.object_streams if is_stream else {}
+            return section, source.obj_offsets, streams
+
+    def _extent(
+        self, number: int, generation: int, start: int, starts: list[int]
+    ) -> tuple[int, int]:
+        """Return the extent of an object from its offset.
+
+        An object ends at the last `endobj` keyword before the next object or
+        cross-reference section. Raises a `RuntimeError` if the offset is not
+        the start of the object.
+        """
+        match = _OBJECT_HEADER.match(self.data, start)
+        if match is None or (int(match[1]), int(match[2])) != (
+            number,
+            generation,
+        ):
+            raise RuntimeError(f"PDF object {number} is not at its offset")
+        limit = starts[bisect.bisect_right(starts, start)]
+        end = self.data.rfind(b"endobj", start, limit)
+        if end < 0:
+            raise RuntimeError(f"PDF object {number} has no endobj")
+        end += len(b"endobj")
+        while end < limit and self.data[end] in _EOL:
+            end += 1
+        return start, end
+
+    def _tokens(self, start: int, end: int) -> PdfTokens:
+        """Return a tokenizer of the bytes of the file in a range."""
+        window = convert_load(self.data[start:end])
+        return PdfTokens(window, 0, True, self.verbose)
+
+
+def open_reader(
+    path: pathlib.Path,
+    pages: bool = True,
+    fallback: type = pdfrw.PdfReader,
+    memory_map: bool = False,
+) -> pdfrw.PdfReader:
+    """Return a lazy reader of a PDF, or a `fallback` reader if needed.
+
+    `pages` and `memory_map` are as for `MappedReader`. Files that cannot be
+    read lazily (e.g., encrypted ones) are read by the fallback reader class.
+    """
+    try:
+        return MappedReader(path, pages, memory_map)
+    except Exception as e:
+        logger.info('Parsing "%s" in full: %s.', path, e)
+        return fallback(path)
@@ -0,0 +1,269 @@
+"""Local HTTP service for populating forms.
+
+The service keeps a `Populator` for each configuration in memory, so the cost
+of imports, loading configurations and parsing forms is only paid once. Rows
+are sent as JSON objects and the populated PDF is sent back:
+
+    POST /fill          populate the form of the only configuration
+    POST /fill/<name>   populate the form of the configuration `<name>.json`
+    GET  /health        list the configurations that are served
+
+Requests are handled by a fixed number of worker threads. Requests that
+arrive while every worker is busy wait in a queue of limited length, and are
+rejected with `503 Service Unavailable` once the queue is full. A
+configuration or form is loaded again when its file is modified.
+"""
+from typing import Any, Iterable, Optional
+import concurrent.futures
+import http
+import http.server
+import io
+import json
+import logging
+import pathlib
+import socket
+import socketserver
+import threading
+
+import pdfpop
+import pdfpop.cache
+import pdfpop.populator
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_QUEUE_LIMIT = 64
+MAX_BODY_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigRegistry:
+    """Populators for a set of configurations, reloaded when they change."""
+
+    def __init__(self, config_paths: Iterable[pathlib.Path]) -> None:
+        """Initialize the registry and load every configuration.
+
+        The populators of every configuration share one template cache.
+        """
+        self._paths = {path.stem: path for path in config_paths}
+        self._templates = pdfpop.cache.TemplateCache()
+        self._populators = {}
+        self._lock = threading.Lock()
+        for name in self._paths:
+            self.get(name)
+
+    @property
+    def names(self) -> list[str]:
+        """Getter for the names of the configurations."""
+        return list(self._paths)
+
+    def get(self, name: Optional[str]) -> pdfpop.populator.Populator:
+        """Return the populator of a configuration, by name.
+
+        The name may be omitted if there is a single configuration. Raises a
+        `KeyError` for unknown configurations.
+        """
+        if name is None and len(self._paths) == 1:
+            (name,) = self._paths
+        path = self._paths[name]
+        mtime = path.stat().st_mtime_ns
+        cached = self._populators.get(name)
+        if cached is None or cached[0] != mtime:
+            with self._lock:
+                cached = self._populators.get(name)
+                if cached is None or cached[0] != mtime:
+                    if cached is not None:
+                        logger.info('Reloading configuration "%s".', path)
+                    populator = pdfpop.populator.Populator(
+                        path, templates=self._templates
+                    )
+                    cached = self._populators[name] = (mtime, populator)
+        return cached[1]
+
+
+class _PooledServerMixin:
+    """Handle requests in a fixed pool of threads with a bounded queue."""
+
+    def start_pool(self, workers: int, queue_limit: int) -> None:
+        """Start the worker threads."""
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="pdfpop-serve"
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def process_request(self, request: socket.socket, client_address) -> None:
+        """Queue a request for a worker, or reject it if the queue is full."""
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Rejected a request because the queue is full.")
+            try:
+                request.sendall(
+                    b"HTTP/1.0 503 Service Unavailable\r\n"
+                    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._executor.submit(self._process, request, client_address)
+
+    def _process(self, request: socket.socket, client_address) -> None:
+        """Handle a request in a worker thread."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self) -> None:
+        """Stop accepting requests and wait for the queued ones."""
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+class FillHTTPServer(_PooledServerMixin, http.server.HTTPServer):
+    """Form filling service on a TCP address."""
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        registry: ConfigRegistry,
+        workers: int,
+        queue_limit: int,
+    ) -> None:
+        """Initialize the server and start its worker threads."""
+        self.registry = registry
+        super().__init__(address, _FillRequestHandler)
+        self.start_pool(workers, queue_limit)
+
+
+class FillUnixServer(_PooledServerMixin, socketserver.UnixStreamServer):
+    """Form filling service on a Unix domain socket."""
+
+    def __init__(
+        self,
+        socket_path: pathlib.Path,
+        registry: ConfigRegistry,
+        workers: int,
+        queue_limit: int,
+    ) -> None:
+        """Initialize the server and start its worker threads."""
+        self.registry = registry
+        super().__init__(str(socket_path), _FillRequestHandler)
+        self.start_pool(workers, queue_limit)
+
+
+class _FillRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handle the requests of the form filling service."""
+
+    server_version = f"pdfpop/{pdfpop.__version__}"
+
+    def do_GET(self) -> None:
+        """Report the health of the service."""
+        if self.path != "/health":
+            self._send_json(http.HTTPStatus.NOT_FOUND, {"error": "Not found."})
+            return
+        self._send_json(
+            http.HTTPStatus.OK,
+            {"status": "ok", "configs": self.server.registry.names},
+        )
+
+    def do_POST(self) -> None:
+        """Populate a form with the row in the request body."""
+        parts = self.path.strip("/").split("/")
+        if parts[0] != "fill" or len(parts) > 2:
+            self._send_json(http.HTTPStatus.NOT_FOUND, {"error": "Not found."})
+            return
+        name = parts[1] if len(parts) == 2 else None
+        try:
+            populator = self.server.registry.get(name)
+        except KeyError:
+            self._send_json(
+                http.HTTPStatus.NOT_FOUND,
+                {"error": f"Unknown configuration: {name}."},
+            )
+            return
+        row = self._read_row()
+        if row is None:
+            return
+        output = io.BytesIO()
+        try:
+            populator.write(row, output)
+        except Exception as e:
+            logger.error(
+                "Failed to populate a request: %s: %s", type(e).__name__, e
+            )
+            self._send_json(
+                http.HTTPStatus.UNPROCESSABLE_ENTITY,
+                {"error": f"{type(e).__name__}: {e}"},
+            )
+            return
+        self.send_response(http.HTTPStatus.OK)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(output.tell()))
+        self.end_headers()
+        self.wfile.write(output.getbuffer())
+
+    def address_string(self) -> str:
+        """Return the client address (Unix sockets have none)."""
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log requests through the pdfpop logger."""
+        logger.info("%s - " + format, self.address_string(), *args)
+
+    def _read_row(self) -> Optional[dict[str, Any]]:
+        """Return the row in the request body, or send an error."""
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= MAX_BODY_SIZE:
+            self._send_json(
+                http.HTTPStatus.BAD_REQUEST,
+                {"error": "Expected a JSON object body."},
+            )
+            return None
+        try:
+            row = json.loads(self.rfile.read(length))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            row = e
+        if not isinstance(row, dict):
+            self._send_json(
+                http.HTTPStatus.BAD_REQUEST,
+                {"error": "Expected a JSON object body."},
+            )
+            return None
+        return row
+
+    def _send_json(self, status: http.HTTPStatus, data: Any) -> None:
+        """Send a JSON response."""
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(
+    config_paths: Iterable[pathlib.Path],
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    socket_path: Optional[pathlib.Path] = None,
+    workers: int = 1,
+    queue_limit: int = DEFAULT_QUEUE_LIMIT,
+) -> socketserver.BaseServer:
+    """Return a form filling server for the given configurations.
+
+    The server listens on a Unix domain socket if `socket_path` is given and
+    on the TCP address `host:port` otherwise.
+    """
+    registry = ConfigRegistry(config_paths)
+    if socket_path is not None:
+        return FillUnixServer(socket_path, registry, workers, queue_limit)
+    return FillHTTPServer((host, port), registry, workers, queue_limit)
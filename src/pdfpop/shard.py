@@ -0,0 +1,216 @@
+"""Deterministic sharding of runs across independent processes or machines.
+
+A run with the shard `i/N` populates only the rows of its data file that
+belong to shard `i` of `N`: every `N`th row by row index, or the rows whose
+key column hashes to the shard. The assignment only depends on the data, so
+`N` runs of the same file (e.g., on different machines) populate every row
+exactly once without coordinating.
+
+Each shard records the status of its rows in a status manifest (JSON Lines):
+a header describing the shard, one line for each row of the shard, and a
+final line with the number of rows in the data file once the shard has
+finished. `combine` merges the status manifests of every shard and finds the
+rows that are missing or failed.
+"""
+from typing import Any, Iterable, Iterator, NamedTuple, Optional
+import hashlib
+import json
+import pathlib
+import re
+
+
+POPULATED = "populated"
+SKIPPED = "skipped"
+MERGED = "merged"
+FAILED = "failed"
+MISSING = "missing"
+
+_SPEC_PATTERN = re.compile(r"\s*(\d+)\s*/\s*(\d+)\s*")
+
+
+class Shard(NamedTuple):
+    """The slice `index` of `count` (counting from 1) of a data file.
+
+    Rows are assigned by row index, or by a hash of the `key` column if it is
+    given, so that rows with the same key land in the same shard.
+    """
+
+    index: int
+    count: int
+    key: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    @property
+    def status_name(self) -> str:
+        """Getter for the default file name of the shard's status manifest."""
+        return f"pdfpop-status-{self.index}-of-{self.count}.jsonl"
+
+    def contains(self, idx: int, row: dict[str, Any]) -> bool:
+        """Return whether the row at index `idx` belongs to the shard."""
+        if self.key is None:
+            return idx % self.count == self.index - 1
+        value = str(row[self.key]).encode("utf-8")
+        bucket = int.from_bytes(hashlib.sha256(value).digest()[:8], "big")
+        return bucket % self.count == self.index - 1
+
+    def select(
+        self, rows: Iterable[tuple[int, dict[str, Any]]]
+    ) -> Iterator[tuple[int, dict[str, Any]]]:
+        """Yield the indexed rows that belong to the shard."""
+        for idx, row in rows:
+            if self.contains(idx, row):
+                yield idx, row
+
+
+def parse(spec: str, key: Optional[str] = None) -> Shard:
+    """Return the shard described by `i/N`, keyed by a column if given.
+
+    Raises a `ValueError` if the description is invalid.
+    """
+    match = _SPEC_PATTERN.fullmatch(spec)
+    if match is None:
+        raise ValueError(f"Expected a shard as i/N, got {spec!r}.")
+    index, count = int(match[1]), int(match[2])
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard {index}/{count} is not between 1 and {count}.")
+    return Shard(index, count, key)
+
+
+class StatusManifest:
+    """Status of every row of a shard, written as the rows are populated."""
+
+    def __init__(
+        self, path: pathlib.Path, shard: Shard, header: dict[str, Any]
+    ) -> None:
+        """Start a new status manifest, replacing an existing one.
+
+        The `header` (e.g., the data path and configuration digest) is
+        recorded along with the shard.
+        """
+        self._path = path
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self._path.open("w", encoding="utf-8")
+        self._write(
+            {"shard": shard.index, "shards": shard.count, "key": shard.key}
+            | header
+        )
+
+    @property
+    def path(self) -> pathlib.Path:
+        """Status manifest path getter."""
+        return self._path
+
+    def record(
+        self,
+        idx: int,
+        status: str,
+        output: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """Record the status of the row at index `idx`."""
+        entry = {"row": idx + 1, "status": status}
+        if output is not None:
+            entry["output"] = output
+        if error is not None:
+            entry["error"] = error
+        self._write(entry)
+
+    def finish(self, total: int) -> None:
+        """Mark the shard as finished, with the number of rows in the data."""
+        self._write({"rows": total})
+
+    def close(self) -> None:
+        """Close the manifest file."""
+        self._file.close()
+
+    def _write(self, entry: dict[str, Any]) -> None:
+        """Append an entry, flushed so that it survives an interrupted run."""
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+
+class Combined(NamedTuple):
+    """The combined status of the rows of every shard."""
+
+    shards: int
+    total: int
+    rows: dict[int, dict[str, Any]]
+    missing_shards: list[int]
+    unfinished_shards: list[int]
+
+    def with_status(self, status: str) -> list[int]:
+        """Return the row numbers with a status, in order."""
+        return sorted(
+            row for row, entry in self.rows.items() if entry["status"] == status
+        )
+
+    @property
+    def missing(self) -> list[int]:
+        """Getter for the row numbers that no shard recorded."""
+        return [row for row in range(1, self.total + 1) if row not in self.rows]
+
+
+def combine(status_paths: Iterable[pathlib.Path]) -> Combined:
+    """Combine the status manifests of the shards of a run.
+
+    Raises a `RuntimeError` if the manifests are not from shards of the same
+    run, i.e., with the same number of shards, key and configuration.
+    """
+    headers = {}
+    rows = {}
+    totals = {}
+    for path in status_paths:
+        header, entries, total = _load(path)
+        previous = next(iter(headers.values()), header)
+        for name in ("shards", "key", "config_digest"):
+            if header.get(name) != previous.get(name):
+                raise RuntimeError(
+                    f'Status manifest "{path}" is from another run: '
+                    f"{name} is {header.get(name)!r}, expected "
+                    f"{previous.get(name)!r}."
+                )
+        if header["shard"] in headers:
+            raise RuntimeError(
+                f"Shard {header['shard']}/{header['shards']} is given twice."
+            )
+        headers[header["shard"]] = header
+        for entry in entries:
+            rows[entry["row"]] = entry
+        if total is not None:
+            totals[header["shard"]] = total
+    if not headers:
+        raise RuntimeError("No status manifests to combine.")
+    count = next(iter(headers.values()))["shards"]
+    total = max(max(totals.values(), default=0), max(rows, default=0))
+    return Combined(
+        count,
+        total,
+        rows,
+        [idx for idx in range(1, count + 1) if idx not in headers],
+        sorted(idx for idx in headers if idx not in totals),
+    )
+
+
+def _load(
+    path: pathlib.Path,
+) -> tuple[dict[str, Any], list[dict[str, Any]], Optional[int]]:
+    """Return the header, row entries and total rows of a status manifest."""
+    header, entries, total = None, [], None
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written final line from an interrupted run.
+                continue
+            if header is None:
+                header = entry
+            elif "row" in entry:
+                entries.append(entry)
+            elif "rows" in entry:
+                total = entry["rows"]
+    if header is None or "shard" not in header:
+        raise RuntimeError(f'"{path}" is not a pdfpop status manifest.')
+    return header, entries, total
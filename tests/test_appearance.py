@@ -0,0 +1,135 @@
+"""Collection of tests for pdfpop's appearance stream generation."""
+import pdfrw
+import pytest
+
+import pdfpop.appearance
+
+
+def _widget(**kwargs):
+    """Return a text widget with the given entries."""
+    widget = pdfrw.PdfDict(
+        Type=pdfrw.PdfName("Annot"),
+        Subtype=pdfrw.PdfName("Widget"),
+        FT=pdfrw.PdfName("Tx"),
+        T=pdfrw.PdfString.encode("field"),
+        Rect=pdfrw.PdfArray([0, 0, 100, 20]),
+    )
+    for key, value in kwargs.items():
+        setattr(widget, key, value)
+    return widget
+
+
+def test_helvetica_metrics():
+    """Test that text is measured with the standard Helvetica widths."""
+    metrics = pdfpop.appearance.HELVETICA
+    assert metrics.measure("A") == 667
+    assert metrics.measure("il") == 444
+    assert metrics.measure("☃") == pdfpop.appearance.HELVETICA_DEFAULT_WIDTH
+
+
+def test_font_widths_are_read_once():
+    """Test that font widths are read from the font and cached."""
+    font = pdfrw.PdfDict(
+        FirstChar=65, Widths=pdfrw.PdfArray([500, 600]), BaseFont="/Custom"
+    )
+    acro_form = pdfrw.PdfDict(
+        DR=pdfrw.PdfDict(Font=pdfrw.PdfDict(F1=font)),
+    )
+    builder = pdfpop.appearance.AppearanceBuilder(acro_form)
+    metrics = builder.metrics("/F1")
+    assert metrics.measure("AB") == 1100
+    assert builder.metrics("/F1") is metrics
+
+
+@pytest.mark.parametrize(
+    "da, expected",
+    [
+        ("/Helv 8.64 Tf 0 g", ("/Helv", 8.64, "0 g")),
+        ("0 0 1 rg /Cour 0 Tf", ("/Cour", 0.0, "0 0 1 rg")),
+        ("0 g", None),
+    ],
+)
+def test_parse_default_appearance(da, expected):
+    """Test that the font, size and color are read from `/DA` strings."""
+    assert pdfpop.appearance._parse_default_appearance(da) == expected
+
+
+def test_text_appearance():
+    """Test that text is drawn with the field's font and alignment."""
+    widget = _widget(
+        DA=pdfrw.PdfString.encode("/Cour 10 Tf 0 g"), Q=pdfrw.PdfObject("2")
+    )
+    builder = pdfpop.appearance.AppearanceBuilder(None)
+    builder.apply("text", widget, widget, "a (b)")
+    stream = widget.AP.N
+    assert "/Cour 10 Tf 0 g" in stream.stream
+    # Right aligned: 100 - padding - five Courier glyphs of 6 points.
+    assert "1 0 0 1 68 " in stream.stream
+    assert r"(a \(b\)) Tj" in stream.stream
+    assert stream.Resources.Font.Cour.BaseFont == "/Courier"
+
+
+def test_text_appearance_auto_size():
+    """Test that a font size of 0 fits the text to the widget."""
+    widget = _widget()
+    builder = pdfpop.appearance.AppearanceBuilder(None)
+    builder.apply("text", widget, widget, "W" * 10)
+    (size,) = [
+        float(token)
+        for token, next_token in zip(
+            widget.AP.N.stream.split(), widget.AP.N.stream.split()[1:]
+        )
+        if next_token == "Tf"
+    ]
+    available = 100 - 2 * pdfpop.appearance.PADDING
+    # The size is written with two decimals.
+    assert size * 10 * 944 / 1000 == pytest.approx(available, abs=0.1)
+
+
+def test_multiline_text_is_wrapped():
+    """Test that multiline text is wrapped at spaces."""
+    widget = _widget(
+        DA=pdfrw.PdfString.encode("/Helv 10 Tf 0 g"),
+        Ff=pdfrw.PdfObject(str(pdfpop.appearance.MULTILINE)),
+        Rect=pdfrw.PdfArray([0, 0, 60, 60]),
+    )
+    builder = pdfpop.appearance.AppearanceBuilder(None)
+    builder.apply("text", widget, widget, "one two three four")
+    assert widget.AP.N.stream.count(" Tj") == 2
+
+
+def test_checkbox_without_appearance():
+    """Test that a checkbox without appearances gets them generated."""
+    widget = _widget(
+        FT=pdfrw.PdfName("Btn"),
+        V=pdfrw.PdfName("Yes"),
+        DA=pdfrw.PdfString.encode("/ZaDb 0 Tf 0 g"),
+    )
+    builder = pdfpop.appearance.AppearanceBuilder(None)
+    builder.apply("checkbox", widget, widget, True)
+    assert widget.AS == "/Yes"
+    assert set(widget.AP.N.keys()) == {"/Yes", "/Off"}
+    assert "(4) Tj" in widget.AP.N.Yes.stream
+
+
+def test_flatten_page():
+    """Test that widgets are drawn into the page and removed."""
+    widget = _widget()
+    pdfpop.appearance.AppearanceBuilder(None).apply(
+        "text", widget, widget, "value"
+    )
+    link = pdfrw.PdfDict(Subtype=pdfrw.PdfName("Link"))
+    content = pdfrw.PdfDict()
+    content.stream = "0 0 m"
+    page = pdfrw.PdfDict(
+        Annots=pdfrw.PdfArray([widget, link]),
+        Contents=content,
+        Resources=pdfrw.PdfDict(),
+    )
+    resources = page.Resources
+    pdfpop.appearance.flatten_page(page)
+    assert list(page.Annots) == [link]
+    assert page.Resources is not resources
+    assert page.Resources.XObject.FlatWidget0 is widget.AP.N
+    assert [stream.stream for stream in page.Contents][:2] == ["q", "0 0 m"]
+    assert page.Contents[2].stream == "Q\nq 1 0 0 1 0 0 cm /FlatWidget0 Do Q"
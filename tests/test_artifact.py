@@ -0,0 +1,203 @@
+"""Collection of tests for pdfpop's compiled form artifacts."""
+import io
+import pathlib
+
+import pdfrw
+import pytest
+
+import pdfpop
+import pdfpop.artifact
+import pdfpop.form_config
+import pdfpop.pdf
+import pdfpop.reader
+
+
+FORM_PATH = pathlib.Path("examples/example-form.pdf")
+ROW = {"name": "John Smith", "satisfied": "No", "membership_type": "1"}
+
+
+@pytest.fixture
+def form_cfg(tmp_path):
+    """Fixture that returns a saved configuration for a copy of a form."""
+    form_path = tmp_path / "form.pdf"
+    form_path.write_bytes(FORM_PATH.read_bytes())
+    form_cfg = pdfpop.form_config.FormConfig(tmp_path / "config.json")
+    form_cfg.data["io"]["form"] = str(form_path)
+    form_cfg.data["io"]["output_dir"] = repr(str(tmp_path))
+    form_cfg.data["io"]["output_name"] = "data['Name'] + '.pdf'"
+    form_cfg.data["fields"] = {"name [text]": "data['Name'].upper()"}
+    form_cfg.save()
+    return form_cfg
+
+
+def _compile(form_cfg):
+    """Compile and save the artifact of a configuration."""
+    artifact = pdfpop.artifact.compile_config(form_cfg)
+    return pdfpop.artifact.save(form_cfg, artifact)
+
+
+def _output(template, incremental=False):
+    """Return the bytes of a template populated with the test row."""
+    output = io.BytesIO()
+    if incremental:
+        populated = template.update(ROW, appearances=True)
+    else:
+        populated = template.populate(ROW, appearances=True)
+    pdfpop.pdf.write_form(template, populated, output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_artifact_round_trip(form_cfg, incremental):
+    """Test that a loaded template populates exactly like a parsed one."""
+    path = _compile(form_cfg)
+    assert path == form_cfg.path.with_suffix(".pdfpopc")
+    artifact = pdfpop.artifact.load(form_cfg)
+    form_path = pathlib.Path(form_cfg.data["io"]["form"]).resolve()
+    (template,) = artifact.templates.values()
+    assert list(artifact.templates) == [form_path]
+    assert template.fields == pdfpop.pdf.FormTemplate(form_path).fields
+    assert _output(template, incremental) == _output(
+        pdfpop.pdf.FormTemplate(form_path), incremental
+    )
+    compiled = pdfpop.form_config.CompiledConfig(
+        form_cfg, ["Name"], artifact.expressions
+    )
+    assert compiled.fields.evaluate({"Name": "Ada"}) == {"name": "ADA"}
+    assert compiled.columns == frozenset(["Name"])
+
+
+def test_artifact_mapped_form_not_parsed(form_cfg, monkeypatch):
+    """Test that loading a mapped template only reads its form again."""
+    _compile(form_cfg)
+
+    def parse(*args):
+        raise AssertionError("The form was parsed again.")
+
+    reader = pdfpop.reader.MappedReader
+    monkeypatch.setattr(reader, "_read_cross_references", parse)
+    monkeypatch.setattr(pdfpop.pdf, "_find_mutable_objects", parse)
+    monkeypatch.setattr(pdfpop.pdf.FormTemplate, "source", property(parse))
+    (template,) = pdfpop.artifact.load(form_cfg).templates.values()
+    monkeypatch.undo()
+    assert template.mapped
+    contents = dict.get(template._reader.pages[0], "/Contents")
+    assert template._reader.loaded(contents) is None
+    parsed = pdfpop.pdf.FormTemplate(template.path)
+    assert b"".join(
+        pdfpop.pdf.render_form(template, template.fill(ROW, flatten=True))
+    ) == b"".join(
+        pdfpop.pdf.render_form(parsed, parsed.fill(ROW, flatten=True))
+    )
+
+
+def test_artifact_ignored_when_config_changes(form_cfg, caplog):
+    """Test that an artifact of another configuration is not loaded."""
+    _compile(form_cfg)
+    form_cfg.data["fields"]["name [text]"] = "Name"
+    form_cfg.save()
+    assert pdfpop.artifact.load(form_cfg) is None
+    assert "out of date with the configuration" in caplog.text
+
+
+def test_artifact_ignores_changed_forms(form_cfg, caplog):
+    """Test that the template of a form that changed is not loaded."""
+    _compile(form_cfg)
+    form_path = pathlib.Path(form_cfg.data["io"]["form"])
+    form_path.write_bytes(form_path.read_bytes() + b"\n")
+    artifact = pdfpop.artifact.load(form_cfg)
+    assert artifact.templates == {}
+    assert artifact.expressions
+    assert "out of date with the form" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "content", [b"", b"not an artifact", pdfpop.artifact.MAGIC + b"\x80"]
+)
+def test_artifact_ignored_when_unreadable(form_cfg, caplog, content):
+    """Test that an unreadable artifact is ignored with a warning."""
+    pdfpop.artifact.get_path(form_cfg.path).write_bytes(content)
+    assert pdfpop.artifact.load(form_cfg) is None
+    assert "cannot be read" in caplog.text
+
+
+def test_artifact_ignored_for_other_versions(form_cfg, caplog, monkeypatch):
+    """Test that an artifact of another format version is not loaded."""
+    _compile(form_cfg)
+    monkeypatch.setattr(pdfpop.artifact, "FORMAT_VERSION", 0)
+    assert pdfpop.artifact.load(form_cfg) is None
+    assert "compiled by another version" in caplog.text
+
+
+def test_artifact_ignored_for_other_pdfpop_versions(
+    form_cfg, caplog, monkeypatch
+):
+    """Test that an artifact compiled by another pdfpop is not loaded."""
+    _compile(form_cfg)
+    monkeypatch.setattr(pdfpop, "__version__", "0.0.0")
+    assert pdfpop.artifact.load(form_cfg) is None
+    assert "compiled by another version" in caplog.text
+
+
+def test_artifact_ignored_when_stale(form_cfg, caplog, monkeypatch):
+    """Test that templates pickled without current state are not loaded."""
+    getstate = pdfpop.pdf.FormTemplate.__getstate__
+
+    def stale_state(template):
+        state = getstate(template)
+        del state["_mapped"]
+        return state
+
+    monkeypatch.setattr(pdfpop.pdf.FormTemplate, "__getstate__", stale_state)
+    _compile(form_cfg)
+    monkeypatch.undo()
+    assert pdfpop.artifact.load(form_cfg) is None
+    assert "cannot be read (AttributeError" in caplog.text
+
+
+def test_artifact_row_dependent_form(form_cfg):
+    """Test that only mappings are compiled if the form depends on rows."""
+    form_cfg.data["io"]["form"] = "data['Form']"
+    form_cfg.save()
+    _compile(form_cfg)
+    artifact = pdfpop.artifact.load(form_cfg)
+    assert artifact.templates == {}
+    assert "data['Form']" in artifact.expressions
+
+
+@pytest.mark.parametrize("form", ["Form", "data.get('Form')"])
+def test_artifact_form_from_column(form_cfg, form):
+    """Test that only mappings are compiled if the form is a data column."""
+    form_cfg.data["io"]["form"] = form
+    form_cfg.save()
+    _compile(form_cfg)
+    artifact = pdfpop.artifact.load(form_cfg)
+    assert artifact.templates == {}
+    assert artifact.expressions
+
+
+def test_artifact_missing_form(form_cfg):
+    """Test that compiling a configuration of a missing form fails."""
+    form_cfg.data["io"]["form"] = "'missing.pdf'"
+    with pytest.raises(FileNotFoundError):
+        pdfpop.artifact.compile_config(form_cfg)
+
+
+def test_artifact_long_object_chains(form_cfg):
+    """Test that long chains of objects are saved without deep recursion."""
+    artifact = pdfpop.artifact.compile_config(form_cfg)
+    (form_path,) = artifact.templates
+    template = pdfpop.pdf.FormTemplate(form_path, mapped=False)
+    artifact.templates[form_path] = template
+    link = None
+    for number in range(5000):
+        link = pdfrw.PdfDict(Number=number, Next=link)
+    template._reader.Root.Chain = link
+    pdfpop.artifact.save(form_cfg, artifact)
+    (loaded,) = pdfpop.artifact.load(form_cfg).templates.values()
+    link = loaded._reader.Root.Chain
+    length = 0
+    while link is not None:
+        length += 1
+        link = link.Next
+    assert length == 5000
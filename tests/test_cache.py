@@ -0,0 +1,72 @@
+"""Collection of tests for pdfpop's template cache."""
+import os
+import pathlib
+
+import pytest
+
+import pdfpop.cache
+import pdfpop.pdf
+
+
+FORM_PATH = pathlib.Path("examples/example-form.pdf")
+
+
+@pytest.fixture
+def forms(tmp_path):
+    """Fixture that returns the paths of three copies of the example form."""
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.pdf"
+        path.write_bytes(FORM_PATH.read_bytes())
+        paths.append(path)
+    return paths
+
+
+def test_template_cache_hits(forms):
+    """Test that each form is parsed once and counted as hits afterwards."""
+    cache = pdfpop.cache.TemplateCache()
+    first = cache.get(forms[0])
+    assert cache.get(forms[0]) is first
+    assert cache.get(forms[0].parent / ".." / forms[0].parent.name / "a.pdf")
+    cache.get(forms[1])
+    assert len(cache) == 2
+    assert cache.drain_stats() == {"hits": 2, "misses": 2, "evictions": 0}
+    assert cache.drain_stats() == {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def test_template_cache_evicts_least_recently_used(forms):
+    """Test that the least recently used template is evicted first."""
+    cache = pdfpop.cache.TemplateCache(max_templates=2)
+    a = cache.get(forms[0])
+    cache.get(forms[1])
+    cache.get(forms[0])
+    cache.get(forms[2])
+    assert len(cache) == 2
+    assert cache.get(forms[0]) is a
+    assert cache.drain_stats()["evictions"] == 1
+    cache.get(forms[1])
+    assert cache.drain_stats()["misses"] == 1
+
+
+def test_template_cache_memory_limit(forms):
+    """Test that templates are evicted to respect the memory limit."""
+    size = pdfpop.pdf.FormTemplate(forms[0]).memory_size
+    cache = pdfpop.cache.TemplateCache(max_bytes=2 * size)
+    for path in forms:
+        cache.get(path)
+    assert len(cache) == 2
+    assert cache.bytes == 2 * size
+    cache = pdfpop.cache.TemplateCache(max_bytes=1)
+    cache.get(forms[0])
+    assert len(cache) == 1
+
+
+def test_template_cache_reloads_modified_forms(forms):
+    """Test that a form is parsed again when its file changes."""
+    cache = pdfpop.cache.TemplateCache()
+    first = cache.get(forms[0])
+    stat = forms[0].stat()
+    os.utime(forms[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(forms[0]) is not first
+    assert len(cache) == 1
+    assert cache.drain_stats()["misses"] == 2
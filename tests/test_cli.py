@@ -7,6 +7,9 @@ import pytest
 from pytest_mock import mocker
 
 import pdfpop.__main__
+import pdfpop.cache
+import pdfpop.commands
+import pdfpop.pipeline
 
 
 @pytest.fixture(scope="session")
@@ -95,6 +98,17 @@ def test_cli_config_form_path_not_found(mocker, cli_runner):
     mock_command.assert_not_called()
 
 
+def test_cli_compile(mocker, cli_runner):
+    """Test CLI invocation of the `compile` command."""
+    mock_command = mocker.patch("pdfpop.commands.compile_config")
+
+    config_path = pathlib.Path("tests/data/pdfpop-blank.json")
+    result = cli_runner("compile", str(config_path))
+
+    assert result.exit_code == 0
+    mock_command.assert_called_once_with(config_path=config_path)
+
+
 def test_cli_run(mocker, cli_runner):
     """Test CLI invocation of the `run` command."""
     mock_command = mocker.patch("pdfpop.commands.run")
@@ -105,7 +119,45 @@ def test_cli_run(mocker, cli_runner):
 
     assert result.exit_code == 0
     mock_command.assert_called_once_with(
-        config_path=config_path, data_path=data_path
+        config_path=config_path,
+        data_path=data_path,
+        jobs=None,
+        all_columns=False,
+        options=pdfpop.commands.OutputOptions(),
+        merge=None,
+        max_templates=pdfpop.cache.DEFAULT_MAX_TEMPLATES,
+        max_template_bytes=pdfpop.cache.DEFAULT_MAX_BYTES,
+        io_threads=pdfpop.pipeline.IO_THREADS,
+        shard=None,
+        status_path=None,
+        metrics_path=None,
+        profile_path=None,
+    )
+
+
+def test_cli_run_jobs(mocker, cli_runner):
+    """Test `run` command invocation with a number of jobs."""
+    mock_command = mocker.patch("pdfpop.commands.run")
+
+    config_path = pathlib.Path("tests/data/pdfpop-blank.json")
+    data_path = pathlib.Path("tests/data/empty.csv")
+    result = cli_runner("run", str(config_path), str(data_path), "-j", "4")
+
+    assert result.exit_code == 0
+    mock_command.assert_called_once_with(
+        config_path=config_path,
+        data_path=data_path,
+        jobs=4,
+        all_columns=False,
+        options=pdfpop.commands.OutputOptions(),
+        merge=None,
+        max_templates=pdfpop.cache.DEFAULT_MAX_TEMPLATES,
+        max_template_bytes=pdfpop.cache.DEFAULT_MAX_BYTES,
+        io_threads=pdfpop.pipeline.IO_THREADS,
+        shard=None,
+        status_path=None,
+        metrics_path=None,
+        profile_path=None,
     )
 
 
@@ -133,3 +185,102 @@ def test_cli_run_data_path_not_found(mocker, cli_runner):
     assert result.exit_code == 2
     assert "Error: Invalid value for 'DATA':" in result.output
     mock_command.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "args, verbosity", [([], 0), (["-v"], 1), (["-qq"], -2), (["-v", "-q"], 0)]
+)
+def test_cli_run_verbosity(mocker, cli_runner, args, verbosity):
+    """Test that `-v` and `-q` set the logging verbosity of `run`."""
+    mocker.patch("pdfpop.commands.run")
+    configured = mocker.patch("pdfpop.log.configured")
+
+    config_path = pathlib.Path("tests/data/pdfpop-blank.json")
+    data_path = pathlib.Path("tests/data/empty.csv")
+    result = cli_runner("run", *args, str(config_path), str(data_path))
+
+    assert result.exit_code == 0
+    configured.assert_called_once_with(verbosity)
+
+
+def test_cli_run_shard(mocker, cli_runner):
+    """Test that `--shard` and `--shard-key` are passed as a shard."""
+    import pdfpop.shard
+
+    mock_command = mocker.patch("pdfpop.commands.run")
+
+    config_path = pathlib.Path("tests/data/pdfpop-blank.json")
+    data_path = pathlib.Path("tests/data/empty.csv")
+    result = cli_runner(
+        "run",
+        str(config_path),
+        str(data_path),
+        "--shard",
+        "2/3",
+        "--shard-key",
+        "Name",
+    )
+
+    assert result.exit_code == 0
+    kwargs = mock_command.call_args.kwargs
+    assert kwargs["shard"] == pdfpop.shard.Shard(2, 3, "Name")
+    assert kwargs["status_path"] is None
+
+
+@pytest.mark.parametrize(
+    "args, message",
+    [
+        (["--shard", "4/3"], "Invalid value for '--shard'"),
+        (["--shard", "x"], "Invalid value for '--shard'"),
+        (["--shard-key", "Name"], "--shard-key requires --shard"),
+    ],
+)
+def test_cli_run_invalid_shard(mocker, cli_runner, args, message):
+    """Test that invalid shards are rejected."""
+    mock_command = mocker.patch("pdfpop.commands.run")
+
+    config_path = pathlib.Path("tests/data/pdfpop-blank.json")
+    data_path = pathlib.Path("tests/data/empty.csv")
+    result = cli_runner("run", str(config_path), str(data_path), *args)
+
+    assert result.exit_code == 2
+    assert message in result.output
+    mock_command.assert_not_called()
+
+
+def test_cli_merge_manifests(mocker, cli_runner, tmp_path):
+    """Test that `merge-manifests` passes the status manifests."""
+    mock_command = mocker.patch("pdfpop.commands.merge_manifests")
+
+    status_paths = [tmp_path / "1.jsonl", tmp_path / "2.jsonl"]
+    for status_path in status_paths:
+        status_path.touch()
+    result = cli_runner(
+        "merge-manifests", *map(str, status_paths), "-o", "all.jsonl"
+    )
+
+    assert result.exit_code == 0
+    mock_command.assert_called_once_with(
+        status_paths=tuple(status_paths),
+        output_path=pathlib.Path("all.jsonl"),
+    )
+
+
+def test_cli_serve(mocker, cli_runner):
+    """Test that the `serve` command passes its options to the command."""
+    mock_command = mocker.patch("pdfpop.commands.serve")
+
+    config_path = pathlib.Path("tests/data/pdfpop-blank.json")
+    result = cli_runner(
+        "serve", str(config_path), "--port", "9000", "--workers", "2"
+    )
+
+    assert result.exit_code == 0
+    mock_command.assert_called_once_with(
+        (config_path,),
+        host="127.0.0.1",
+        port=9000,
+        socket_path=None,
+        workers=2,
+        queue_limit=64,
+    )
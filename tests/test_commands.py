@@ -1,10 +1,16 @@
 """Collection of tests for pdfpop's commands module."""
+import contextlib
+import json
+import logging
 import pathlib
 
+import pdfrw
 import pytest
 
 import pdfpop.commands
 import pdfpop.form_config
+import pdfpop.manifest
+import pdfpop.shard
 
 
 def test_config_command_form_path_not_found(tmp_path):
@@ -23,3 +29,525 @@ def test_config_command_config_path_exists(tmp_path):
             pdfpop.commands.config(form_path)
     finally:
         form_cfg_path.unlink()
+
+
+@pytest.fixture
+def run_config(tmp_path):
+    """Fixture that returns a configuration for the example form."""
+    form_cfg = pdfpop.form_config.FormConfig(tmp_path / "config.json")
+    form_cfg.data["io"]["form"] = "'examples/example-form.pdf'"
+    form_cfg.data["io"]["output_dir"] = repr(str(tmp_path))
+    form_cfg.data["io"]["output_name"] = "data['Last Name'] + '.pdf'"
+    form_cfg.data["fields"] = {
+        "name [text]": "data['First Name']",
+        "signature [text]": None,
+    }
+    form_cfg.save()
+    return form_cfg
+
+
+def test_run_command_populates_fields(tmp_path, run_config):
+    """Test that configured fields are populated in the output form."""
+    pdfpop.commands.run(
+        run_config.path, pathlib.Path("examples/example-data.xlsx"), jobs=1
+    )
+    form = pdfrw.PdfReader(tmp_path / "Smith.pdf")
+    values = {
+        annotation["/T"]: annotation["/V"]
+        for annotation in form.pages[0].Annots
+        if annotation["/T"]
+    }
+    assert values["(name)"].to_unicode() == "John"
+    assert (tmp_path / "Doe.pdf").exists()
+
+
+@pytest.mark.parametrize("level", [logging.INFO, logging.DEBUG])
+def test_run_command_parallel_matches_serial(
+    tmp_path, run_config, caplog, level
+):
+    """Test that a parallel run produces the same status and outputs."""
+    caplog.set_level(level, logger="pdfpop")
+    data_path = pathlib.Path("examples/example-data.xlsx")
+    pdfpop.commands.run(run_config.path, data_path, jobs=1)
+    serial_output = caplog.record_tuples
+    assert serial_output
+    caplog.clear()
+    serial_pdf = (tmp_path / "Smith.pdf").read_bytes()
+    pdfpop.commands.run(run_config.path, data_path, jobs=2)
+    assert caplog.record_tuples == serial_output
+    assert (tmp_path / "Smith.pdf").read_bytes() == serial_pdf
+
+
+@pytest.mark.parametrize("level", [logging.INFO, logging.DEBUG])
+def test_run_command_pipelined_matches_serial(
+    tmp_path, run_config, caplog, level
+):
+    """Test that writing outputs in threads keeps the status in row order."""
+    caplog.set_level(level, logger="pdfpop")
+    data_path = pathlib.Path("examples/example-data.xlsx")
+    pdfpop.commands.run(run_config.path, data_path, jobs=1, io_threads=0)
+    serial_output = caplog.record_tuples
+    caplog.clear()
+    serial_pdf = (tmp_path / "Smith.pdf").read_bytes()
+    pdfpop.commands.run(run_config.path, data_path, jobs=1, io_threads=2)
+    assert caplog.record_tuples == serial_output
+    assert (tmp_path / "Smith.pdf").read_bytes() == serial_pdf
+
+
+def test_run_command_pipelined_same_output(tmp_path, run_config):
+    """Test that rows with the same output path are written in row order."""
+    run_config.data["io"]["output_name"] = "'out.pdf'"
+    run_config.save()
+    data_path = tmp_path / "data.csv"
+    data_path.write_text(
+        "First Name,Last Name\n"
+        + "".join(f"{idx},Name\n" for idx in range(100))
+    )
+    pdfpop.commands.run(run_config.path, data_path, jobs=1, io_threads=4)
+    form = pdfrw.PdfReader(tmp_path / "out.pdf")
+    values = {
+        annotation["/T"]: annotation["/V"]
+        for annotation in form.pages[0].Annots
+        if annotation["/T"]
+    }
+    assert values["(name)"].to_unicode() == "99"
+
+
+@pytest.mark.parametrize("io_threads", [0, 2])
+def test_run_command_reports_failed_writes(
+    tmp_path, run_config, caplog, io_threads
+):
+    """Test that outputs that cannot be written are reported as failed."""
+    run_config.data["io"]["output_dir"] = repr(str(tmp_path / "missing"))
+    run_config.save()
+    with pytest.raises(RuntimeError, match="2 of 2 rows: 1, 2"):
+        pdfpop.commands.run(
+            run_config.path,
+            pathlib.Path("examples/example-data.xlsx"),
+            jobs=1,
+            io_threads=io_threads,
+        )
+    assert "Failed to populate row 2: FileNotFoundError" in caplog.text
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_command_reports_failed_rows(tmp_path, run_config, caplog, jobs):
+    """Test that a failing row is reported without stopping other rows."""
+    run_config.data["io"]["output_name"] = "data['First Name'] + '.pdf'"
+    satisfied = "'Maybe' if data['Last Name'] == 'Smith' else 'Yes'"
+    run_config.data["fields"]["satisfied [combo]"] = satisfied
+    run_config.save()
+    with pytest.raises(RuntimeError, match="1 of 2 rows: 1"):
+        pdfpop.commands.run(
+            run_config.path,
+            pathlib.Path("examples/example-data.xlsx"),
+            jobs=jobs,
+        )
+    assert "Failed to populate row 1: KeyError" in caplog.text
+    assert not (tmp_path / "John.pdf").exists()
+    assert (tmp_path / "Jane.pdf").exists()
+
+
+def test_run_command_csv_data(tmp_path, run_config):
+    """Test that rows are populated from a CSV data file."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("First Name,Last Name\nAda,Lovelace\n")
+    pdfpop.commands.run(run_config.path, data_path, jobs=1)
+    assert (tmp_path / "Lovelace.pdf").exists()
+
+
+def test_run_command_resume(tmp_path, run_config, caplog):
+    """Test that a resumed run only populates new or changed rows."""
+    caplog.set_level(logging.INFO, logger="pdfpop")
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("First Name,Last Name\nAda,Lovelace\nAlan,Turing\n")
+    pdfpop.commands.run(run_config.path, data_path, jobs=1)
+    assert (tmp_path / pdfpop.manifest.MANIFEST_NAME).exists()
+    caplog.clear()
+
+    data_path.write_text("First Name,Last Name\nAda,Lovelace\nAl,Turing\n")
+    pdfpop.commands.run(
+        run_config.path,
+        data_path,
+        jobs=1,
+        options=pdfpop.commands.OutputOptions(resume=True),
+    )
+    assert "Skipping row 1" in caplog.text
+    assert (
+        'Populating form "examples/example-form.pdf" for row 2.' in caplog.text
+    )
+    caplog.clear()
+
+    (tmp_path / "Lovelace.pdf").unlink()
+    pdfpop.commands.run(
+        run_config.path,
+        data_path,
+        jobs=2,
+        options=pdfpop.commands.OutputOptions(resume=True),
+    )
+    assert "Skipping row 2" in caplog.text
+    assert (tmp_path / "Lovelace.pdf").exists()
+    manifest_path = tmp_path / pdfpop.manifest.MANIFEST_NAME
+    assert len(manifest_path.read_text().splitlines()) == 2
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_command_resume_with_other_options(tmp_path, run_config, jobs):
+    """Test that a resumed run populates rows again if the options change."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("First Name,Last Name\nAda,Lovelace\n")
+    pdfpop.commands.run(run_config.path, data_path, jobs=jobs)
+    options = pdfpop.commands.OutputOptions(resume=True, flatten=True)
+    pdfpop.commands.run(run_config.path, data_path, jobs=jobs, options=options)
+    form = pdfrw.PdfReader(tmp_path / "Lovelace.pdf")
+    assert form.Root.AcroForm is None
+    mtime = (tmp_path / "Lovelace.pdf").stat().st_mtime_ns
+    pdfpop.commands.run(run_config.path, data_path, jobs=jobs, options=options)
+    assert (tmp_path / "Lovelace.pdf").stat().st_mtime_ns == mtime
+
+
+def test_run_command_merge(tmp_path, run_config, caplog):
+    """Test that every row is merged into a single output."""
+    caplog.set_level(logging.INFO, logger="pdfpop")
+    merge_path = tmp_path / "merged.pdf"
+    pdfpop.commands.run(
+        run_config.path,
+        pathlib.Path("examples/example-data.xlsx"),
+        merge=merge_path,
+    )
+    assert "Populated form added to" in caplog.text
+    merged = pdfrw.PdfReader(merge_path)
+    assert len(merged.Root.AcroForm.Fields) == 2
+    assert not (tmp_path / "Smith.pdf").exists()
+    assert not (tmp_path / pdfpop.manifest.MANIFEST_NAME).exists()
+
+
+def test_run_command_merge_resume(tmp_path, run_config):
+    """Test that merged output cannot be resumed."""
+    with pytest.raises(RuntimeError, match="cannot be resumed"):
+        pdfpop.commands.run(
+            run_config.path,
+            pathlib.Path("examples/example-data.xlsx"),
+            options=pdfpop.commands.OutputOptions(resume=True),
+            merge=tmp_path / "merged.pdf",
+        )
+
+
+def test_run_command_incremental(tmp_path, run_config):
+    """Test that outputs can be saved as incremental updates."""
+    pdfpop.commands.run(
+        run_config.path,
+        pathlib.Path("examples/example-data.xlsx"),
+        jobs=1,
+        options=pdfpop.commands.OutputOptions(incremental=True),
+    )
+    form_bytes = pathlib.Path("examples/example-form.pdf").read_bytes()
+    assert (tmp_path / "Smith.pdf").read_bytes().startswith(form_bytes)
+    form = pdfrw.PdfReader(tmp_path / "Smith.pdf")
+    values = {
+        annotation.T.to_unicode(): annotation.V
+        for annotation in form.pages[0].Annots
+        if annotation.T
+    }
+    assert values["name"].to_unicode() == "John"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_command_flatten(tmp_path, run_config, jobs):
+    """Test that outputs can be flattened in this and worker processes."""
+    pdfpop.commands.run(
+        run_config.path,
+        pathlib.Path("examples/example-data.xlsx"),
+        jobs=jobs,
+        options=pdfpop.commands.OutputOptions(flatten=True),
+    )
+    form = pdfrw.PdfReader(tmp_path / "Smith.pdf")
+    assert form.Root.AcroForm is None
+    assert form.pages[0].Annots is None
+    xobjects = form.pages[0].Resources.XObject.values()
+    assert any("(John) Tj" in (xobject.stream or "") for xobject in xobjects)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_command_metrics(tmp_path, run_config, jobs):
+    """Test that stage and row metrics are saved."""
+    metrics_path = tmp_path / "metrics.json"
+    pdfpop.commands.run(
+        run_config.path,
+        pathlib.Path("examples/example-data.xlsx"),
+        jobs=jobs,
+        metrics_path=metrics_path,
+    )
+    metrics = json.loads(metrics_path.read_text())
+    assert metrics["rows"]["count"] == 2
+    assert metrics["fields"]["set"] == 2
+    assert metrics["fields"]["ignored"] == 2
+    assert {"load", "compile", "parse", "fill", "write"} <= set(
+        metrics["stages"]
+    )
+    assert metrics["stages"]["write"]["calls"] == 2
+    assert len(metrics["slowest_rows"]) == 2
+
+
+def test_compile_command_config_path_not_found(tmp_path):
+    """Test that an error is raised if the config path is not found."""
+    with pytest.raises(FileNotFoundError):
+        pdfpop.commands.compile_config(tmp_path / "not_found.json")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_command_compiled(tmp_path, run_config, caplog, jobs):
+    """Test that a compiled configuration is used instead of parsing."""
+    caplog.set_level(logging.INFO, logger="pdfpop")
+    data_path = pathlib.Path("examples/example-data.xlsx")
+    pdfpop.commands.run(run_config.path, data_path, jobs=jobs)
+    expected = (tmp_path / "Smith.pdf").read_bytes()
+    pdfpop.commands.compile_config(run_config.path)
+    assert 'Compiled form configuration saved to "' in caplog.text
+    metrics_path = tmp_path / "metrics.json"
+    pdfpop.commands.run(
+        run_config.path, data_path, jobs=jobs, metrics_path=metrics_path
+    )
+    assert (tmp_path / "Smith.pdf").read_bytes() == expected
+    metrics = json.loads(metrics_path.read_text())
+    assert "parse" not in metrics["stages"]
+    assert metrics["caches"]["templates"]["misses"] == 0
+
+
+@pytest.mark.parametrize(
+    "max_templates, expected",
+    [
+        (32, {"hits": 4, "misses": 2, "evictions": 0}),
+        (1, {"hits": 0, "misses": 6, "evictions": 5}),
+    ],
+)
+def test_run_command_template_cache(tmp_path, max_templates, expected):
+    """Test that rows selecting different forms share parsed templates."""
+    form_path = pathlib.Path("examples/example-form.pdf")
+    (tmp_path / "b.pdf").write_bytes(form_path.read_bytes())
+    form_cfg = pdfpop.form_config.FormConfig(tmp_path / "config.json")
+    form_cfg.data["io"]["form"] = (
+        f"{str(form_path)!r} if data['Form'] == 'a' "
+        f"else {str(tmp_path / 'b.pdf')!r}"
+    )
+    form_cfg.data["io"]["output_dir"] = repr(str(tmp_path))
+    form_cfg.data["io"]["output_name"] = "data['Name'] + '.pdf'"
+    form_cfg.data["fields"] = {"name [text]": "Name"}
+    form_cfg.save()
+    data_path = tmp_path / "data.csv"
+    data_path.write_text(
+        "Name,Form\n" + "".join(f"{idx},{'ab'[idx % 2]}\n" for idx in range(6))
+    )
+    metrics_path = tmp_path / "metrics.json"
+    pdfpop.commands.run(
+        form_cfg.path,
+        data_path,
+        jobs=1,
+        max_templates=max_templates,
+        metrics_path=metrics_path,
+    )
+    metrics = json.loads(metrics_path.read_text())
+    assert metrics["caches"]["templates"] == expected
+    assert metrics["stages"]["parse"]["calls"] == expected["misses"]
+
+
+def test_run_command_template_cache_workers(tmp_path, run_config):
+    """Test that the template cache statistics of workers are merged."""
+    metrics_path = tmp_path / "metrics.json"
+    pdfpop.commands.run(
+        run_config.path,
+        pathlib.Path("examples/example-data.xlsx"),
+        jobs=2,
+        metrics_path=metrics_path,
+    )
+    stats = json.loads(metrics_path.read_text())["caches"]["templates"]
+    assert stats["hits"] + stats["misses"] == 2
+    assert 1 <= stats["misses"] <= 2
+
+
+def test_run_command_summary(tmp_path, run_config, caplog):
+    """Test that a single line is logged for each row in summary mode."""
+    caplog.set_level(logging.INFO, logger="pdfpop")
+    pdfpop.commands.run(
+        run_config.path,
+        pathlib.Path("examples/example-data.xlsx"),
+        jobs=1,
+        options=pdfpop.commands.OutputOptions(summary=True),
+    )
+    assert caplog.messages == [
+        f'Row 1: set 1 and ignored 1 fields in "{tmp_path / "Smith.pdf"}".',
+        f'Row 2: set 1 and ignored 1 fields in "{tmp_path / "Doe.pdf"}".',
+    ]
+
+
+@pytest.fixture
+def dedup_config(tmp_path):
+    """Fixture that returns a configuration with outputs named by row."""
+    form_cfg = pdfpop.form_config.FormConfig(tmp_path / "config.json")
+    form_cfg.data["io"]["form"] = "'examples/example-form.pdf'"
+    form_cfg.data["io"]["output_dir"] = repr(str(tmp_path))
+    form_cfg.data["io"]["output_name"] = "data['Output'] + '.pdf'"
+    form_cfg.data["fields"] = {"name [text]": "Name"}
+    form_cfg.save()
+    return form_cfg
+
+
+@pytest.mark.parametrize("jobs, io_threads", [(1, 0), (1, 2), (2, 4)])
+def test_run_command_dedup(tmp_path, dedup_config, caplog, jobs, io_threads):
+    """Test that rows with identical fields reuse the earlier outputs."""
+    caplog.set_level(logging.INFO, logger="pdfpop")
+    data_path = tmp_path / "data.csv"
+    data_path.write_text(
+        "Name,Output\n" + "".join(f"{'ab'[i % 2]},{i}\n" for i in range(6))
+    )
+    metrics_path = tmp_path / "metrics.json"
+    pdfpop.commands.run(
+        dedup_config.path,
+        data_path,
+        jobs=jobs,
+        options=pdfpop.commands.OutputOptions(dedup="hardlink"),
+        io_threads=io_threads,
+        metrics_path=metrics_path,
+    )
+    outputs = [(tmp_path / f"{idx}.pdf").read_bytes() for idx in range(6)]
+    assert outputs[0] != outputs[1]
+    assert outputs[::2] == [outputs[0]] * 3
+    assert outputs[1::2] == [outputs[1]] * 3
+    stats = json.loads(metrics_path.read_text())["caches"]["outputs"]
+    assert stats == {"hits": 4, "misses": 2}
+    assert (tmp_path / "2.pdf").samefile(tmp_path / "0.pdf")
+    assert (
+        "Reused identical outputs for 4 of 6 populated rows (66.7%)."
+        in caplog.messages
+    )
+    assert 'Identical populated form reused for "' in caplog.text
+
+
+def test_dispatcher_holds_identical_rows(tmp_path, dedup_config):
+    """Test that identical rows wait for the first of them to be written."""
+    compiled = pdfpop.form_config.CompiledConfig(
+        dedup_config, ["Name", "Output"]
+    )
+    runner = pdfpop.commands._RowRunner(
+        compiled,
+        dedup_config.digest,
+        pdfpop.commands.OutputOptions(dedup="hardlink"),
+    )
+    rows = [{"Name": "a", "Output": str(idx)} for idx in range(3)]
+    dispatcher = pdfpop.commands._Dispatcher(enumerate(rows), runner, 16)
+
+    def submitted():
+        return [(idx, source) for idx, _, _, source in dispatcher.chunk(16)]
+
+    assert submitted() == [(0, None)]
+    dispatcher.finish(0, False)
+    assert submitted() == [(1, None)]
+    dispatcher.finish(1, True)
+    assert submitted() == [(2, tmp_path / "1.pdf")]
+    assert submitted() == []
+
+
+@pytest.mark.parametrize("io_threads", [0, 2])
+def test_run_command_dedup_overwritten_source(
+    tmp_path, dedup_config, io_threads
+):
+    """Test that overwriting a reused output leaves its links intact."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("Name,Output\na,x\na,y\nb,x\na,z\n")
+    pdfpop.commands.run(
+        dedup_config.path,
+        data_path,
+        jobs=1,
+        options=pdfpop.commands.OutputOptions(dedup="hardlink"),
+        io_threads=io_threads,
+    )
+
+    def name(output):
+        form = pdfrw.PdfReader(tmp_path / f"{output}.pdf")
+        for annotation in form.pages[0].Annots:
+            if annotation.T and annotation.T.to_unicode() == "name":
+                return annotation.V.to_unicode()
+
+    assert [name(output) for output in "xyz"] == ["b", "a", "a"]
+    assert not (tmp_path / "x.pdf").samefile(tmp_path / "y.pdf")
+
+
+def test_run_command_merge_dedup(tmp_path, run_config):
+    """Test that merged output cannot be de-duplicated."""
+    with pytest.raises(RuntimeError, match="cannot be de-duplicated"):
+        pdfpop.commands.run(
+            run_config.path,
+            pathlib.Path("examples/example-data.xlsx"),
+            options=pdfpop.commands.OutputOptions(dedup="copy"),
+            merge=tmp_path / "merged.pdf",
+        )
+
+
+@pytest.mark.parametrize("key, jobs", [(None, 1), ("Group", 1), (None, 2)])
+def test_run_command_shards(tmp_path, dedup_config, caplog, key, jobs):
+    """Test that the shards of a run populate every row exactly once."""
+    caplog.set_level(logging.INFO, logger="pdfpop")
+    data_path = tmp_path / "data.csv"
+    data_path.write_text(
+        "Name,Output,Group\n"
+        + "".join(f"{idx},{idx},{idx % 4}\n" for idx in range(10))
+    )
+    status_paths = []
+    for index in (1, 2, 3):
+        status_paths.append(tmp_path / f"status-{index}.jsonl")
+        pdfpop.commands.run(
+            dedup_config.path,
+            data_path,
+            jobs=jobs,
+            shard=pdfpop.shard.Shard(index, 3, key),
+            status_path=status_paths[-1],
+        )
+    combined_path = tmp_path / "combined.jsonl"
+    pdfpop.commands.merge_manifests(status_paths, combined_path)
+    entries = [json.loads(line) for line in combined_path.open()]
+    assert [entry["row"] for entry in entries] == list(range(1, 11))
+    assert {entry["status"] for entry in entries} == {"populated"}
+    assert all((tmp_path / f"{idx}.pdf").exists() for idx in range(10))
+    assert (
+        "Combined the status of 10 rows from 3 of 3 shards: 10 populated, "
+        "0 missing." in caplog.messages
+    )
+
+
+def test_run_command_shard_key_not_in_data(tmp_path, dedup_config):
+    """Test that an error is raised if the shard key column is missing."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("Name,Output\na,b\n")
+    with pytest.raises(RuntimeError, match='"Group" is not in the data'):
+        pdfpop.commands.run(
+            dedup_config.path,
+            data_path,
+            jobs=1,
+            shard=pdfpop.shard.Shard(1, 2, "Group"),
+            status_path=tmp_path / "status.jsonl",
+        )
+
+
+def test_merge_manifests_reports_missing_and_failed(tmp_path, dedup_config):
+    """Test that failed rows and rows of missing shards are reported."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text(
+        "Name,Output\n"
+        + "".join(f"{idx},{idx}\n" for idx in range(4))
+        + "4,missing/4\n5,5\n"
+    )
+    status_paths = [tmp_path / f"status-{index}.jsonl" for index in (1, 2)]
+    for index, status_path in enumerate(status_paths, 1):
+        with contextlib.suppress(RuntimeError):
+            pdfpop.commands.run(
+                dedup_config.path,
+                data_path,
+                jobs=1,
+                shard=pdfpop.shard.Shard(index, 3),
+                status_path=status_path,
+            )
+    with pytest.raises(RuntimeError) as excinfo:
+        pdfpop.commands.merge_manifests(status_paths)
+    assert str(excinfo.value) == (
+        "Incomplete run: missing shards 3; failed rows 5; missing rows 3, 6."
+    )
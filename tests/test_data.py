@@ -0,0 +1,210 @@
+"""Collection of tests for pdfpop's data file handling."""
+import io
+import pathlib
+import types
+
+import pandas as pd
+import pytest
+
+import pdfpop.data
+
+
+ROWS = [
+    {"First Name": "John", "Fees": "45.0", "Remarks": ""},
+    {"First Name": "Jane", "Fees": "34.99", "Remarks": "Too loud."},
+]
+
+
+def test_read_rows_not_found(tmp_path):
+    """Test that an error is raised if the data file is not found."""
+    with pytest.raises(FileNotFoundError):
+        pdfpop.data.read_rows(tmp_path / "not_found.csv")
+
+
+def test_read_rows_unsupported_type(tmp_path):
+    """Test that an error is raised for unsupported data file types."""
+    data_path = tmp_path / "data.txt"
+    data_path.touch()
+    with pytest.raises(RuntimeError, match="Unsupported data file type"):
+        pdfpop.data.read_rows(data_path)
+
+
+def test_read_rows_is_lazy(tmp_path):
+    """Test that rows are read lazily."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("First Name,Fees,Remarks\nJohn,45.0,\n")
+    assert isinstance(pdfpop.data.read_rows(data_path), types.GeneratorType)
+
+
+def test_read_rows_csv(tmp_path):
+    """Test that rows are read from a CSV file."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text(
+        "First Name,Fees,Remarks\nJohn,45.0,\nJane,34.99,Too loud.\n"
+    )
+    assert list(pdfpop.data.read_rows(data_path)) == ROWS
+
+
+def test_read_rows_empty_csv():
+    """Test that an empty CSV file has no rows."""
+    data_path = pathlib.Path("tests/data/empty.csv")
+    assert list(pdfpop.data.read_rows(data_path)) == []
+
+
+def test_read_rows_json_lines(tmp_path):
+    """Test that rows are read from a JSON Lines file."""
+    data_path = tmp_path / "data.jsonl"
+    data_path.write_text(
+        '{"First Name": "John", "Fees": 45.0, "Remarks": null}\n'
+        "\n"
+        '{"First Name": "Jane", "Fees": 34.99, "Remarks": "Too loud."}\n'
+    )
+    assert list(pdfpop.data.read_rows(data_path)) == ROWS
+
+
+def test_read_rows_parquet(tmp_path):
+    """Test that rows are read from a Parquet file."""
+    pytest.importorskip("pyarrow")
+    data_path = tmp_path / "data.parquet"
+    pd.DataFrame(
+        {
+            "First Name": ["John", "Jane"],
+            "Fees": [45.0, 34.99],
+            "Remarks": [None, "Too loud."],
+        }
+    ).to_parquet(data_path)
+    assert list(pdfpop.data.read_rows(data_path)) == ROWS
+
+
+def test_read_rows_excel():
+    """Test that rows are read from a Microsoft Excel file."""
+    data_path = pathlib.Path("examples/example-data.xlsx")
+    rows = list(pdfpop.data.read_rows(data_path))
+    assert [row["Last Name"] for row in rows] == ["Smith", "Doe"]
+    assert rows[0]["Remarks"] == ""
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "First Name,Fees,Remarks\nJohn,45.0,\nJane,34.99,Too loud.\n",
+        '{"First Name": "John", "Fees": 45.0, "Remarks": ""}\n'
+        '{"First Name": "Jane", "Fees": 34.99, "Remarks": "Too loud."}\n',
+    ],
+)
+def test_read_rows_stdin(monkeypatch, text):
+    """Test that CSV and JSON Lines rows are read from stdin."""
+    monkeypatch.setattr("sys.stdin", io.StringIO(text))
+    rows = pdfpop.data.read_rows(pdfpop.data.STDIN_PATH)
+    assert list(rows) == ROWS
+
+
+def test_read_rows_csv_select_columns(tmp_path):
+    """Test that only the selected CSV columns are read."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("First Name,Fees,Remarks\nJohn,45.0,\n")
+    headers = []
+
+    def select_columns(header):
+        headers.append(header)
+        return {"Remarks", "First Name", "Unknown"}
+
+    rows = list(pdfpop.data.read_rows(data_path, select_columns))
+    assert headers == [["First Name", "Fees", "Remarks"]]
+    assert rows == [{"First Name": "John", "Remarks": ""}]
+
+
+def test_read_rows_excel_select_columns():
+    """Test that only the selected Microsoft Excel columns are read."""
+    data_path = pathlib.Path("examples/example-data.xlsx")
+    rows = pdfpop.data.read_rows(data_path, lambda header: {"Fees"})
+    assert list(rows) == [{"Fees": "45"}, {"Fees": "34.99"}]
+
+
+def test_read_rows_select_all_columns():
+    """Test that every column is read when the selection is unknown."""
+    data_path = pathlib.Path("examples/example-data.xlsx")
+    rows = pdfpop.data.read_rows(data_path, lambda header: None)
+    assert len(next(rows)) == 12
+
+
+def _write_xlsx(path, rows):
+    """Write the rows to the first sheet of a Microsoft Excel workbook."""
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save(path)
+
+
+def test_read_rows_excel_numbers(tmp_path):
+    """Test that Microsoft Excel numbers are converted one by one."""
+    data_path = tmp_path / "data.xlsx"
+    _write_xlsx(data_path, [["Fees"], [45], [1.5], [None]])
+    rows = list(pdfpop.data.read_rows(data_path))
+    assert rows == [{"Fees": "45"}, {"Fees": "1.5"}]
+
+
+def test_read_rows_excel_duplicate_headers(tmp_path):
+    """Test that duplicate Microsoft Excel column names are made unique."""
+    data_path = tmp_path / "data.xlsx"
+    _write_xlsx(data_path, [["Name", "Name", None], ["John", "Jane", "x"]])
+    rows = pdfpop.data.read_rows(data_path, lambda header: {"Name.1"})
+    assert list(rows) == [{"Name.1": "Jane"}]
+    rows = pdfpop.data.read_rows(data_path)
+    assert list(rows) == [{"Name": "John", "Name.1": "Jane", "Unnamed: 2": "x"}]
+
+
+def test_read_rows_excel_blank_rows(tmp_path):
+    """Test that blank Microsoft Excel rows keep the index of later rows."""
+    data_path = tmp_path / "data.xlsx"
+    _write_xlsx(data_path, [["Name"], ["John"], [None], ["Jane"], [None]])
+    rows = list(pdfpop.data.read_rows(data_path))
+    assert rows == [{"Name": "John"}, {"Name": ""}, {"Name": "Jane"}]
+
+
+def test_read_rows_csv_duplicate_headers(tmp_path):
+    """Test that duplicate CSV column names are made unique."""
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("Name,Name,\nJohn,Jane,x\n")
+    assert list(pdfpop.data.read_rows(data_path)) == [
+        {"Name": "John", "Name.1": "Jane", "Unnamed: 2": "x"}
+    ]
+
+
+def _fake_read_excel(monkeypatch, frame):
+    """Make pandas read a legacy Microsoft Excel file as a data frame."""
+    calls = []
+
+    def read_excel(path, header, nrows=None, usecols=None, dtype=None):
+        calls.append(usecols)
+        if nrows == 0:
+            return frame.iloc[:0]
+        return frame if usecols is None else frame.iloc[:, usecols]
+
+    monkeypatch.setattr(pd, "read_excel", read_excel)
+    return calls
+
+
+def test_read_rows_xls_numeric_header(tmp_path, monkeypatch):
+    """Test that legacy Excel columns with numeric names are selected."""
+    data_path = tmp_path / "data.xls"
+    data_path.touch()
+    frame = pd.DataFrame(
+        {"Name": ["John", "Jane"], 2020: [45, None]}, dtype=object
+    )
+    calls = _fake_read_excel(monkeypatch, frame)
+    rows = pdfpop.data.read_rows(data_path, lambda header: {"2020"})
+    assert list(rows) == [{"2020": "45"}, {"2020": ""}]
+    assert calls[-1] == [1]
+
+
+def test_read_rows_xls_no_columns(tmp_path, monkeypatch):
+    """Test that legacy Excel rows are counted when no column is selected."""
+    data_path = tmp_path / "data.xls"
+    data_path.touch()
+    frame = pd.DataFrame({"Name": ["John", "Jane"]}, dtype=object)
+    calls = _fake_read_excel(monkeypatch, frame)
+    rows = pdfpop.data.read_rows(data_path, lambda header: set())
+    assert list(rows) == [{}, {}]
+    assert calls[-1] == [0]
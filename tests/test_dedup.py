@@ -0,0 +1,67 @@
+"""Collection of tests for pdfpop's dedup module."""
+import pytest
+
+import pdfpop.dedup
+
+
+def test_output_index(tmp_path):
+    """Test that outputs are found by key until they are overwritten."""
+    index = pdfpop.dedup.OutputIndex()
+    assert index.get("a") is None
+    index.add("a", tmp_path / "1.pdf")
+    index.add("a", tmp_path / "2.pdf")
+    assert index.get("a") == tmp_path / "1.pdf"
+    index.add("b", tmp_path / "1.pdf")
+    assert index.get("a") is None
+    assert index.get("b") == tmp_path / "1.pdf"
+    index.discard(tmp_path / "1.pdf")
+    assert index.get("b") is None
+    assert index.drain_stats() == {"hits": 2, "misses": 3}
+    assert index.drain_stats() == {"hits": 0, "misses": 0}
+
+
+def test_output_index_unknown_method():
+    """Test that an error is raised for an unknown method."""
+    with pytest.raises(RuntimeError, match="Unknown de-duplication method"):
+        pdfpop.dedup.OutputIndex("symlink")
+
+
+def test_make_key():
+    """Test that keys depend on the form, options and field values."""
+    key = pdfpop.dedup.make_key(
+        "form", {"flatten": False}, {"a": "1", "b": True}
+    )
+    assert key == pdfpop.dedup.make_key(
+        "form", {"flatten": False}, {"b": True, "a": "1"}
+    )
+    assert key != pdfpop.dedup.make_key("other", {"flatten": False}, {"a": "1"})
+    assert key != pdfpop.dedup.make_key(
+        "form", {"flatten": True}, {"a": "1", "b": True}
+    )
+    assert key != pdfpop.dedup.make_key(
+        "form", {"flatten": False}, {"a": "2", "b": True}
+    )
+
+
+@pytest.mark.parametrize("method", pdfpop.dedup.METHODS)
+def test_reuse(tmp_path, method):
+    """Test that each method replaces the target with the source content."""
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"source")
+    target = tmp_path / "target.pdf"
+    target.write_bytes(b"old target")
+    pdfpop.dedup.reuse(source, target, method)
+    assert target.read_bytes() == b"source"
+    assert target.samefile(source) == (method == pdfpop.dedup.HARDLINK)
+
+
+def test_reuse_falls_back_to_copy(tmp_path, mocker):
+    """Test that a copy is made if links and clones are not supported."""
+    mocker.patch("os.link", side_effect=OSError("cross-device link"))
+    mocker.patch("pdfpop.dedup._reflink", side_effect=OSError("not supported"))
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"source")
+    target = tmp_path / "target.pdf"
+    pdfpop.dedup.reuse(source, target, pdfpop.dedup.HARDLINK)
+    assert target.read_bytes() == b"source"
+    assert not target.samefile(source)
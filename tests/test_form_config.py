@@ -100,3 +100,138 @@ def test_interpret_data_original_value_fallback():
     data = {"a2": 123}
     mapped_fields = pdfpop.form_config.interpret(fields, data)
     assert mapped_fields == {"a1": 123, "b1": "return data['b2']"}
+
+
+def test_compiled_section_sorts_mappings_by_kind():
+    """Tests that mappings are sorted by kind when compiled."""
+    fields = {"a1": None, "b1": "b2", "c1": 1.5, "d1": "data['b2'] * 2"}
+    section = pdfpop.form_config.CompiledSection(fields, ["b2"])
+    assert section.ignored == ["a1"]
+    assert [(f.key, f.kind) for f in section.fields] == [
+        ("b1", pdfpop.form_config.COLUMN),
+        ("c1", pdfpop.form_config.LITERAL),
+        ("d1", pdfpop.form_config.EXPRESSION),
+    ]
+    assert section.evaluate({"b2": "x"}) == {"b1": "x", "c1": 1.5, "d1": "xx"}
+    assert section.evaluate({"b2": "y"}) == {"b1": "y", "c1": 1.5, "d1": "yy"}
+
+
+def test_compiled_section_uncompilable_text_is_literal():
+    """Tests that mappings which do not compile are used as text."""
+    fields = {
+        "a1": "1.0.0",
+        "b1": "return data[",
+        "c1": "N/A",
+        "d1": "examples/example-form.pdf",
+        "e1": "return missing",
+    }
+    section = pdfpop.form_config.CompiledSection(fields, [])
+    assert [f.kind for f in section.fields] == [
+        pdfpop.form_config.LITERAL
+    ] * len(fields)
+    assert list(section.errors) == ["b1", "e1"]
+    assert isinstance(section.errors["e1"], NameError)
+    assert section.evaluate({}) == fields
+
+
+def test_compiled_section_fallback_warns(caplog):
+    """Tests that expressions failing for a row name their field."""
+    fields = {"a1": "data['a2']", "b1": "return data['b2']"}
+    section = pdfpop.form_config.CompiledSection(fields, [])
+    with caplog.at_level("WARNING", logger="pdfpop"):
+        assert section.evaluate({"a2": 123}) == {
+            "a1": 123,
+            "b1": "return data['b2']",
+        }
+    assert len(caplog.records) == 1
+    assert '"b1"' in caplog.records[0].getMessage()
+    assert "KeyError" in caplog.records[0].getMessage()
+
+
+def test_compiled_section_comprehension_data_access():
+    """Tests that expressions can use data inside comprehensions."""
+    fields = {"a1": "[data[k] for k in ('a2', 'b2')]"}
+    section = pdfpop.form_config.CompiledSection(fields, ["a2", "b2"])
+    assert section.evaluate({"a2": 1, "b2": 2}) == {"a1": [1, 2]}
+
+
+def test_compiled_config_strips_field_types():
+    """Tests that the compiled fields section uses bare field names."""
+    form_cfg = pdfpop.form_config.FormConfig(pathlib.Path("unused.json"))
+    form_cfg.data["io"]["form"] = "'form.pdf'"
+    form_cfg.data["fields"] = {"name [text]": "Name"}
+    compiled = pdfpop.form_config.CompiledConfig(form_cfg, ["Name"])
+    assert compiled.fields.evaluate({"Name": "Jo"}) == {"name": "Jo"}
+    assert compiled.io.evaluate({"Name": "Jo"})["form"] == "form.pdf"
+    assert compiled.errors == {}
+
+
+def test_compiled_section_columns():
+    """Tests that the columns used by a section are found statically."""
+    fields = {
+        "a1": "a2",
+        "b1": "data['b2'] + ' ' + data.get('c2', '')",
+        "c1": "return data['d2'].lower()",
+        "d1": 123,
+        "e1": None,
+    }
+    section = pdfpop.form_config.CompiledSection(fields, ["a2"])
+    assert section.columns == {"a2", "b2", "c2", "d2"}
+
+
+@pytest.mark.parametrize(
+    "logic",
+    [
+        "data[min(data)]",
+        "data.items()",
+        "len(data)",
+        "return {k: v for k, v in data.items()}",
+    ],
+)
+def test_compiled_section_columns_unknown(logic):
+    """Tests that dynamic data access makes the used columns unknown."""
+    section = pdfpop.form_config.CompiledSection({"a1": logic}, [])
+    assert section.columns is None
+
+
+def test_compiled_section_evaluate_batch():
+    """Tests that batch evaluation matches row by row evaluation."""
+    fields = {
+        "a1": "a2",
+        "b1": "data['a2'] + ' ' + data['b2']",
+        "c1": "data['b2'].upper()",
+        "d1": "return data['a2'][0]",
+        "e1": 1.5,
+        "f1": None,
+    }
+    rows = [{"a2": "John", "b2": "Smith"}, {"a2": "Jane", "b2": "Doe"}]
+    section = pdfpop.form_config.CompiledSection(fields, ["a2", "b2"])
+    batch = section.evaluate_batch(rows)
+    assert batch == [tuple(section.evaluate(row).values()) for row in rows]
+    assert section.bind(batch[0]) == section.evaluate(rows[0])
+    assert section.keys == ("a1", "b1", "c1", "d1", "e1")
+
+
+def test_compiled_section_evaluate_batch_vectorizes(mocker):
+    """Tests that concatenations are evaluated once for the whole batch."""
+    section = pdfpop.form_config.CompiledSection(
+        {"a1": "data['a2'] + '!'"}, ["a2"]
+    )
+    vectorized = mocker.spy(pdfpop.form_config, "_evaluate_vectorized")
+    rows = [{"a2": str(i)} for i in range(10)]
+    assert section.evaluate_batch(rows) == [(f"{i}!",) for i in range(10)]
+    assert vectorized.call_count == 1
+    assert vectorized.spy_return == [f"{i}!" for i in range(10)]
+
+
+@pytest.mark.parametrize(
+    "logic",
+    ["data['a2'].replace('a', 'b')", "data['a2'][:1]", "data['a2'] * 2"],
+)
+def test_compiled_section_evaluate_batch_falls_back(logic):
+    """Tests that expressions that are not concatenations run per row."""
+    section = pdfpop.form_config.CompiledSection({"a1": logic}, ["a2"])
+    rows = [{"a2": "aa"}, {"a2": "ab"}]
+    assert section.evaluate_batch(rows) == [
+        tuple(section.evaluate(row).values()) for row in rows
+    ]
@@ -0,0 +1,76 @@
+"""Collection of tests for pdfpop's logging configuration."""
+import io
+import logging
+
+import pytest
+
+import pdfpop.log
+
+
+@pytest.mark.parametrize(
+    "verbosity, level",
+    [
+        (-3, logging.ERROR),
+        (-2, logging.ERROR),
+        (-1, logging.WARNING),
+        (0, logging.INFO),
+        (1, logging.DEBUG),
+        (2, logging.DEBUG),
+    ],
+)
+def test_get_level(verbosity, level):
+    """Test that verbosities map to logging levels."""
+    assert pdfpop.log.get_level(verbosity) == level
+
+
+def test_configured_buffers_messages():
+    """Test that messages are buffered until the context exits."""
+    stream = io.StringIO()
+    logger = logging.getLogger("pdfpop.test")
+    with pdfpop.log.configured(stream=stream):
+        logger.info("shown")
+        logger.debug("hidden")
+        assert stream.getvalue() == ""
+    assert stream.getvalue() == "shown\n"
+
+
+def test_configured_flushes_errors():
+    """Test that an error flushes the buffered messages immediately."""
+    stream = io.StringIO()
+    logger = logging.getLogger("pdfpop.test")
+    with pdfpop.log.configured(-1, stream=stream):
+        logger.info("hidden")
+        logger.warning("warning")
+        logger.error("error")
+        assert stream.getvalue() == "warning\nerror\n"
+
+
+def test_configured_restores_logger():
+    """Test that the pdfpop logger is restored when the context exits."""
+    logger = logging.getLogger(pdfpop.log.LOGGER_NAME)
+    handlers, level = logger.handlers[:], logger.level
+    with pdfpop.log.configured(1, stream=io.StringIO()):
+        assert logger.level == logging.DEBUG
+    assert logger.handlers == handlers
+    assert logger.level == level
+    assert logger.propagate
+
+
+def test_capture_and_replay(caplog):
+    """Test that captured records are logged again in order."""
+    logger = logging.getLogger(pdfpop.log.LOGGER_NAME)
+    saved = logger.handlers[:], logger.level
+    buffer = pdfpop.log.capture(logging.INFO)
+    try:
+        logging.getLogger("pdfpop.test").info("row %d", 1)
+        logging.getLogger("pdfpop.test").debug("hidden")
+        records = buffer.drain()
+    finally:
+        logger.handlers = saved[0]
+        logger.setLevel(saved[1])
+        logger.propagate = True
+    assert records == [("pdfpop.test", logging.INFO, "row 1")]
+    assert buffer.drain() == []
+    caplog.set_level(logging.INFO, logger="pdfpop")
+    pdfpop.log.replay(records)
+    assert caplog.record_tuples == records
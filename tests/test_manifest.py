@@ -0,0 +1,79 @@
+"""Collection of tests for pdfpop's output manifest handling."""
+import pathlib
+
+import pdfpop.manifest
+
+
+def _entry(tmp_path, row=None, output_name="out.pdf", options=None):
+    """Return a manifest entry for an output in the given directory."""
+    return pdfpop.manifest.make_entry(
+        0,
+        row or {"a": "1"},
+        "config",
+        "form",
+        tmp_path / output_name,
+        options or {"flatten": False},
+    )
+
+
+def test_manifest_path(tmp_path):
+    """Test that the manifest is kept in the output directory."""
+    manifest = pdfpop.manifest.Manifest(tmp_path)
+    assert manifest.path == tmp_path / pdfpop.manifest.MANIFEST_NAME
+
+
+def test_manifest_record_and_load(tmp_path):
+    """Test that recorded entries are loaded, latest entry first."""
+    manifest = pdfpop.manifest.Manifest(tmp_path)
+    manifest.record(_entry(tmp_path))
+    manifest.record(_entry(tmp_path, {"a": "2"}))
+    manifest.close(compact=False)
+    with manifest.path.open("a") as f:
+        f.write('{"output": "trunc')
+    loaded = pdfpop.manifest.Manifest(tmp_path)
+    loaded.load()
+    assert loaded.entries == {
+        str(tmp_path / "out.pdf"): _entry(tmp_path, {"a": "2"})
+    }
+
+
+def test_manifest_close_compacts(tmp_path):
+    """Test that closing a manifest keeps the latest entry of each output."""
+    manifest = pdfpop.manifest.Manifest(tmp_path)
+    manifest.record(_entry(tmp_path))
+    manifest.record(_entry(tmp_path, output_name="other.pdf"))
+    manifest.close()
+    with manifest.path.open("a") as f:
+        f.write('{"output": "trunc')
+    manifest = pdfpop.manifest.Manifest(tmp_path)
+    manifest.record(_entry(tmp_path, {"a": "2"}))
+    assert len(manifest.path.read_text().splitlines()) == 4
+    manifest.close()
+    lines = manifest.path.read_text().splitlines()
+    assert len(lines) == 2
+    loaded = pdfpop.manifest.Manifest(tmp_path)
+    loaded.load()
+    assert loaded.entries == {
+        str(tmp_path / "out.pdf"): _entry(tmp_path, {"a": "2"}),
+        str(tmp_path / "other.pdf"): _entry(tmp_path, output_name="other.pdf"),
+    }
+
+
+def test_manifest_is_current(tmp_path):
+    """Test that only existing outputs with matching digests are current."""
+    manifest = pdfpop.manifest.Manifest(tmp_path)
+    entry = _entry(tmp_path)
+    manifest.record(entry)
+    assert not manifest.is_current(entry)
+    (tmp_path / "out.pdf").touch()
+    assert manifest.is_current(entry)
+    assert not manifest.is_current(_entry(tmp_path, {"a": "2"}))
+    assert not manifest.is_current(_entry(tmp_path, output_name="new.pdf"))
+    assert not manifest.is_current(_entry(tmp_path, options={"flatten": True}))
+
+
+def test_make_entry_row_digest_ignores_key_order(tmp_path):
+    """Test that the row digest does not depend on the column order."""
+    first = _entry(tmp_path, {"a": "1", "b": "2"})
+    second = _entry(tmp_path, {"b": "2", "a": "1"})
+    assert first["row_digest"] == second["row_digest"]
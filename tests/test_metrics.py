@@ -0,0 +1,122 @@
+"""Collection of tests for pdfpop's run instrumentation."""
+import json
+
+import pytest
+
+import pdfpop.metrics
+
+
+def test_metrics_stage():
+    """Test that the time of each stage is accumulated."""
+    metrics = pdfpop.metrics.Metrics()
+    for _ in range(3):
+        with metrics.stage("fill"):
+            pass
+    stage = metrics.report()["stages"]["fill"]
+    assert stage["calls"] == 3
+    assert stage["seconds"] >= 0
+
+
+def test_metrics_rows():
+    """Test that rows, field counts and failures are recorded."""
+    metrics = pdfpop.metrics.Metrics()
+    with metrics.row(0):
+        metrics.count_fields(3, 1)
+    with pytest.raises(KeyError):
+        with metrics.row(1):
+            raise KeyError("field")
+    report = metrics.report()
+    assert report["rows"]["count"] == 2
+    assert report["rows"]["failed"] == 1
+    assert report["fields"] == {"set": 3, "ignored": 1}
+    assert {row["row"] for row in report["slowest_rows"]} == {1, 2}
+
+
+def test_metrics_memory():
+    """Test that the RSS change and the peak RSS so far are recorded."""
+    metrics = pdfpop.metrics.Metrics()
+    with metrics.row(0):
+        with metrics.stage("fill"):
+            pass
+    report = metrics.report()
+    for record in (report["stages"]["fill"], report["slowest_rows"][0]):
+        assert record["max_rss_so_far"] == report["peak_rss"]
+        if pdfpop.metrics.current_rss() is not None:
+            assert isinstance(record["rss_delta"], int)
+
+
+def test_metrics_deferred_rows():
+    """Test that deferred rows are recorded with the time added later."""
+    metrics = pdfpop.metrics.Metrics()
+    with metrics.row(0, deferred=True) as row:
+        metrics.count_fields(2, 0)
+    assert metrics.report()["rows"]["count"] == 0
+    seconds = row["seconds"]
+    metrics.finish_row(row, 1.5, failed=True)
+    report = metrics.report()
+    assert report["rows"]["count"] == 1
+    assert report["rows"]["failed"] == 1
+    assert report["rows"]["seconds"] == seconds + 1.5
+    assert report["fields"] == {"set": 2, "ignored": 0}
+
+
+def test_metrics_slowest_rows():
+    """Test that only the slowest rows are kept, slowest first."""
+    metrics = pdfpop.metrics.Metrics()
+    for idx in range(pdfpop.metrics.SLOWEST_ROWS * 2):
+        metrics._add_row(
+            {
+                "row": idx + 1,
+                "seconds": float(idx % 7),
+                "fields_set": 0,
+                "fields_ignored": 0,
+                "failed": False,
+            }
+        )
+    slowest = metrics.report()["slowest_rows"]
+    assert len(slowest) == pdfpop.metrics.SLOWEST_ROWS
+    seconds = [row["seconds"] for row in slowest]
+    assert seconds == sorted(seconds, reverse=True)
+    assert seconds[0] == 6.0
+
+
+def test_metrics_merge():
+    """Test that the snapshot of another process is merged."""
+    worker = pdfpop.metrics.Metrics()
+    with worker.row(4):
+        with worker.stage("write"):
+            pass
+    metrics = pdfpop.metrics.Metrics()
+    with metrics.stage("load"):
+        pass
+    metrics.merge(worker.snapshot())
+    report = metrics.report()
+    assert set(report["stages"]) == {"load", "write"}
+    assert report["rows"]["count"] == 1
+    assert report["slowest_rows"][0]["row"] == 5
+
+
+def test_metrics_save(tmp_path):
+    """Test that the metrics are saved as JSON."""
+    metrics = pdfpop.metrics.Metrics()
+    metrics.save(tmp_path / "metrics.json")
+    report = json.loads((tmp_path / "metrics.json").read_text())
+    assert report["rows"]["count"] == 0
+
+
+def test_null_metrics_record_nothing():
+    """Test that disabled metrics do not record anything."""
+    metrics = pdfpop.metrics.NULL_METRICS
+    with metrics.row(0):
+        with metrics.stage("fill"):
+            metrics.count_fields(1, 0)
+    assert not metrics.enabled
+    assert metrics.report()["stages"] == {}
+    assert metrics.report()["rows"]["count"] == 0
+
+
+def test_profiled(tmp_path):
+    """Test that profile statistics are dumped."""
+    with pdfpop.metrics.profiled(tmp_path / "run.prof"):
+        sum(range(10))
+    assert (tmp_path / "run.prof").stat().st_size > 0
@@ -0,0 +1,337 @@
+"""Collection of tests for pdfpop's PDF handling."""
+import pathlib
+import re
+
+import pdfrw
+import pytest
+
+import pdfpop.pdf
+
+
+FORM_PATH = pathlib.Path("examples/example-form.pdf")
+
+
+@pytest.fixture
+def row():
+    """Fixture that returns a row of field values for the example form."""
+    return {
+        "name": "John Smith",
+        "EMAIL": "john.smith@fake.com",
+        "extended_hours": "Yes",
+        "satisfied": "No",
+        "requests": ["Lower fees", "Add more space"],
+        "remarks": "Music is too loud.",
+    }
+
+
+def _field_values(path):
+    """Return the value of every field of a PDF, by field name."""
+    values = {}
+    for page in pdfrw.PdfReader(path).pages:
+        for annotation in page["/Annots"] or []:
+            field = annotation if annotation["/T"] else annotation["/Parent"]
+            value = field["/V"]
+            if isinstance(value, pdfrw.PdfString):
+                value = value.to_unicode()
+            elif isinstance(value, pdfrw.PdfArray):
+                value = [item.to_unicode() for item in value]
+            elif value is not None:
+                value = str(value)
+            values[field["/T"].to_unicode()] = value
+    return values
+
+
+def test_form_template_matches_direct_population(tmp_path, row):
+    """Test that a template sets the same values as pdfrw on its own."""
+    form = pdfrw.PdfReader(FORM_PATH)
+    for page in form.pages:
+        for annotation in page["/Annots"]:
+            field = annotation if annotation["/T"] else annotation["/Parent"]
+            value = row.get(field["/T"].to_unicode())
+            if isinstance(value, list):
+                field.V = pdfrw.PdfArray(
+                    [pdfrw.PdfString.encode(item) for item in value]
+                )
+            elif field["/FT"] == "/Btn" and value is not None:
+                field.V = pdfrw.PdfName("Yes")
+            elif value is not None:
+                field.V = pdfrw.PdfString.encode(value)
+    pdfrw.PdfWriter().write(tmp_path / "direct.pdf", form)
+    expected = _field_values(tmp_path / "direct.pdf")
+    for mapped in (True, False):
+        template = pdfpop.pdf.FormTemplate(FORM_PATH, mapped=mapped)
+        pdfpop.pdf.populate_form(template, row, tmp_path / "template.pdf")
+        assert _field_values(tmp_path / "template.pdf") == expected
+
+
+def test_form_template_is_not_modified_by_population(tmp_path, row):
+    """Test that populating a clone leaves the template untouched."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    pdfpop.pdf.populate_form(template, row, tmp_path / "filled.pdf")
+    pdfpop.pdf.populate_form(template, {}, tmp_path / "template.pdf")
+    pdfpop.pdf.populate_form(FORM_PATH, {}, tmp_path / "direct.pdf")
+    assert (tmp_path / "direct.pdf").read_bytes() == (
+        tmp_path / "template.pdf"
+    ).read_bytes()
+
+
+def test_form_template_shares_page_content():
+    """Test that clones share unchanged page content with the template."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    first, second = template.clone(), template.clone()
+    assert first.pages[0] is not second.pages[0]
+    assert first.pages[0].Contents is second.pages[0].Contents
+    assert first.pages[0].Annots[0] is not second.pages[0].Annots[0]
+
+
+def test_form_template_memory_size():
+    """Test that lazily read templates are charged for what they parse."""
+    mapped = pdfpop.pdf.FormTemplate(FORM_PATH)
+    eager = pdfpop.pdf.FormTemplate(FORM_PATH, mapped=False)
+    memory_mapped = pdfpop.pdf.FormTemplate(FORM_PATH, memory_map=True)
+    size = FORM_PATH.stat().st_size
+    assert size < mapped.memory_size < eager.memory_size
+    assert memory_mapped.memory_size == mapped.memory_size - size
+
+
+def test_form_template_field_index():
+    """Test that fields are indexed by name with their type and widgets."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    fields = template.fields
+    assert list(fields) == [
+        key.split(" [")[0] for key in pdfpop.pdf.get_fields_info(FORM_PATH)
+    ]
+    assert fields["name"].type == "text"
+    assert fields["satisfied"].type == "combo"
+    assert fields["requests"].type == "list"
+    assert fields["membership_type"].type == "radio"
+    assert len(fields["membership_type"].widgets) == 3
+    assert fields["satisfied"].options["No"] == "(No)"
+    assert fields["membership_type"].exports == ("/0", "/1", "/2")
+
+
+def test_form_template_populate_only_sets_given_fields():
+    """Test that only the fields present in a row are modified."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    trailer = template.populate({"EMAIL": "jane@fake.com"})
+    values = {
+        annotation["/T"].to_unicode(): annotation["/V"]
+        for annotation in trailer.pages[0].Annots
+        if annotation["/T"]
+    }
+    assert values["EMAIL"].to_unicode() == "jane@fake.com"
+    assert values["name"] is None
+
+
+def test_form_template_populates_radio_buttons_every_time():
+    """Test that radio buttons are set in every population of a template."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    for value in ("1", "2", "0"):
+        trailer = template.populate({"membership_type": value})
+        kids = [
+            annotation
+            for annotation in trailer.pages[0].Annots
+            if annotation.Parent and annotation.Parent.T == "(membership_type)"
+        ]
+        assert kids[0].Parent.V == f"/{value}"
+        assert [kid.AS for kid in kids] == [
+            f"/{value}" if idx == int(value) else "/Off" for idx in range(3)
+        ]
+
+
+def test_form_template_choice_export_values():
+    """Test that choice fields are set to the export value of options."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    trailer = template.populate({"requests": ["Lower fees", "Add more space"]})
+    (requests,) = [
+        annotation
+        for annotation in trailer.pages[0].Annots
+        if annotation.T == "(requests)"
+    ]
+    assert requests.V == ["(Lower fees)", "(Add more space)"]
+    with pytest.raises(KeyError):
+        template.populate({"satisfied": "Maybe"})
+
+
+def test_merged_form_writer(tmp_path, row):
+    """Test that rows are merged into one PDF with per-row field names."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    output_path = tmp_path / "merged.pdf"
+    with pdfpop.pdf.MergedFormWriter(output_path) as writer:
+        writer.add(template, row)
+        writer.add(template, {"name": "Jane Doe"})
+    merged = pdfrw.PdfReader(output_path)
+    pages = len(pdfrw.PdfReader(FORM_PATH).pages)
+    assert len(merged.pages) == 2 * pages
+    fields = merged.Root.AcroForm.Fields
+    assert [field.T.to_unicode() for field in fields] == ["row1", "row2"]
+    values = {
+        f"{annotation.Parent.T.to_unicode()}.{annotation.T.to_unicode()}": (
+            annotation.V
+        )
+        for annotation in merged.pages[pages].Annots
+        if annotation.T
+    }
+    assert values["row2.name"].to_unicode() == "Jane Doe"
+    assert merged.pages[0].Contents is merged.pages[pages].Contents
+
+
+def test_populate_form_incremental(tmp_path, row):
+    """Test that an incremental update populates the same field values."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    full_path = tmp_path / "full.pdf"
+    incremental_path = tmp_path / "incremental.pdf"
+    pdfpop.pdf.populate_form(template, row, full_path)
+    pdfpop.pdf.populate_form(template, row, incremental_path, incremental=True)
+    assert incremental_path.read_bytes().startswith(FORM_PATH.read_bytes())
+
+    def values(path):
+        form = pdfrw.PdfReader(path)
+        return [
+            (annotation.T, annotation.V, annotation.AS)
+            for annotation in form.pages[0].Annots
+        ]
+
+    assert values(incremental_path) == values(full_path)
+    form = pdfrw.PdfReader(incremental_path)
+    assert form.Root.AcroForm.NeedAppearances == "true"
+
+
+def test_form_template_update_only_modified_objects():
+    """Test that an update only contains the objects population modified."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    update = template.update({"EMAIL": "jane@fake.com"})
+    objects = re.findall(rb"^(\d+) 0 obj", update, re.MULTILINE)
+    acro_form = pdfrw.PdfReader(FORM_PATH).Root.AcroForm
+    email = template.fields["EMAIL"]
+    assert len(objects) == 1 + len({email.annotation, *email.widgets})
+    assert str(acro_form.indirect[0]).encode() in objects
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_populate_form_appearances(tmp_path, row, incremental):
+    """Test that populated widgets get appearance streams."""
+    output_path = tmp_path / "filled.pdf"
+    pdfpop.pdf.populate_form(
+        FORM_PATH, row, output_path, incremental=incremental, appearances=True
+    )
+    form = pdfrw.PdfReader(output_path)
+    assert form.Root.AcroForm.NeedAppearances is None
+    widgets = {
+        (annotation.T or annotation.Parent.T).to_unicode(): annotation
+        for annotation in form.pages[0].Annots
+    }
+    name = widgets["name"].AP.N
+    assert "(John Smith) Tj" in name.stream
+    assert name.Resources.Font.Helv is not None
+    assert widgets["extended_hours"].AS == "/Yes"
+    assert "(Lower fees) Tj" in widgets["requests"].AP.N.stream
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_populate_form_flatten(tmp_path, row, incremental):
+    """Test that flattening draws the widgets and removes the form."""
+    output_path = tmp_path / "flat.pdf"
+    pdfpop.pdf.populate_form(
+        FORM_PATH, row, output_path, incremental=incremental, flatten=True
+    )
+    form = pdfrw.PdfReader(output_path)
+    assert form.Root.AcroForm is None
+    page = form.pages[0]
+    assert page.Annots is None
+    drawn = [
+        xobject.stream
+        for xobject in page.Resources.XObject.values()
+        if xobject.stream
+    ]
+    assert any("(John Smith) Tj" in stream for stream in drawn)
+    assert "/FlatWidget0 Do" in page.Contents[-1].stream
+
+
+def test_flatten_leaves_template_unmodified(tmp_path, row):
+    """Test that flattening a clone does not alter the template."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    template.populate(row, flatten=True)
+    trailer = template.populate({})
+    assert trailer.Root.AcroForm is not None
+    assert len(trailer.pages[0].Annots) == 16
+
+
+def _nested_form(path, fields=True):
+    """Write a form with nested fields and a page without annotations.
+
+    The "city" field inherits its type from its parent.
+    """
+    parent = pdfrw.PdfDict(T=pdfrw.PdfString.encode("person"))
+    first = pdfrw.PdfDict(
+        T=pdfrw.PdfString.encode("first"),
+        FT=pdfrw.PdfName("Tx"),
+        Parent=parent,
+        Subtype=pdfrw.PdfName("Widget"),
+    )
+    address = pdfrw.PdfDict(
+        T=pdfrw.PdfString.encode("address"),
+        FT=pdfrw.PdfName("Tx"),
+        Parent=parent,
+    )
+    city = pdfrw.PdfDict(
+        T=pdfrw.PdfString.encode("city"),
+        Parent=address,
+        Subtype=pdfrw.PdfName("Widget"),
+    )
+    parent.Kids = pdfrw.PdfArray([first, address])
+    address.Kids = pdfrw.PdfArray([city])
+    radio = pdfrw.PdfDict(
+        T=pdfrw.PdfString.encode("choice"),
+        FT=pdfrw.PdfName("Btn"),
+        Ff=1 << 15,
+    )
+    buttons = [
+        pdfrw.PdfDict(Parent=radio, Subtype=pdfrw.PdfName("Widget"))
+        for _ in range(2)
+    ]
+    radio.Kids = pdfrw.PdfArray(buttons)
+    for obj in (parent, first, address, city, radio, *buttons):
+        obj.indirect = True
+    writer = pdfrw.PdfWriter()
+    writer.addpage(
+        pdfrw.PdfDict(
+            Type=pdfrw.PdfName("Page"),
+            MediaBox=[0, 0, 612, 792],
+            Annots=pdfrw.PdfArray([first, city, *buttons]),
+        )
+    )
+    writer.addpage(
+        pdfrw.PdfDict(Type=pdfrw.PdfName("Page"), MediaBox=[0, 0, 612, 792])
+    )
+    acro_form = pdfrw.PdfDict()
+    if fields:
+        acro_form.Fields = pdfrw.PdfArray([parent, radio])
+    writer.trailer.Root.AcroForm = acro_form
+    writer.write(path)
+    return path
+
+
+def test_get_fields_info_nested_fields(tmp_path, mocker, caplog):
+    """Test that fields are discovered from the field tree by full name."""
+    readpages = mocker.spy(pdfrw.PdfReader, "readpages")
+    fields_info = pdfpop.pdf.get_fields_info(_nested_form(tmp_path / "f.pdf"))
+    assert list(fields_info) == [
+        "person.first [text]",
+        "person.address.city [text]",
+        "choice [radio]",
+    ]
+    assert readpages.call_count == 0
+    assert not caplog.records
+
+
+def test_get_fields_info_falls_back_to_pages(tmp_path, caplog):
+    """Test that forms without a field tree are discovered from pages."""
+    form_path = _nested_form(tmp_path / "f.pdf", fields=False)
+    fields_info = pdfpop.pdf.get_fields_info(form_path)
+    assert list(fields_info) == [
+        "person.first [text]",
+        "person.address.city [text]",
+        "choice [radio]",
+    ]
+    assert "has no AcroForm fields" in caplog.text
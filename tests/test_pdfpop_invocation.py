@@ -3,7 +3,9 @@ Tests to make sure that pdfpop can be called from the cli without using the
 entry point set up for the package.
 """
 
+import json
 import os
+import pathlib
 import subprocess
 import sys
 
@@ -30,3 +32,93 @@ def test_submodule_should_invoke_main(monkeypatch):
     )
     assert result.returncode == 0
     assert result.stdout.decode("utf-8").startswith("Usage: pdfpop")
+
+
+# Cumulative import time budget of `pdfpop.cli` in microseconds. It is a
+# generous multiple of the typical time so that slow machines do not fail.
+CLI_IMPORT_BUDGET = 250_000
+
+
+def _imported_modules(monkeypatch, code):
+    """Return the modules imported by running code in a new interpreter."""
+    monkeypatch.setenv("PYTHONPATH", ".")
+    result = subprocess.run(
+        [sys.executable, "-c", f"{code}\nimport sys; print(*sys.modules)"],
+        capture_output=True,
+        check=True,
+    )
+    return set(result.stdout.decode("utf-8").split())
+
+
+def test_cli_import_is_lazy(monkeypatch):
+    """Should not import the command dependencies to start the CLI."""
+    modules = _imported_modules(monkeypatch, "import pdfpop.cli")
+    heavy = {"pandas", "openpyxl", "pdfrw", "pdfpop.commands", "http.server"}
+    assert not modules & heavy
+
+
+def test_commands_import_without_pandas(monkeypatch):
+    """Should not import pandas or openpyxl for the `config` command."""
+    modules = _imported_modules(monkeypatch, "import pdfpop.commands")
+    assert not modules & {"pandas", "openpyxl"}
+
+
+def test_cli_import_time(monkeypatch):
+    """Should import the CLI within the import time budget."""
+    monkeypatch.setenv("PYTHONPATH", ".")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import pdfpop.cli"],
+        capture_output=True,
+        check=True,
+    )
+    for line in result.stderr.decode("utf-8").splitlines():
+        _, cumulative, module = line.split("|")
+        if module.strip() == "pdfpop.cli":
+            assert int(cumulative) < CLI_IMPORT_BUDGET
+            break
+    else:
+        pytest.fail("pdfpop.cli was not imported.")
+
+
+def test_shard_processes(monkeypatch, tmp_path):
+    """Should populate every row with concurrent shard processes."""
+    monkeypatch.setenv("PYTHONPATH", str(pathlib.Path.cwd()))
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps(
+            {
+                "io": {
+                    "form": repr(
+                        str(pathlib.Path("examples/example-form.pdf").resolve())
+                    ),
+                    "output_dir": repr(str(tmp_path)),
+                    "output_name": "data['Output'] + '.pdf'",
+                },
+                "fields": {"name [text]": "Name"},
+            }
+        )
+    )
+    data_path = tmp_path / "data.csv"
+    data_path.write_text(
+        "Name,Output\n" + "".join(f"{idx},{idx}\n" for idx in range(8))
+    )
+    shards = [
+        subprocess.Popen(
+            [sys.executable, "-m", "pdfpop", "run", "-j", "1"]
+            + ["--shard", f"{index}/2", str(config_path), str(data_path)],
+            cwd=tmp_path,
+            stdout=subprocess.DEVNULL,
+        )
+        for index in (1, 2)
+    ]
+    assert [shard.wait() for shard in shards] == [0, 0]
+
+    result = subprocess.run(
+        [sys.executable, "-m", "pdfpop", "merge-manifests"]
+        + ["pdfpop-status-1-of-2.jsonl", "pdfpop-status-2-of-2.jsonl"],
+        cwd=tmp_path,
+        capture_output=True,
+    )
+    assert result.returncode == 0
+    assert "8 populated, 0 missing" in result.stdout.decode("utf-8")
+    assert all((tmp_path / f"{idx}.pdf").exists() for idx in range(8))
@@ -0,0 +1,20 @@
+"""Collection of tests for pdfpop's pipeline stages."""
+import pytest
+
+import pdfpop.pipeline
+
+
+def test_read_ahead():
+    """Test that rows are read ahead and reading errors are raised."""
+
+    def rows():
+        yield from ({"row": idx} for idx in range(10))
+        raise ValueError("unreadable")
+
+    read_rows = pdfpop.pipeline.read_ahead(rows(), 2)
+    assert [next(read_rows)["row"] for _ in range(10)] == list(range(10))
+    with pytest.raises(ValueError, match="unreadable"):
+        next(read_rows)
+    read_rows = pdfpop.pipeline.read_ahead(({} for _ in range(100)), 2)
+    next(read_rows)
+    read_rows.close()
@@ -0,0 +1,108 @@
+"""Collection of tests for pdfpop's in-process populator."""
+import concurrent.futures
+import io
+import pathlib
+
+import pdfrw
+import pytest
+
+import pdfpop.form_config
+import pdfpop.pdf
+import pdfpop.populator
+
+
+FORM_PATH = pathlib.Path("examples/example-form.pdf")
+
+
+@pytest.fixture
+def form_cfg(tmp_path):
+    """Fixture that returns a configuration for the example form."""
+    form_cfg = pdfpop.form_config.FormConfig(tmp_path / "config.json")
+    form_cfg.data["io"]["form"] = repr(str(FORM_PATH))
+    form_cfg.data["io"]["output_dir"] = repr(str(tmp_path))
+    form_cfg.data["io"]["output_name"] = "'out.pdf'"
+    form_cfg.data["fields"] = {
+        "name [text]": "data['First Name'] + ' ' + data['Last Name']",
+        "EMAIL [text]": "Email",
+        "remarks [text]": None,
+    }
+    form_cfg.save()
+    return form_cfg
+
+
+def _values(pdf_bytes):
+    """Return the field values of a populated PDF."""
+    form = pdfrw.PdfReader(fdata=pdf_bytes)
+    return {
+        annotation.T.to_unicode(): annotation.V.to_unicode()
+        for annotation in form.pages[0].Annots
+        if isinstance(annotation.V, pdfrw.PdfString)
+    }
+
+
+def test_populator_populate(tmp_path, form_cfg):
+    """Test that a row is populated into PDF bytes."""
+    populator = pdfpop.populator.Populator(form_cfg.path)
+    row = {"First Name": "Ada", "Last Name": "Lovelace", "Email": "a@b.c"}
+    pdf_bytes = populator.populate(row)
+    pdfpop.pdf.populate_form(
+        FORM_PATH,
+        {"name": "Ada Lovelace", "EMAIL": "a@b.c"},
+        tmp_path / "direct.pdf",
+    )
+    assert pdf_bytes == (tmp_path / "direct.pdf").read_bytes()
+
+
+def test_populator_write(form_cfg):
+    """Test that a row is populated into a writable stream."""
+    populator = pdfpop.populator.Populator(form_cfg)
+    output = io.BytesIO()
+    populator.write({"First Name": "A", "Last Name": "B", "Email": ""}, output)
+    assert _values(output.getvalue())["name"] == "A B"
+
+
+def test_populator_form_and_columns(form_cfg):
+    """Test that an explicit form and known columns are used."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    form_cfg.data["io"]["form"] = "'missing.pdf'"
+    populator = pdfpop.populator.Populator(
+        form_cfg, form=template, columns=["First Name", "Last Name", "Email"]
+    )
+    row = {"First Name": "A", "Last Name": "B", "Email": "c@d.e"}
+    assert _values(populator.populate(row))["EMAIL"] == "c@d.e"
+
+
+def test_populator_ignores_other_keys(form_cfg):
+    """Test that rows with extra keys reuse the compiled configuration."""
+    populator = pdfpop.populator.Populator(form_cfg)
+    for idx in range(pdfpop.populator.MAX_COMPILED + 4):
+        row = {"First Name": "A", "Last Name": "B", f"extra{idx}": idx}
+        assert _values(populator.populate(row))["EMAIL"] == "Email"
+    assert len(populator._compiled) == 1
+    row = {"First Name": "A", "Last Name": "B", "Email": "c@d.e"}
+    assert _values(populator.populate(row))["EMAIL"] == "c@d.e"
+    assert len(populator._compiled) == 2
+
+
+def test_populator_incremental(form_cfg):
+    """Test that incremental updates of the form are returned."""
+    populator = pdfpop.populator.Populator(form_cfg, incremental=True)
+    row = {"First Name": "A", "Last Name": "B", "Email": "c@d.e"}
+    pdf_bytes = populator.populate(row)
+    assert pdf_bytes.startswith(FORM_PATH.read_bytes())
+    assert _values(pdf_bytes)["name"] == "A B"
+
+
+def test_populator_is_thread_safe(form_cfg):
+    """Test that concurrent rows are populated independently."""
+    populator = pdfpop.populator.Populator(form_cfg)
+    rows = [
+        {"First Name": str(idx), "Last Name": "X", "Email": f"{idx}@x.com"}
+        for idx in range(32)
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(populator.populate, rows))
+    for row, pdf_bytes in zip(rows, results):
+        values = _values(pdf_bytes)
+        assert values["name"] == f"{row['First Name']} X"
+        assert values["EMAIL"] == row["Email"]
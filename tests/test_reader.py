@@ -0,0 +1,201 @@
+"""Collection of tests for pdfpop's memory-mapped PDF reader."""
+import io
+import logging
+import mmap
+import pathlib
+import zlib
+
+import pdfrw
+import pytest
+
+import pdfpop.pdf
+import pdfpop.reader
+
+
+FORM_PATH = pathlib.Path("examples/example-form.pdf")
+CONTENT = b"BT /F1 12 Tf 72 740 Td (Hello) Tj ET"
+
+
+def _compressed_form(path):
+    """Write a one-field form whose dictionaries are in an object stream."""
+    objects = [
+        "<</AcroForm <</Fields [4 0 R]>> /Pages 2 0 R /Type /Catalog>>",
+        "<</Count 1 /Kids [3 0 R] /Type /Pages>>",
+        "<</Annots [4 0 R] /Contents 5 0 R /MediaBox [0 0 612 792] "
+        "/Parent 2 0 R /Type /Page>>",
+        "<</FT /Tx /P 3 0 R /Rect [72 700 300 720] /Subtype /Widget "
+        "/T (name)>>",
+    ]
+    offsets, body = [], ""
+    for obj in objects:
+        offsets.append(len(body))
+        body += obj + "\n"
+    index = " ".join(f"{num} {off}" for num, off in enumerate(offsets, 1))
+    stream = zlib.compress(f"{index}\n{body}".encode("latin-1"))
+    first = len(index) + 1
+    data = bytearray(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+    positions = {}
+    header = b"/Filter /FlateDecode /First %d /N 4 /Type /ObjStm " % first
+    for number, dictionary, content in [
+        (5, b"", CONTENT),
+        (6, header, stream),
+    ]:
+        positions[number] = len(data)
+        data += b"%d 0 obj\n<<%s/Length %d>>\nstream\n" % (
+            number,
+            dictionary,
+            len(content),
+        )
+        data += content + b"\nendstream\nendobj\n"
+    positions[7] = len(data)
+    rows = [(0, 0, 65535)] + [(2, 6, idx) for idx in range(4)]
+    rows += [(1, positions[number], 0) for number in (5, 6, 7)]
+    xref = b"".join(
+        bytes([kind]) + a.to_bytes(4, "big") + b.to_bytes(2, "big")
+        for kind, a, b in rows
+    )
+    data += (
+        b"7 0 obj\n<</Length %d /Root 1 0 R /Size 8 /Type /XRef "
+        b"/W [1 4 2]>>\nstream\n" % len(xref)
+    )
+    data += xref + b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % (
+        positions[7]
+    )
+    path.write_bytes(bytes(data))
+    return path
+
+
+def _written(reader):
+    """Return a reader's document as written by pdfrw."""
+    output = io.BytesIO()
+    pdfrw.PdfWriter().write(output, reader)
+    return output.getvalue()
+
+
+@pytest.fixture(params=["plain", "compressed"])
+def form_path(request, tmp_path):
+    """Fixture that returns a form with and without an object stream."""
+    if request.param == "plain":
+        return FORM_PATH
+    return _compressed_form(tmp_path / "compressed.pdf")
+
+
+@pytest.mark.parametrize("memory_map", [False, True])
+def test_mapped_reader_matches_pdfrw(form_path, memory_map):
+    """Test that a mapped reader reads the same document as pdfrw."""
+    reader = pdfpop.reader.MappedReader(form_path, memory_map=memory_map)
+    assert isinstance(reader.data, mmap.mmap) == memory_map
+    assert _written(reader) == _written(pdfrw.PdfReader(form_path))
+
+
+def test_mapped_reader_parses_lazily():
+    """Test that only the objects that are accessed are parsed."""
+    reader = pdfpop.reader.MappedReader(FORM_PATH)
+    contents = dict.get(reader.pages[0], "/Contents")
+    assert reader.loaded(contents) is None
+    assert reader.pages[0].Contents is reader.loaded(contents)
+
+
+def test_mapped_reader_object_extents():
+    """Test that the extent of each object holds its bytes."""
+    reader = pdfpop.reader.MappedReader(FORM_PATH)
+    data = FORM_PATH.read_bytes()
+    for number, generation, (start, end) in reader.objects():
+        assert data[start:end].startswith(b"%d %d obj" % (number, generation))
+        assert data[start:end].rstrip().endswith(b"endobj")
+
+
+def test_open_reader_falls_back_to_pdfrw(tmp_path, caplog):
+    """Test that forms that cannot be read lazily are read by pdfrw."""
+    caplog.set_level(logging.INFO, logger="pdfpop")
+    form_path = tmp_path / "form.pdf"
+    form_path.write_bytes(b"\n" + FORM_PATH.read_bytes())
+    reader = pdfpop.reader.open_reader(form_path)
+    assert not isinstance(reader, pdfpop.reader.MappedReader)
+    assert len(reader.pages) == 1
+    assert "in full" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "options", [{}, {"appearances": True}, {"flatten": True}]
+)
+def test_rewrite_matches_populate(options):
+    """Test that a rewrite sets the same fields as a pdfrw population."""
+    row = {"name": "John Smith", "satisfied": "No", "membership_type": "1"}
+    mapped = pdfpop.pdf.FormTemplate(FORM_PATH)
+    parsed = pdfpop.pdf.FormTemplate(FORM_PATH, mapped=False)
+    assert mapped.mapped and not parsed.mapped
+    rewrite = mapped.fill(row, **options)
+    assert isinstance(rewrite, pdfpop.pdf.Rewrite)
+
+    def values(populated, template):
+        data = b"".join(pdfpop.pdf.render_form(template, populated))
+        reader = pdfrw.PdfReader(fdata=data)
+        return sorted(
+            (str(annotation.T), str(annotation.V), str(annotation.AS))
+            for annotation in reader.pages[0].Annots or []
+        )
+
+    assert values(rewrite, mapped) == values(
+        parsed.fill(row, **options), parsed
+    )
+
+
+def test_rewrite_copies_unmodified_objects():
+    """Test that unmodified objects are copied without being parsed."""
+    template = pdfpop.pdf.FormTemplate(FORM_PATH)
+    reader = template._reader
+    contents = dict.get(reader.pages[0], "/Contents")
+    output = io.BytesIO()
+    pdfpop.pdf.write_form(template, template.rewrite({"name": "Ada"}), output)
+    (start, end) = reader.entries[contents[0]][1]
+    assert FORM_PATH.read_bytes()[start:end] in output.getvalue()
+    assert reader.loaded(contents) is None
+    populated = pdfrw.PdfReader(fdata=output.getvalue())
+    assert populated.pages[0].Annots[0].V == "(Ada)"
+
+
+def test_rewrite_of_compressed_objects(tmp_path):
+    """Test that objects of object streams are written on their own."""
+    form_path = _compressed_form(tmp_path / "form.pdf")
+    assert pdfpop.pdf.get_fields_info(form_path) == {"name [text]": None}
+    output_path = tmp_path / "output.pdf"
+    pdfpop.pdf.populate_form(form_path, {"name": "Ada"}, output_path)
+    data = output_path.read_bytes()
+    assert b"/ObjStm" not in data and b"/XRef" not in data
+    populated = pdfrw.PdfReader(output_path)
+    assert populated.Root.AcroForm.Fields[0].V == "(Ada)"
+    assert populated.pages[0].Contents.stream == CONTENT.decode("latin-1")
+
+
+def test_rewrite_of_updated_form(tmp_path):
+    """Test that the latest revision of an updated form is rewritten."""
+    updated_path = tmp_path / "updated.pdf"
+    pdfpop.pdf.populate_form(
+        FORM_PATH, {"name": "Ada"}, updated_path, incremental=True
+    )
+    output_path = tmp_path / "output.pdf"
+    pdfpop.pdf.populate_form(updated_path, {"EMAIL": "ada@x"}, output_path)
+    data = output_path.read_bytes()
+    assert data.count(b"startxref") == 1
+    values = {
+        annotation.T: annotation.V
+        for annotation in pdfrw.PdfReader(output_path).pages[0].Annots
+    }
+    assert values["(name)"] == "(Ada)"
+    assert values["(EMAIL)"] == "(ada@x)"
+
+
+def test_template_outlives_truncated_form(tmp_path):
+    """Test that a template still populates after its form is truncated."""
+    form_path = tmp_path / "form.pdf"
+    form_path.write_bytes(FORM_PATH.read_bytes())
+    template = pdfpop.pdf.FormTemplate(form_path)
+    rewrite = template.fill({"name": "Ada"})
+    expected = b"".join(pdfpop.pdf.render_form(template, rewrite))
+    with form_path.open("r+b") as f:
+        f.truncate(0)
+    assert b"".join(pdfpop.pdf.render_form(template, rewrite)) == expected
+    populated = template.fill({"name": "Ada"}, incremental=True)
+    data = b"".join(pdfpop.pdf.render_form(template, populated))
+    assert data.startswith(FORM_PATH.read_bytes())
@@ -0,0 +1,167 @@
+"""Collection of tests for pdfpop's HTTP fill service."""
+import http.client
+import json
+import os
+import pathlib
+import socket
+import threading
+
+import pdfrw
+import pytest
+
+import pdfpop.form_config
+import pdfpop.server
+
+
+FORM_PATH = pathlib.Path("examples/example-form.pdf")
+ROW = {"First Name": "Ada", "Last Name": "Lovelace", "Email": "a@b.c"}
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    """Fixture that returns a configuration path for the example form."""
+    form_cfg = pdfpop.form_config.FormConfig(tmp_path / "example.json")
+    form_cfg.data["io"]["form"] = repr(str(FORM_PATH))
+    form_cfg.data["io"]["output_dir"] = repr(str(tmp_path))
+    form_cfg.data["io"]["output_name"] = "'out.pdf'"
+    form_cfg.data["fields"] = {
+        "name [text]": "data['First Name'] + ' ' + data['Last Name']",
+        "EMAIL [text]": "Email",
+    }
+    form_cfg.save()
+    return form_cfg.path
+
+
+@pytest.fixture
+def server(config_path):
+    """Fixture that runs a fill server on a free port."""
+    server = pdfpop.server.make_server(
+        [config_path], port=0, workers=2, queue_limit=2
+    )
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _request(server, method, path, body=None):
+    """Send a request to a server and return its status and body."""
+    connection = http.client.HTTPConnection(*server.server_address)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def _values(pdf_bytes):
+    """Return the field values of a populated PDF."""
+    form = pdfrw.PdfReader(fdata=pdf_bytes)
+    return {
+        annotation.T.to_unicode(): annotation.V.to_unicode()
+        for annotation in form.pages[0].Annots
+        if isinstance(annotation.V, pdfrw.PdfString)
+    }
+
+
+@pytest.mark.parametrize("path", ["/fill", "/fill/example"])
+def test_server_fill(server, path):
+    """Test that a JSON row is populated into the response body."""
+    status, body = _request(server, "POST", path, json.dumps(ROW))
+    assert status == 200
+    assert _values(body) == {"name": "Ada Lovelace", "EMAIL": "a@b.c"}
+
+
+def test_server_health(server):
+    """Test that the health endpoint lists the configurations."""
+    status, body = _request(server, "GET", "/health")
+    assert status == 200
+    assert json.loads(body) == {"status": "ok", "configs": ["example"]}
+
+
+@pytest.mark.parametrize(
+    "method, path, body, expected",
+    [
+        ("POST", "/fill/unknown", "{}", 404),
+        ("POST", "/other", "{}", 404),
+        ("GET", "/fill", None, 404),
+        ("POST", "/fill", "not json", 400),
+        ("POST", "/fill", "[1, 2]", 400),
+        ("POST", "/fill", None, 400),
+    ],
+)
+def test_server_errors(server, method, path, body, expected):
+    """Test that invalid requests are answered with an error status."""
+    status, response = _request(server, method, path, body)
+    assert status == expected
+    assert "error" in json.loads(response)
+
+
+def test_server_fill_error(server, config_path):
+    """Test that a row that fails to populate is answered with 422."""
+    form_cfg = pdfpop.form_config.FormConfig(config_path)
+    form_cfg.load()
+    form_cfg.data["io"]["form"] = "'missing.pdf'"
+    form_cfg.save()
+    stat = config_path.stat()
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    status, body = _request(server, "POST", "/fill", json.dumps(ROW))
+    assert status == 422
+    assert "FileNotFoundError" in json.loads(body)["error"]
+
+
+def test_server_reload(server, config_path):
+    """Test that a modified configuration is loaded again."""
+    form_cfg = pdfpop.form_config.FormConfig(config_path)
+    form_cfg.load()
+    form_cfg.data["fields"]["EMAIL [text]"] = "'changed'"
+    form_cfg.save()
+    stat = config_path.stat()
+    os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    status, body = _request(server, "POST", "/fill", json.dumps(ROW))
+    assert status == 200
+    assert _values(body)["EMAIL"] == "changed"
+
+
+def test_server_queue_full(server):
+    """Test that requests are rejected when the queue is full."""
+    slots = [server._slots.acquire(blocking=False) for _ in range(4)]
+    assert all(slots)
+    try:
+        status, _ = _request(server, "GET", "/health")
+    finally:
+        for _ in slots:
+            server._slots.release()
+    assert status == 503
+    status, _ = _request(server, "GET", "/health")
+    assert status == 200
+
+
+def test_server_unix_socket(config_path, tmp_path):
+    """Test that rows can be populated over a Unix domain socket."""
+    socket_path = tmp_path / "pdfpop.sock"
+    server = pdfpop.server.make_server([config_path], socket_path=socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        body = json.dumps(ROW).encode()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(socket_path))
+            client.sendall(
+                b"POST /fill HTTP/1.0\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            response = b""
+            while chunk := client.recv(65536):
+                response += chunk
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    head, _, pdf_bytes = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.0 200")
+    assert _values(pdf_bytes)["name"] == "Ada Lovelace"
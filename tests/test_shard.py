@@ -0,0 +1,106 @@
+"""Collection of tests for pdfpop's shard module."""
+import pytest
+
+import pdfpop.shard
+
+
+def test_parse():
+    """Test that shards are parsed from `i/N`."""
+    assert pdfpop.shard.parse("2/3") == pdfpop.shard.Shard(2, 3)
+    assert pdfpop.shard.parse(" 1 / 1 ", "Name") == pdfpop.shard.Shard(
+        1, 1, "Name"
+    )
+    assert str(pdfpop.shard.Shard(2, 3)) == "2/3"
+
+
+@pytest.mark.parametrize("spec", ["", "2", "0/3", "4/3", "1/0", "a/b"])
+def test_parse_invalid(spec):
+    """Test that invalid shards are rejected."""
+    with pytest.raises(ValueError):
+        pdfpop.shard.parse(spec)
+
+
+@pytest.mark.parametrize("key", [None, "Name"])
+def test_shards_partition_rows(key):
+    """Test that every row belongs to exactly one shard."""
+    rows = [(idx, {"Name": f"name-{idx % 7}"}) for idx in range(100)]
+    shards = [pdfpop.shard.Shard(index, 3, key) for index in (1, 2, 3)]
+    selected = [list(shard.select(rows)) for shard in shards]
+    assert sorted(sum(selected, [])) == rows
+    assert all(selected)
+
+
+def test_shard_key_is_stable():
+    """Test that rows with the same key land in the same, stable shard."""
+    shard = pdfpop.shard.Shard(1, 4, "Name")
+    assert shard.contains(0, {"Name": "a"}) == shard.contains(9, {"Name": "a"})
+    # The assignment must not change between processes or versions.
+    assert [
+        index
+        for index in range(1, 5)
+        if pdfpop.shard.Shard(index, 4, "Name").contains(0, {"Name": "a"})
+    ] == [3]
+
+
+def _status(tmp_path, index, count=2, rows=(), total=None, **header):
+    """Write a status manifest and return its path."""
+    path = tmp_path / f"status-{index}.jsonl"
+    status = pdfpop.shard.StatusManifest(
+        path, pdfpop.shard.Shard(index, count), header
+    )
+    for row, state in rows:
+        error = "boom" if state == "failed" else None
+        status.record(row - 1, state, error=error)
+    if total is not None:
+        status.finish(total)
+    status.close()
+    return path
+
+
+def test_combine(tmp_path):
+    """Test that the rows of every shard are combined."""
+    combined = pdfpop.shard.combine(
+        [
+            _status(
+                tmp_path, 1, rows=[(1, "populated"), (3, "failed")], total=4
+            ),
+            _status(tmp_path, 2, rows=[(2, "skipped")]),
+        ]
+    )
+    assert combined.shards == 2
+    assert combined.total == 4
+    assert combined.missing == [4]
+    assert combined.with_status("failed") == [3]
+    assert combined.rows[3]["error"] == "boom"
+    assert combined.missing_shards == []
+    assert combined.unfinished_shards == [2]
+
+
+def test_combine_missing_shard(tmp_path):
+    """Test that shards without a status manifest are reported."""
+    combined = pdfpop.shard.combine(
+        [_status(tmp_path, 2, count=3, rows=[(2, "populated")], total=3)]
+    )
+    assert combined.missing_shards == [1, 3]
+    assert combined.missing == [1, 3]
+
+
+def test_combine_other_run(tmp_path):
+    """Test that manifests of different runs are not combined."""
+    with pytest.raises(RuntimeError, match="from another run"):
+        pdfpop.shard.combine(
+            [
+                _status(tmp_path, 1, config_digest="a"),
+                _status(tmp_path, 2, config_digest="b"),
+            ]
+        )
+    with pytest.raises(RuntimeError, match="given twice"):
+        pdfpop.shard.combine([_status(tmp_path, 1)] * 2)
+
+
+def test_combine_not_a_status_manifest(tmp_path):
+    """Test that other files are rejected."""
+    path = tmp_path / "other.jsonl"
+    path.write_text('{"row": 1}\n')
+    with pytest.raises(RuntimeError, match="not a pdfpop status manifest"):
+        pdfpop.shard.combine([path])